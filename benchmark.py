@@ -0,0 +1,560 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from fake_llm_server import NAME_RE, FakeLLMServer
+
+# Stages in pipeline order -> unit counted for throughput
+STAGES = {
+    "preprocess": "rows",
+    "wordcloud": "rows",
+    "translate": "rows",
+    "build_graph": "chunks",
+    "retriever": "rows",
+    "zero_shot": "rows",
+    "few_shot": "rows",
+    "few_shot_rag": "rows",
+    "grasp_choq": "rows",
+    "cascade": "rows",
+}
+
+# Classifier stages -> stance_runner strategy
+CLASSIFIER_STAGES = {
+    "zero_shot": "zero_shot",
+    "few_shot": "few_shot",
+    "few_shot_rag": "few_shot_rag",
+    "grasp_choq": "grasp_choq",
+}
+
+ENTITIES = [
+    "Sheikh Hasina", "Awami League", "Muhammad Yunus", "Khaleda Zia", "Chhatra League",
+    "Jamaat", "Interim Government", "Dhaka University", "Election Commission", "Tarique Rahman",
+]
+RELATIONS = ["LEADER_OF", "MEMBER_OF", "OPPOSES", "SUPPORTS", "CRITICIZED", "VISITED", "STUDENT_WING", "ALLY_OF"]
+TEMPLATES = [
+    "{a} criticized {b} over the handling of the protests in Dhaka today",
+    "Supporters of {a} rallied against {b} demanding a fair election",
+    "{a} met with {b} to discuss the interim arrangements and reforms",
+    "Why is {a} silent while {b} keeps attacking students across the country",
+    "{a} thanked {b} for standing with the people during the crisis",
+]
+BIOS = ["Proud supporter of Awami League", "BNP activist", "Journalist and photographer", "Student at Dhaka University"]
+
+
+def synthetic_corpus(n, seed=0):
+    """
+    BPDisC-shaped tweets: the columns the pipeline reads (Content, translation,
+    label, info_from_graph, user_bio, has_image) plus the scraper metadata.
+    The same `n` and `seed` always give the same corpus.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, len(ENTITIES), n)
+    b = (a + rng.integers(1, len(ENTITIES), n)) % len(ENTITIES)
+    templates = rng.integers(0, len(TEMPLATES), n)
+    texts = [TEMPLATES[t].format(a=ENTITIES[i], b=ENTITIES[j]) + f" #{k}" for k, (t, i, j) in enumerate(zip(templates, a, b))]
+    relations = rng.integers(0, len(RELATIONS), n)
+    return pd.DataFrame({
+        "label": rng.integers(0, 2, n),
+        "info_from_graph": [f"{ENTITIES[i]} - {RELATIONS[r]} -> {ENTITIES[j]}" for i, j, r in zip(a, b, relations)],
+        "translation": texts,
+        "Name": [f"User {k % 97}" for k in range(n)],
+        "Handle": [f"@user{k % 97}" for k in range(n)],
+        "Timestamp": pd.Timestamp("2024-10-01") + pd.to_timedelta(rng.integers(0, 30 * 86400, n), unit="s"),
+        "Verified": rng.integers(0, 2, n),
+        "Content": [f"[bn] {text}" for text in texts],
+        "Tags": [f"['#{ENTITIES[i].replace(' ', '')}']" for i in a],
+        "Mentions": "[]",
+        "Tweet ID": [f"tweet_id:{1850000000000000000 + k}" for k in range(n)],
+        "user_bio": [BIOS[k % len(BIOS)] for k in range(n)],
+        "has_image": rng.random(n) < 0.1,
+    })
+
+
+class HashingEmbeddings:
+    """Deterministic bag-of-words embeddings so vector search runs without a model."""
+
+    def __init__(self, dim=64):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in str(text).lower().split():
+            vector[zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+        return (vector / max(np.linalg.norm(vector), 1e-12)).tolist()
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+
+def synthetic_graph(n_nodes=500, n_edges=2000, n_documents=1000, seed=0):
+    """In-memory LocalGraph over the synthetic entities, standing in for Neo4j."""
+    from local_graph import LocalGraph
+
+    rng = np.random.default_rng(seed)
+    node_ids = ENTITIES + [f"Entity {i}" for i in range(max(0, n_nodes - len(ENTITIES)))]
+    embeddings = HashingEmbeddings()
+    texts = [
+        TEMPLATES[t].format(a=node_ids[i], b=node_ids[j])
+        for t, i, j in zip(rng.integers(0, len(TEMPLATES), n_documents),
+                           rng.integers(0, len(node_ids), n_documents),
+                           rng.integers(0, len(node_ids), n_documents))
+    ]
+    return LocalGraph(
+        node_ids,
+        rng.integers(0, len(node_ids), n_edges),
+        rng.integers(0, len(node_ids), n_edges),
+        rng.integers(0, len(RELATIONS), n_edges),
+        RELATIONS,
+        texts,
+        embeddings.embed_documents(texts),
+        embeddings=embeddings,
+    )
+
+
+def _chunks(df, rows):
+    return [df.iloc[start:start + rows] for start in range(0, len(df), rows)]
+
+
+def _timed(latencies, fn):
+    start = time.perf_counter()
+    result = fn()
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+# Each bench_* function does its imports and setup untimed and returns the
+# timed part: a callable returning (items processed, per-call latencies)
+
+def bench_preprocess(df, workdir, config):
+    import preprocess
+
+    chunks = _chunks(df, config["batch_rows"])
+
+    def run():
+        latencies = []
+        for chunk in chunks:
+            _timed(latencies, lambda: preprocess.preprocess_twitter_dataset(chunk))
+        return len(df), latencies
+    return run
+
+
+def bench_wordcloud(df, workdir, config):
+    import entities
+
+    paths = []
+    for i, chunk in enumerate(_chunks(df, config["batch_rows"])):
+        paths.append(os.path.join(workdir, f"chunk_{i}.parquet"))
+        chunk.to_parquet(paths[-1], index=False)
+
+    def run():
+        latencies = []
+        for path in paths:
+            _timed(latencies, lambda: entities.generate_wordcloud_and_csv(path, "translation", path + ".csv"))
+        return len(df), latencies
+    return run
+
+
+def bench_translate(df, workdir, config):
+    import translation
+
+    rows = list(df["Content"].items())
+    translate_tweet_async = translation.translate_tweet_async
+
+    def run():
+        latencies = []
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await translate_tweet_async(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        # translate_rows_async looks the function up at call time, so each request is timed
+        translation.translate_tweet_async = timed
+        try:
+            translations = asyncio.run(translation.translate_rows_async(
+                rows,
+                concurrency=config["concurrency"],
+                requests_per_second=config["requests_per_second"],
+            ))
+        finally:
+            translation.translate_tweet_async = translate_tweet_async
+        return len(translations), latencies
+    return run
+
+
+def bench_build_graph(df, workdir, config):
+    """
+    Pipelined ingestion (graph_ingestion.ingest_entities, as used by
+    build_knowledge_graph_pipelined) with Wikipedia replaced by articles built
+    from the corpus, extraction by one fake LLM call per chunk and Neo4j by a list.
+    """
+    from langchain_core.documents import Document
+    from openai import AsyncOpenAI
+    from graph_ingestion import ingest_entities
+    from rate_limiter import TokenBucket, call_with_retries_async
+
+    # One article per entity, sized so larger corpora ingest proportionally more chunks
+    words_per_article = max(64, len(df) * 64 // len(ENTITIES))
+    articles = {}
+    for name in ENTITIES:
+        rows = df[df["translation"].str.contains(name, regex=False)]["translation"]
+        articles[name] = " ".join(" ".join(rows).split()[:words_per_article]) or name
+
+    def run():
+        client = AsyncOpenAI(base_url=os.environ["OPENROUTER_BASE_URL"], api_key="bench", max_retries=0)
+        limiter = TokenBucket(config["requests_per_second"], capacity=max(1.0, config["requests_per_second"]))
+        memory_graph = []
+        latencies = []
+
+        def load_documents(name):
+            return [Document(page_content=articles[name], metadata={"title": name})]
+
+        def split_documents(documents):
+            words = documents[0].page_content.split()
+            return [Document(page_content=" ".join(words[start:start + 64])) for start in range(0, len(words), 48)]
+
+        async def extract_graph(chunks):
+            start = time.perf_counter()
+            text = chunks[0].page_content
+            await call_with_retries_async(lambda: client.chat.completions.create(
+                model="gpt-4o",
+                messages=[{"role": "user", "content": f"Extract entities and relationships:\n{text}"}],
+                temperature=0,
+            ), limiter=limiter)
+            latencies.append(time.perf_counter() - start)
+            names = list(dict.fromkeys(NAME_RE.findall(text)))
+            return [{"nodes": names, "relationships": list(zip(names, names[1:])), "source": text}]
+
+        stats = asyncio.run(ingest_entities(
+            ENTITIES,
+            load_documents=load_documents,
+            split_documents=split_documents,
+            extract_graph=extract_graph,
+            write_graph=memory_graph.extend,
+            extract_concurrency=config["concurrency"],
+        ))
+        return stats["chunks"], latencies
+    return run
+
+
+def bench_retriever(df, workdir, config):
+    """retrieve_from_graph.retriever over a synthetic LocalGraph with the gazetteer extractor."""
+    from entity_extractor import GazetteerExtractor
+    import retrieve_from_graph
+
+    backend = synthetic_graph(seed=config["seed"])
+    extractor = GazetteerExtractor.from_local_graph(backend)
+    questions = df["translation"].tolist()
+
+    def run():
+        latencies = []
+        for question in questions:
+            _timed(latencies, lambda: retrieve_from_graph.retriever(question, backend=backend, extractor=extractor))
+        return len(questions), latencies
+    return run
+
+
+def bench_classifier(stage):
+    def bench(df, workdir, config):
+        import importlib
+        from stance_runner import STRATEGIES, build_inputs, run_strategy_async
+
+        strategy = CLASSIFIER_STAGES[stage]
+        # Build the shared chat model outside the timed run
+        importlib.import_module(STRATEGIES[strategy][0]).get_llm()
+        rows = [
+            (index, build_inputs(row, context_column="info_from_graph"), row["label"])
+            for index, row in df.iterrows()
+        ]
+
+        def run():
+            results = asyncio.run(run_strategy_async(
+                rows,
+                strategy,
+                os.path.join(workdir, f"{stage}.jsonl"),
+                concurrency=config["concurrency"],
+                requests_per_second=config["requests_per_second"],
+            ))
+            ok = results[results["stance"].notna()] if "stance" in results else results.iloc[0:0]
+            return len(ok), results["latency"].tolist()
+        return run
+    return bench
+
+
+def bench_cascade(df, workdir, config):
+    import importlib
+    from cascade import DEFAULT_STAGES, classify_cascade_async
+    from stance_runner import STRATEGIES, build_inputs, run_strategy_async
+
+    for strategy in DEFAULT_STAGES:
+        importlib.import_module(STRATEGIES[strategy][0]).get_llm()
+    rows = [
+        (index, build_inputs(row, context_column="info_from_graph"), row["label"])
+        for index, row in df.iterrows()
+    ]
+
+    def run():
+        results = asyncio.run(run_strategy_async(
+            rows,
+            "cascade",
+            os.path.join(workdir, "cascade.jsonl"),
+            concurrency=config["concurrency"],
+            requests_per_second=config["requests_per_second"],
+            classify=classify_cascade_async,
+        ))
+        ok = results[results["stance"].notna()] if "stance" in results else results.iloc[0:0]
+        return len(ok), results["latency"].tolist()
+    return run
+
+
+STAGE_FUNCTIONS = {
+    "preprocess": bench_preprocess,
+    "wordcloud": bench_wordcloud,
+    "translate": bench_translate,
+    "build_graph": bench_build_graph,
+    "retriever": bench_retriever,
+    **{stage: bench_classifier(stage) for stage in CLASSIFIER_STAGES},
+    "cascade": bench_cascade,
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(stage, size, config):
+    """
+    Run one stage on a synthetic corpus of `size` rows and measure it.
+    Meant to run in a fresh process so peak RSS belongs to this stage alone.
+
+    Returns:
+    dict: items processed, rows/sec, latency quantiles and peak RSS, or the
+          reason the stage was skipped or failed
+    """
+    os.environ.update(config["env"])
+    # Stages import the repository's modules after the chdir below, so '' on sys.path
+    # (python -c, notebooks) would no longer find them
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    if repo_dir not in sys.path:
+        sys.path.insert(0, repo_dir)
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.environ["DATASET_CACHE_DIR"] = os.path.join(workdir, ".dataset_cache")
+    cwd = os.getcwd()
+    result = {"stage": stage, "size": size, "unit": STAGES[stage]}
+    try:
+        os.chdir(workdir)
+        df = synthetic_corpus(size, seed=config["seed"])
+        # Stage functions print progress per row; keep the benchmark output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            run = STAGE_FUNCTIONS[stage](df, workdir, config)
+            start = time.perf_counter()
+            items, latencies = run()
+            wall = time.perf_counter() - start
+        latencies = np.asarray(latencies, dtype=float)
+        result.update({
+            "status": "ok",
+            "items": items,
+            "wall_seconds": round(wall, 4),
+            "items_per_second": round(items / wall, 2) if wall > 0 else None,
+            "latency_count": int(latencies.size),
+            "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3) if latencies.size else None,
+            "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3) if latencies.size else None,
+        })
+    except Exception as e:
+        status = "skipped" if is_missing_dependency(e) else "error"
+        result.update({"status": status, "reason": f"{type(e).__name__}: {e}"})
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return result
+
+
+def is_missing_dependency(error):
+    """
+    True when `error` is a third-party package that is not installed. A broken
+    import of one of the repository's own modules is an error, not a skip.
+    """
+    if not isinstance(error, ModuleNotFoundError) or not error.name:
+        return False
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    return not os.path.exists(os.path.join(repo_dir, error.name.split(".")[0] + ".py"))
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(stages=tuple(STAGES), sizes=(100, 1000), latency=0.05, jitter=0.02, rate_limit=200.0,
+                  error_rate=0.01, concurrency=16, requests_per_second=100.0, batch_rows=1000, seed=0,
+                  isolate=True):
+    """
+    Run every stage on synthetic corpora of each size against a local fake LLM server.
+
+    Parameters:
+    stages (iterable): Stage names from STAGES
+    sizes (iterable): Corpus sizes in rows
+    latency, jitter, rate_limit, error_rate: Fake server behaviour (see FakeLLMServer)
+    concurrency (int): Requests in flight for LLM stages
+    requests_per_second (float): Client-side rate limit for LLM stages
+    batch_rows (int): Rows per timed call for the batch stages (preprocess, wordcloud)
+    seed (int): Seed for corpora, graph and fault injection
+    isolate (bool): Run each case in a fresh process so peak RSS is per stage
+
+    Returns:
+    dict: Run metadata and one result per (stage, size)
+    """
+    server = FakeLLMServer(latency=latency, jitter=jitter, rate_limit=rate_limit, error_rate=error_rate, seed=seed)
+    config = {
+        "concurrency": concurrency,
+        "requests_per_second": requests_per_second,
+        "batch_rows": batch_rows,
+        "seed": seed,
+        "env": {
+            "OPENROUTER_BASE_URL": server.url,
+            "OPENROUTER_API_KEY": "bench",
+            # ChatOpenAI builds its own async client from these
+            "OPENAI_API_BASE": server.url,
+            "OPENAI_API_KEY": "bench",
+            "LLM_CACHE_MODE": "off",
+            "MPLBACKEND": "Agg",
+        },
+    }
+    results = []
+    with server:
+        for stage in stages:
+            for size in sizes:
+                before = dict(server.stats)
+                if isolate:
+                    context = multiprocessing.get_context("spawn")
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                        result = pool.submit(run_case, stage, size, config).result()
+                else:
+                    result = run_case(stage, size, config)
+                result["server"] = {key: server.stats[key] - before[key] for key in before}
+                results.append(result)
+                print(format_result(result))
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "latency": latency, "jitter": jitter, "rate_limit": rate_limit, "error_rate": error_rate,
+                "concurrency": concurrency, "requests_per_second": requests_per_second,
+                "batch_rows": batch_rows, "seed": seed, "isolate": isolate,
+            },
+        },
+        "results": results,
+    }
+
+
+def format_result(result):
+    if result["status"] != "ok":
+        return f"{result['stage']:<13} {result['size']:>7}  {result['status']}: {result['reason']}"
+    p50 = f"{result['p50_ms']:.1f}" if result["p50_ms"] is not None else "-"
+    p99 = f"{result['p99_ms']:.1f}" if result["p99_ms"] is not None else "-"
+    return (f"{result['stage']:<13} {result['size']:>7}  {result['items_per_second']:>9.1f} {result['unit']}/s"
+            f"  p50 {p50:>8} ms  p99 {p99:>8} ms  peak RSS {result['peak_rss_mb']:.0f} MB")
+
+
+def compare_results(baseline, current, tolerance=0.1):
+    """
+    Regressions of `current` against `baseline` beyond `tolerance` (a fraction):
+    lower throughput, higher p99 latency or higher peak RSS. A case that was ok
+    in the baseline and now errors or is skipped is a 'status' regression.
+
+    Returns:
+    list: (stage, size, metric, baseline value, current value) tuples
+    """
+    previous = {(r["stage"], r["size"]): r for r in baseline["results"] if r.get("status") == "ok"}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get((result["stage"], result["size"]))
+        if before is None:
+            continue
+        if result.get("status") != "ok":
+            regressions.append((result["stage"], result["size"], "status", "ok",
+                                f"{result.get('status')} ({result.get('reason')})"))
+            continue
+        for metric, higher_is_better in (("items_per_second", True), ("p99_ms", False), ("peak_rss_mb", False)):
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append((result["stage"], result["size"], metric, old, new))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline throughput and latency benchmark for every pipeline stage.")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean fake LLM latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--rate-limit", type=float, default=200.0, help="Fake server requests/sec before 429s")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="Fraction of fake 500 responses")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests-per-second", type=float, default=100.0)
+    parser.add_argument("--batch-rows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-isolate", action="store_true", help="Run every case in this process")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        stages=args.stages,
+        sizes=args.sizes,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        error_rate=args.error_rate,
+        concurrency=args.concurrency,
+        requests_per_second=args.requests_per_second,
+        batch_rows=args.batch_rows,
+        seed=args.seed,
+        isolate=not args.no_isolate,
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Results saved to '{args.output}'")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare_results(json.load(f), report, tolerance=args.tolerance)
+        for stage, size, metric, old, new in regressions:
+            print(f"REGRESSION {stage} ({size} rows): {metric} {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against '{args.compare}'")
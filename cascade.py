@@ -0,0 +1,564 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import time
+from collections import Counter
+import numpy as np
+import pandas as pd
+import tracing
+from example_store import held_out_rows
+from llm_cache import cached_completion_async
+from rate_limiter import call_with_retries_async
+from stance_runner import (
+    STRATEGIES, build_strategy_messages, find_stance, label_stance, load_rows, parse_stance,
+    prefetch_strategy_examples, run_strategy_async, summarize, usage_counts
+)
+
+# Strategies tried in order, cheapest first; a tweet stops at the first confident answer
+DEFAULT_STAGES = ("zero_shot", "few_shot_rag", "grasp_choq")
+
+# Minimum confidence at which a stage's answer is accepted; the last stage always answers.
+# Conservative until tune_thresholds has been run on labeled data
+DEFAULT_THRESHOLDS = {"zero_shot": 0.95, "few_shot_rag": 0.9}
+
+# Stages whose prompts read retrieved graph context
+CONTEXT_STAGES = {"few_shot_rag", "grasp_choq"}
+
+# "logprobs" reads the stance token probability and falls back to votes when the
+# provider returns no logprobs; "votes" always samples `votes` answers
+CONFIDENCE_MODES = ("logprobs", "votes")
+TOP_LOGPROBS = 5
+VOTE_TEMPERATURE = 0.7
+
+# Candidate thresholds searched by tune_thresholds; inf never accepts the stage
+THRESHOLD_GRID = tuple(np.round(np.linspace(0.5, 1.0, 26), 2)) + (math.inf,)
+
+USAGE_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+def _token_stance(token, min_length=1):
+    # FAVOR or AGAINST when the token starts one of the stance words (markdown emphasis aside)
+    token = token.strip().lower().lstrip("*_`'\"")
+    if len(token) < min_length:
+        return None
+    if "favor".startswith(token) or "favour".startswith(token):
+        return "FAVOR"
+    if "against".startswith(token):
+        return "AGAINST"
+    return None
+
+
+def logprob_confidence(logprobs):
+    """
+    Stance and confidence from the token logprobs of one answer.
+
+    The scored token is the one holding the verdict word that parse_stance
+    reads (after the final 'Stance:' marker, or the last stance word), not a
+    stance word inside the reasoning. Its confidence is the probability of
+    that stance relative to both stances among the top alternatives at that
+    position.
+
+    Parameters:
+    logprobs (dict): OpenAI `logprobs` of a choice ({"content": [...]})
+
+    Returns:
+    tuple: (stance, confidence), or (None, None) when the verdict is not a stance token
+    """
+    positions = (logprobs or {}).get("content") or []
+    _, offset = find_stance("".join(position.get("token", "") for position in positions))
+    if offset is None:
+        return None, None
+    end = 0
+    for position in positions:
+        token = position.get("token", "")
+        end += len(token)
+        # The token that contains the first character of the verdict word
+        if end <= offset:
+            continue
+        stance = _token_stance(token, min_length=2)
+        if stance is None:
+            return None, None
+        mass = {"FAVOR": 0.0, "AGAINST": 0.0}
+        for alternative in position.get("top_logprobs") or [position]:
+            other = _token_stance(alternative.get("token", ""))
+            if other is not None:
+                mass[other] += math.exp(alternative["logprob"])
+        total = mass["FAVOR"] + mass["AGAINST"]
+        return stance, (mass[stance] / total if total > 0 else math.exp(position["logprob"]))
+    return None, None
+
+
+def vote_confidence(answers):
+    """
+    Majority stance of several sampled answers and the share of answers that
+    agree with it; answers without a stance count against the majority.
+
+    Returns:
+    tuple: (stance, confidence), or (None, 0.0) when no answer has a stance
+    """
+    stances = Counter(stance for stance in map(parse_stance, answers) if stance is not None)
+    if not stances:
+        return None, 0.0
+    stance, count = stances.most_common(1)[0]
+    return stance, count / len(answers)
+
+
+async def score_async(strategy, inputs, confidence="logprobs", votes=5, limiter=None, max_retries=5):
+    """
+    Classify one row with `strategy` and measure how sure the model is.
+
+    In "logprobs" mode one answer is requested with token logprobs. When the
+    provider returns none, or they disagree with the answer text, `votes`
+    answers are sampled at VOTE_TEMPERATURE (self-consistency) and the
+    majority share is the confidence. Results go through the response cache,
+    together with the token usage of the requests that produced them.
+
+    Returns:
+    dict: raw answer, stance, confidence, confidence method, token counts
+          spent by this call (zero on a cache hit), cache_hit and tokens, the
+          prompt plus completion tokens the answer cost when it was computed
+          (None for cache entries stored without usage)
+    """
+    module, messages = build_strategy_messages(strategy, inputs)
+    llm = module.get_llm()
+    counts = dict.fromkeys(USAGE_KEYS, 0)
+    computed = False
+
+    async def sample(n, **params):
+        # One request for `n` completions; usage is reported once per request
+        async def generate():
+            return await llm.agenerate([messages], n=n, **params)
+        result = await call_with_retries_async(generate, max_retries=max_retries, limiter=limiter)
+        generations = result.generations[0]
+        if generations:
+            message = generations[0].message
+            for key, value in usage_counts(message).items():
+                counts[key] += value
+            tracing.add_usage(message)
+        return generations
+
+    async def request():
+        nonlocal computed
+        computed = True
+        answers = []
+        if confidence == "logprobs":
+            generations = await sample(1, logprobs=True, top_logprobs=TOP_LOGPROBS)
+            answers.append(generations[0].text)
+            stance, score = logprob_confidence((generations[0].generation_info or {}).get("logprobs"))
+            if score is not None and stance == parse_stance(answers[0]):
+                return {"answers": answers, "stance": stance, "confidence": score, "method": "logprobs",
+                        "usage": dict(counts)}
+        # Providers that ignore `n` return one answer per request, so ask again until there are enough
+        while len(answers) < votes:
+            generations = await sample(votes - len(answers), temperature=VOTE_TEMPERATURE)
+            if not generations:
+                break
+            answers.extend(generation.text for generation in generations)
+        stance, score = vote_confidence(answers)
+        return {"answers": answers, "stance": stance, "confidence": score, "method": "votes", "usage": dict(counts)}
+
+    with tracing.span("llm.classify", strategy=strategy, confidence=confidence) as span:
+        result = await cached_completion_async(
+            llm.model_name,
+            messages,
+            {"temperature": llm.temperature, "confidence": confidence, "votes": votes},
+            request
+        )
+        span.set("method", result["method"])
+    usage = result.get("usage")
+    return {
+        "tokens": usage["prompt_tokens"] + usage["completion_tokens"] if usage else None,
+        "raw": result["answers"][0] if result["answers"] else None,
+        "stance": result["stance"],
+        "confidence": result["confidence"],
+        "method": result["method"],
+        "cache_hit": not computed,
+        **counts,
+    }
+
+
+async def _with_context(inputs, retrieve):
+    # Retrieved graph context replaces the dataset's context columns
+    with tracing.span("cascade.retrieve"):
+        relational_text, unstructured_data = await asyncio.to_thread(retrieve, inputs["tweet"])
+    return {**inputs, "context": relational_text, "relational_text": relational_text,
+            "unstructured_data": unstructured_data}
+
+
+async def classify_cascade_async(inputs, stages=DEFAULT_STAGES, thresholds=None, retrieve=None,
+                                 confidence="logprobs", votes=5, limiter=None, max_retries=5):
+    """
+    Classify one row with the cheapest stage that is confident enough.
+
+    Stages run in order; a stance whose confidence reaches the stage's
+    threshold is returned, otherwise the row escalates to the next stage. The
+    last stage always answers. With `retrieve` (tweet -> (relational_text,
+    unstructured_data), e.g. grasp_pipeline.make_retrieve), graph context is
+    fetched only when a row first reaches a stage in CONTEXT_STAGES.
+
+    Parameters:
+    inputs (dict): Prompt variables from stance_runner.build_inputs
+    stages (tuple): Strategy names from stance_runner.STRATEGIES, cheapest first
+    thresholds (dict): Strategy -> minimum confidence; stages without one always escalate
+
+    Returns:
+    dict: Final stance and answer, the stage that answered (exit_stage), the
+          number of escalations, per-stage stances and confidences (path) and
+          token counts summed over all stages
+    """
+    thresholds = DEFAULT_THRESHOLDS if thresholds is None else thresholds
+    totals = dict.fromkeys(USAGE_KEYS, 0)
+    path = []
+    retrieved = False
+    cache_hit = True
+    with tracing.span("cascade.classify") as span:
+        for index, strategy in enumerate(stages):
+            if retrieve is not None and strategy in CONTEXT_STAGES and not retrieved:
+                inputs = await _with_context(inputs, retrieve)
+                retrieved = True
+            result = await score_async(strategy, inputs, confidence=confidence, votes=votes,
+                                       limiter=limiter, max_retries=max_retries)
+            for key in USAGE_KEYS:
+                totals[key] += result[key]
+            cache_hit = cache_hit and result["cache_hit"]
+            path.append({"strategy": strategy, "stance": result["stance"], "confidence": result["confidence"]})
+            if result["stance"] is not None and result["confidence"] >= thresholds.get(strategy, math.inf):
+                break
+        span.set("exit_stage", strategy)
+        span.set("escalations", index)
+    return {
+        "raw": result["raw"],
+        "stance": result["stance"],
+        "confidence": result["confidence"],
+        "exit_stage": strategy,
+        "escalations": index,
+        "path": path,
+        "cache_hit": cache_hit,
+        **totals,
+    }
+
+
+async def score_all_stages_async(inputs, stages=DEFAULT_STAGES, retrieve=None, confidence="logprobs", votes=5,
+                                 limiter=None, max_retries=5):
+    """
+    Run every stage on one row, for tuning. Returns the last stage's stance
+    and the per-stage stance, confidence and token count (path).
+    """
+    if retrieve is not None and CONTEXT_STAGES.intersection(stages):
+        inputs = await _with_context(inputs, retrieve)
+    results = await asyncio.gather(*(
+        score_async(strategy, inputs, confidence=confidence, votes=votes, limiter=limiter, max_retries=max_retries)
+        for strategy in stages
+    ))
+    path = [{
+        "strategy": strategy,
+        "stance": result["stance"],
+        "confidence": result["confidence"],
+        "tokens": result["tokens"],
+    } for strategy, result in zip(stages, results)]
+    return {
+        "raw": results[-1]["raw"],
+        "stance": results[-1]["stance"],
+        "path": path,
+        "cache_hit": all(result["cache_hit"] for result in results),
+        **{key: sum(result[key] for result in results) for key in USAGE_KEYS},
+    }
+
+
+def stage_table(results, stages=DEFAULT_STAGES):
+    """
+    One row per tuning record with its label and '<stage>_stance',
+    '<stage>_confidence' and '<stage>_tokens' columns, from the `path` of
+    score_all_stages_async results.
+    """
+    rows = []
+    for record in results.to_dict("records"):
+        path = record.get("path")
+        if not isinstance(path, list):
+            continue
+        row = {"row": record["row"], "label": record.get("label")}
+        for step in path:
+            for key in ("stance", "confidence", "tokens"):
+                row[f"{step['strategy']}_{key}"] = step.get(key)
+        rows.append(row)
+    columns = ["row", "label"] + [f"{stage}_{key}" for stage in stages for key in ("stance", "confidence", "tokens")]
+    return pd.DataFrame(rows).reindex(columns=columns)
+
+
+def tune_thresholds(table, stages=DEFAULT_STAGES, max_accuracy_drop=0.0, grid=THRESHOLD_GRID):
+    """
+    Choose per-stage confidence thresholds on labeled data.
+
+    Every combination of thresholds from `grid` for the stages before the last
+    is simulated on the table. The chosen combination has the lowest mean
+    token cost per tweet among those whose accuracy is at most
+    `max_accuracy_drop` below running only the last stage. Ties go to the
+    more accurate combination. The cost of a stage is its mean prompt plus
+    completion tokens over the rows with a recorded count. Cached answers
+    carry the usage of the request that computed them; a stage with no
+    recorded count at all raises ValueError, because its cost is unknown.
+
+    Parameters:
+    table (DataFrame): Output of stage_table
+    stages (tuple): Cascade stages, cheapest first
+    max_accuracy_drop (float): Accuracy the cascade may lose relative to the last stage
+    grid (iterable): Candidate thresholds
+
+    Returns:
+    dict: thresholds, accuracy, reference_accuracy, mean_tokens,
+          reference_tokens, exit_rates per stage and rows
+    """
+    labels = table["label"].map(label_stance)
+    table = table[labels.notna()]
+    labels = labels[labels.notna()].to_numpy()
+    if not len(table):
+        raise ValueError("No labeled rows to tune on")
+
+    correct = np.stack([(table[f"{stage}_stance"] == labels).to_numpy() for stage in stages])
+    answered = np.stack([table[f"{stage}_stance"].notna().to_numpy() for stage in stages])
+    scores = np.stack([table[f"{stage}_confidence"].astype(float).fillna(-1.0).to_numpy() for stage in stages])
+    costs = []
+    for stage in stages:
+        tokens = table[f"{stage}_tokens"].astype(float)
+        # Zero is what tuning records written before usage was cached hold for cache hits
+        tokens = tokens[tokens > 0]
+        if not len(tokens):
+            raise ValueError(
+                f"No token counts recorded for stage '{stage}'. Its answers come from cache entries stored "
+                f"without usage; re-run tuning with LLM_CACHE_MODE=off or a fresh cache and tuning file"
+            )
+        costs.append(tokens.mean())
+    # Cost of exiting at stage i includes every stage before it
+    exit_costs = np.cumsum(costs)
+    columns = np.arange(len(table))
+    reference_accuracy = correct[-1].mean()
+
+    best = None
+    for combination in itertools.product(grid, repeat=len(stages) - 1):
+        accepted = answered[:-1] & (scores[:-1] >= np.array(combination)[:, None])
+        exits = np.where(accepted.any(axis=0), accepted.argmax(axis=0), len(stages) - 1)
+        accuracy = correct[exits, columns].mean()
+        if accuracy < reference_accuracy - max_accuracy_drop - 1e-12:
+            continue
+        mean_tokens = exit_costs[exits].mean()
+        if best is None or (mean_tokens, -accuracy) < (best["mean_tokens"], -best["accuracy"]):
+            best = {
+                "thresholds": {stage: float(value) for stage, value in zip(stages, combination)},
+                "accuracy": float(accuracy),
+                "mean_tokens": float(mean_tokens),
+                "exit_rates": {stage: float((exits == i).mean()) for i, stage in enumerate(stages)},
+            }
+    # The combination that never accepts an early stage always qualifies, so best is set
+    best.update({
+        "stages": list(stages),
+        "reference_accuracy": float(reference_accuracy),
+        "reference_tokens": float(exit_costs[-1]),
+        "rows": int(len(table)),
+    })
+    return best
+
+
+def save_thresholds(tuned, path, **settings):
+    """Write tune_thresholds output, plus the settings it was tuned with, to JSON"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({**tuned, **settings}, f, indent=2, default=str)
+
+
+def load_thresholds(path):
+    """
+    Read thresholds written by save_thresholds. JSON infinity is kept, so a
+    stage tuned to never accept keeps escalating.
+
+    Returns:
+    dict: With at least 'stages' and 'thresholds'
+    """
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _check_stages(stages):
+    unknown = [stage for stage in stages if stage not in STRATEGIES]
+    if unknown:
+        raise ValueError(f"Unknown strategies {unknown}; choose from {list(STRATEGIES)}")
+    if len(stages) < 2:
+        raise ValueError("A cascade needs at least two stages")
+
+
+def tune_cascade(input_file, output_file="cascade_thresholds.json", stages=DEFAULT_STAGES, sample=300, seed=0,
+                 predictions_dir="predictions", retrieve=None, confidence="logprobs", votes=5,
+                 max_accuracy_drop=0.0, text_column="translation", context_column="info_from_graph",
+                 label_column="label", id_column=None, concurrency=16, requests_per_second=5.0, max_retries=5):
+    """
+    Run every stage on a labeled sample, tune the thresholds and save them to `output_file`.
+    Per-row stage outputs go to '<predictions_dir>/cascade_tuning.jsonl', so an
+    interrupted run resumes and re-tuning with another accuracy target makes no
+    new requests.
+
+    Returns:
+    dict: tune_thresholds output
+    """
+    _check_stages(stages)
+    rows = held_out_rows(load_rows(input_file, text_column, context_column, label_column, id_column),
+                         input_file, id_column)
+    rows = [row for row in rows if label_stance(row[2]) is not None]
+    if sample and len(rows) > sample:
+        rows = random.Random(seed).sample(rows, sample)
+    print(f"Tuning {' -> '.join(stages)} on {len(rows)} labeled tweets")
+
+    os.makedirs(predictions_dir, exist_ok=True)
+    for stage in stages:
+        prefetch_strategy_examples(stage, rows)
+
+    def classify(inputs, limiter, max_retries):
+        return score_all_stages_async(inputs, stages=stages, retrieve=retrieve, confidence=confidence, votes=votes,
+                                      limiter=limiter, max_retries=max_retries)
+
+    results = asyncio.run(run_strategy_async(
+        rows,
+        "cascade_tuning",
+        os.path.join(predictions_dir, "cascade_tuning.jsonl"),
+        concurrency=concurrency,
+        requests_per_second=requests_per_second,
+        max_retries=max_retries,
+        classify=classify
+    ))
+    tuned_ids = {row[0] for row in rows}
+    results = results[results["row"].isin(tuned_ids)]
+    tuned = tune_thresholds(stage_table(results, stages), stages, max_accuracy_drop=max_accuracy_drop)
+    save_thresholds(tuned, output_file, confidence=confidence, votes=votes, max_accuracy_drop=max_accuracy_drop)
+
+    print(f"Thresholds: {tuned['thresholds']}")
+    print(f"Accuracy {tuned['accuracy']:.3f} (last stage alone {tuned['reference_accuracy']:.3f}), "
+          f"{tuned['mean_tokens']:.0f} tokens per tweet (last stage alone {tuned['reference_tokens']:.0f})")
+    print(f"Answered at each stage: {tuned['exit_rates']}")
+    print(f"Saved to '{output_file}'")
+    return tuned
+
+
+def summarize_cascade(results, wall_time, stages=DEFAULT_STAGES):
+    """stance_runner.summarize plus the share of tweets answered at each stage and mean escalations"""
+    summary = summarize("cascade", results, wall_time)
+    if "exit_stage" in results:
+        answered = results[results["exit_stage"].notna()]
+        for stage in stages:
+            summary[f"exit_{stage}"] = (answered["exit_stage"] == stage).mean() if len(answered) else 0.0
+        summary["escalations"] = answered["escalations"].mean() if len(answered) else 0.0
+    return summary
+
+
+def run_cascade(input_file, thresholds_file=None, output_dir="predictions", retrieve=None, stages=None,
+                confidence=None, votes=None, text_column="translation", context_column="info_from_graph",
+                label_column="label", id_column=None, concurrency=16, requests_per_second=5.0, max_retries=5):
+    """
+    Classify a dataset with the cascade. Stages, thresholds and confidence
+    settings come from `thresholds_file` (see tune_cascade) unless given;
+    without a file DEFAULT_STAGES and DEFAULT_THRESHOLDS are used.
+    Predictions go to '<output_dir>/cascade.jsonl'.
+
+    Returns:
+    DataFrame: One summary row
+    """
+    tuned = load_thresholds(thresholds_file) if thresholds_file else {}
+    stages = tuple(stages or tuned.get("stages") or DEFAULT_STAGES)
+    _check_stages(stages)
+    thresholds = tuned.get("thresholds", DEFAULT_THRESHOLDS)
+    confidence = confidence or tuned.get("confidence", "logprobs")
+    votes = votes or tuned.get("votes", 5)
+    rows = held_out_rows(load_rows(input_file, text_column, context_column, label_column, id_column),
+                         input_file, id_column)
+    print(f"Running cascade {' -> '.join(stages)} with thresholds {thresholds} on {len(rows)} tweets")
+
+    os.makedirs(output_dir, exist_ok=True)
+    for stage in stages:
+        prefetch_strategy_examples(stage, rows)
+
+    def classify(inputs, limiter, max_retries):
+        return classify_cascade_async(inputs, stages=stages, thresholds=thresholds, retrieve=retrieve,
+                                      confidence=confidence, votes=votes, limiter=limiter, max_retries=max_retries)
+
+    start = time.perf_counter()
+    results = asyncio.run(run_strategy_async(
+        rows,
+        "cascade",
+        os.path.join(output_dir, "cascade.jsonl"),
+        concurrency=concurrency,
+        requests_per_second=requests_per_second,
+        max_retries=max_retries,
+        classify=classify
+    ))
+    summary_df = pd.DataFrame([summarize_cascade(results, time.perf_counter() - start, stages)])
+    print(summary_df.to_string(index=False))
+    print("Time, tokens and retries by operation:")
+    tracing.get_tracer().print_summary()
+    return summary_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Confidence-based cascade of stance classifiers")
+    parser.add_argument("command", choices=["tune", "run"])
+    parser.add_argument("input_file", nargs="?", default="BPDisC_translated.xlsx")
+    parser.add_argument("--thresholds", default="cascade_thresholds.json",
+                        help="Thresholds file written by 'tune' and read by 'run'")
+    parser.add_argument("--stages", nargs="+", choices=list(STRATEGIES), default=None)
+    parser.add_argument("--confidence", choices=CONFIDENCE_MODES, default=None)
+    parser.add_argument("--votes", type=int, default=None, help="Sampled answers when voting")
+    parser.add_argument("--sample", type=int, default=300, help="Labeled tweets used for tuning")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0)
+    parser.add_argument("--output-dir", default="predictions")
+    parser.add_argument("--text-column", default="translation")
+    parser.add_argument("--context-column", default="info_from_graph")
+    parser.add_argument("--label-column", default="label")
+    parser.add_argument("--id-column", default=None)
+    parser.add_argument("--snapshot", default=None,
+                        help="Retrieve context from this local_graph snapshot, only for escalated tweets")
+    parser.add_argument("--max-context-tokens", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests-per-second", type=float, default=5.0)
+    parser.add_argument("--trace-file", default=None, help="Append spans to this file as OTLP/JSON lines")
+    args = parser.parse_args()
+
+    if args.trace_file:
+        tracing.get_tracer().stream_to(args.trace_file)
+    retrieve = None
+    if args.snapshot:
+        import resources
+        from grasp_pipeline import make_retrieve
+        from local_graph import LocalGraph
+        backend = LocalGraph.load(args.snapshot, embeddings=resources.embeddings())
+        retrieve = make_retrieve(backend=backend, max_tokens=args.max_context_tokens, embeddings=getattr(backend, "embeddings", None))
+
+    options = dict(
+        retrieve=retrieve,
+        text_column=args.text_column,
+        context_column=args.context_column,
+        label_column=args.label_column,
+        id_column=args.id_column,
+        concurrency=args.concurrency,
+        requests_per_second=args.requests_per_second,
+    )
+    if args.command == "tune":
+        tune_cascade(
+            args.input_file,
+            output_file=args.thresholds,
+            stages=tuple(args.stages or DEFAULT_STAGES),
+            sample=args.sample,
+            predictions_dir=args.output_dir,
+            confidence=args.confidence or "logprobs",
+            votes=args.votes or 5,
+            max_accuracy_drop=args.max_accuracy_drop,
+            **options
+        )
+    else:
+        run_cascade(
+            args.input_file,
+            thresholds_file=args.thresholds if os.path.exists(args.thresholds) else None,
+            output_dir=args.output_dir,
+            stages=args.stages,
+            confidence=args.confidence,
+            votes=args.votes,
+            **options
+        )
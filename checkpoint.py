@@ -0,0 +1,44 @@
+import json
+import os
+import time
+
+
+def read_records(checkpoint_file):
+    """
+    Yield the records of an append-only JSONL file, skipping a partially written last line.
+    A missing file yields nothing.
+    """
+    if not os.path.exists(checkpoint_file):
+        return
+    with open(checkpoint_file, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partially written last line
+                continue
+
+
+class CheckpointWriter:
+    """
+    Append-only JSONL writer. Every record is flushed to the OS immediately and
+    fsynced at most every `sync_interval` seconds, so a crash loses only the
+    last few seconds of completed records.
+    """
+
+    def __init__(self, checkpoint_file, sync_interval=2.0):
+        self.file = open(checkpoint_file, 'a', encoding='utf-8')
+        self.sync_interval = sync_interval
+        self._last_sync = time.monotonic()
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            os.fsync(self.file.fileno())
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
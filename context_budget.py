@@ -0,0 +1,231 @@
+import re
+import threading
+import numpy as np
+
+try:
+    import tiktoken
+except ImportError:  # Token counts fall back to a characters-per-token estimate
+    tiktoken = None
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model="gpt-4o"):
+    """
+    tiktoken encoding for `model`, or None when tiktoken is not installed or its
+    encoding file cannot be downloaded (e.g. offline without a tiktoken cache).
+    """
+    if tiktoken is None:
+        return None
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4o"):
+    """Number of tokens `text` takes in `model`'s tokenizer (about 4 characters per token without tiktoken)."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, model="gpt-4o"):
+    """Cut `text` down to at most `max_tokens` tokens."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def dedupe(items):
+    """Drop empty and repeated items (ignoring surrounding whitespace), keeping the first occurrence."""
+    seen = set()
+    unique = []
+    for item in items:
+        key = " ".join(str(item).split())
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(str(item).strip())
+    return unique
+
+
+def fit_to_budget(items, max_tokens, separator="\n", model="gpt-4o"):
+    """
+    Join items in order until the next one would exceed `max_tokens`.
+    The first item is truncated rather than dropped if it alone is over budget.
+
+    Returns:
+    str: The joined items that fit
+    """
+    kept = []
+    used = 0
+    separator_tokens = count_tokens(separator, model) if separator else 0
+    for item in items:
+        cost = count_tokens(item, model) + (separator_tokens if kept else 0)
+        if used + cost > max_tokens:
+            if not kept:
+                kept.append(truncate_tokens(item, max_tokens, model))
+            break
+        kept.append(item)
+        used += cost
+    return separator.join(kept)
+
+
+# Relation types that usually carry political affiliation get a higher prior
+RELATION_PRIOR_KEYWORDS = ("LEADER", "MEMBER", "PARTY", "OPPOS", "ALLY", "SUPPORT", "GOVERN", "PRESIDENT", "MINISTER", "FOUND")
+
+
+def relation_type(triple):
+    """Relationship type of a 'source - TYPE -> target' triple, or '' if it has another shape."""
+    if " - " not in triple or " -> " not in triple:
+        return ""
+    return triple.split(" - ", 1)[1].split(" -> ", 1)[0]
+
+
+def relation_prior(triple, priors=None):
+    """Weight of a triple from its relationship type: `priors[type]` if given, else a keyword match."""
+    rel = relation_type(triple)
+    if priors is not None:
+        return priors.get(rel, 1.0)
+    return 1.5 if any(keyword in rel.upper() for keyword in RELATION_PRIOR_KEYWORDS) else 1.0
+
+
+def _words(text):
+    return set(re.findall(r"\w+", str(text).lower()))
+
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def embed_unique(texts, embeddings, known=None, batch_size=256):
+    """
+    Unit-length embeddings of the distinct `texts`, keyed by text. Vectors in
+    `known` (text -> vector, e.g. stored chunk embeddings) are reused; the rest
+    are embedded with embed_documents, `batch_size` texts per call.
+    """
+    known = known or {}
+    vectors = {}
+    pending = []
+    for text in dict.fromkeys(texts):
+        if text in known:
+            vectors[text] = _unit(known[text])
+        else:
+            pending.append(text)
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        vectors.update(zip(batch, _unit(embeddings.embed_documents(batch))))
+    return vectors
+
+
+def relevance_scores(query, items, embeddings=None, vectors=None):
+    """
+    Relevance of each item to `query`: cosine similarity of embeddings when an
+    embedding model is given, otherwise word overlap (Jaccard). `vectors`
+    holds precomputed unit embeddings from embed_unique; they are used when
+    they cover the query and every item.
+    """
+    if not items:
+        return np.zeros(0, dtype=np.float32)
+    if embeddings is not None and vectors is not None and query in vectors and all(item in vectors for item in items):
+        return np.stack([vectors[item] for item in items]) @ vectors[query]
+    if embeddings is not None:
+        query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+        item_vectors = np.asarray(embeddings.embed_documents(list(items)), dtype=np.float32)
+        query_vector /= max(np.linalg.norm(query_vector), 1e-12)
+        item_vectors /= np.maximum(np.linalg.norm(item_vectors, axis=1, keepdims=True), 1e-12)
+        return item_vectors @ query_vector
+    query_words = _words(query)
+    scores = []
+    for item in items:
+        item_words = _words(item)
+        union = query_words | item_words
+        scores.append(len(query_words & item_words) / len(union) if union else 0.0)
+    return np.array(scores, dtype=np.float32)
+
+
+def compile_context(query, triples, chunks, max_tokens=1200, triple_share=0.4, embeddings=None,
+                    relation_priors=None, model="gpt-4o", vectors=None):
+    """
+    Build a bounded retrieval context for `query`.
+
+    Triples and chunks are deduplicated and ranked by relevance to the query
+    (triples also weighted by a relation-type prior), then the best ones are
+    kept within `max_tokens`. Triples get `triple_share` of the budget and any
+    part they leave unused goes to chunks.
+
+    Parameters:
+    query (str): The tweet the context is for
+    triples (list): 'source - TYPE -> target' strings
+    chunks (list): Retrieved text chunks
+    max_tokens (int): Total token budget for triples and chunks
+    triple_share (float): Fraction of the budget reserved for triples
+    embeddings: Optional embedding model with embed_query/embed_documents
+    relation_priors (dict): Optional relationship type -> weight
+    vectors (dict): Optional precomputed embeddings from embed_unique
+
+    Returns:
+    tuple: (relational_text, unstructured_chunks) where relational_text is newline-joined
+           triples and unstructured_chunks is the list of kept chunks
+    """
+    triples = dedupe(triples)
+    chunks = dedupe(chunks)
+
+    triple_scores = relevance_scores(query, triples, embeddings, vectors)
+    triple_scores = triple_scores * np.array([relation_prior(triple, relation_priors) for triple in triples], dtype=np.float32)
+    ranked_triples = [triples[i] for i in np.argsort(-triple_scores, kind="stable")]
+    relational_text = fit_to_budget(ranked_triples, int(max_tokens * triple_share), model=model)
+
+    remaining = max_tokens - (count_tokens(relational_text, model) if relational_text else 0)
+    chunk_scores = relevance_scores(query, chunks, embeddings, vectors)
+    kept_chunks = []
+    for i in np.argsort(-chunk_scores, kind="stable"):
+        cost = count_tokens(chunks[i], model)
+        if cost > remaining:
+            continue
+        kept_chunks.append(chunks[i])
+        remaining -= cost
+    return relational_text, kept_chunks
+
+
+def compile_contexts(queries, triples_per_query, chunks_per_query, max_tokens=1200, triple_share=0.4, embeddings=None,
+                     relation_priors=None, model="gpt-4o", known_vectors=None, batch_size=256):
+    """
+    compile_context for many queries. With an embedding model, the queries and
+    the distinct triples and chunks of the whole batch are embedded once, so
+    items shared by several queries (e.g. the neighbourhood of a common
+    entity) are not re-embedded for each of them.
+
+    Parameters:
+    queries (list): Tweets
+    triples_per_query (list): One list of triples per query
+    chunks_per_query (list): One list of chunks per query
+    known_vectors (dict): Optional text -> stored embedding, reused instead of embedding again
+    batch_size (int): Texts per embed_documents call
+
+    Returns:
+    list: One (relational_text, unstructured_chunks) tuple per query
+    """
+    queries = [str(query) for query in queries]
+    triples_per_query = [dedupe(triples) for triples in triples_per_query]
+    chunks_per_query = [dedupe(chunks) for chunks in chunks_per_query]
+    vectors = None
+    if embeddings is not None:
+        texts = queries + [item for items in triples_per_query + chunks_per_query for item in items]
+        vectors = embed_unique(texts, embeddings, known=known_vectors, batch_size=batch_size)
+    return [
+        compile_context(query, triples, chunks, max_tokens=max_tokens, triple_share=triple_share,
+                        embeddings=embeddings, relation_priors=relation_priors, model=model, vectors=vectors)
+        for query, triples, chunks in zip(queries, triples_per_query, chunks_per_query)
+    ]
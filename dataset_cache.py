@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Source formats converted to Parquet on first load
+CONVERTED_FORMATS = (".xlsx", ".csv", ".jsonl")
+
+
+def file_sha256(path, block_size=1 << 20):
+    """SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_source(path):
+    """Parse a source file with pandas based on its extension."""
+    if path.endswith(".xlsx"):
+        return pd.read_excel(path)
+    elif path.endswith(".csv"):
+        return pd.read_csv(path)
+    elif path.endswith(".jsonl"):
+        return pd.read_json(path, lines=True)
+    elif path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    raise ValueError("Unsupported file format. Use .xlsx, .csv, .jsonl or .parquet")
+
+
+def to_arrow_table(df):
+    """
+    Convert a DataFrame to an Arrow table. Object columns that mix types
+    (common in Excel sheets) are stored as strings, keeping missing values.
+    """
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        df = df.copy()
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+class DatasetCache:
+    """
+    Parquet cache for datasets that are slow to parse, such as BPDisC.xlsx.
+
+    Each source file is converted once to `<cache_dir>/<name>.parquet` with a
+    JSON sidecar holding the source mtime, size and SHA-256. The cache is reused
+    while the mtime and size are unchanged; if they change, the file is hashed
+    and only converted again when its content actually differs.
+
+    Parameters:
+    cache_dir (str): Directory holding the converted files
+    """
+
+    def __init__(self, cache_dir=".dataset_cache"):
+        self.cache_dir = cache_dir
+
+    def _paths(self, source):
+        # Key on the absolute path so same-named files in different folders do not collide
+        tag = hashlib.sha256(os.path.abspath(source).encode("utf-8")).hexdigest()[:12]
+        stem = f"{os.path.basename(source)}.{tag}"
+        base = os.path.join(self.cache_dir, stem)
+        return base + ".parquet", base + ".json"
+
+    def _is_fresh(self, source, data_path, meta_path):
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return False
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        stat = os.stat(source)
+        if meta.get("mtime") == stat.st_mtime and meta.get("size") == stat.st_size:
+            return True
+        # Touched but possibly unchanged: fall back to the content hash
+        if meta.get("sha256") != file_sha256(source):
+            return False
+        self._write_meta(meta_path, stat, meta["sha256"])
+        return True
+
+    def _write_meta(self, meta_path, stat, sha256):
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256}, f)
+        os.replace(tmp_path, meta_path)
+
+    def ensure(self, source):
+        """
+        Return the path of an up-to-date Parquet copy of `source`, converting it if needed.
+        Parquet sources are returned unchanged.
+        """
+        if source.endswith(".parquet"):
+            return source
+        if not source.endswith(CONVERTED_FORMATS):
+            raise ValueError("Unsupported file format. Use .xlsx, .csv, .jsonl or .parquet")
+        data_path, meta_path = self._paths(source)
+        if self._is_fresh(source, data_path, meta_path):
+            return data_path
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stat = os.stat(source)
+        sha256 = file_sha256(source)
+        table = to_arrow_table(read_source(source))
+        # Write to a temporary file first so a crash never leaves a half-written cache
+        tmp_path = data_path + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, data_path)
+        self._write_meta(meta_path, stat, sha256)
+        return data_path
+
+    def load(self, source, columns=None):
+        """
+        Load `source` as a DataFrame through the cache.
+
+        Parameters:
+        source (str): Path to an .xlsx, .csv, .jsonl or .parquet file
+        columns (list): Only read these columns; other columns are never decoded
+
+        Returns:
+        DataFrame: The requested columns of the dataset
+        """
+        data_path = self.ensure(source)
+        table = pq.read_table(data_path, columns=columns, memory_map=True)
+        return table.to_pandas()
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """Process-wide dataset cache; the directory comes from DATASET_CACHE_DIR."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DatasetCache(os.getenv("DATASET_CACHE_DIR", ".dataset_cache"))
+    return _default_cache
+
+
+def load_dataset(source, columns=None, cache=None):
+    """
+    Load a dataset through the Parquet cache, reading only `columns` when given.
+    """
+    cache = cache or get_default_cache()
+    return cache.load(source, columns=columns)
@@ -1,19 +1,102 @@
 import pandas as pd
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
-from nltk.corpus import stopwords
-import nltk
 from collections import Counter
-import spacy
+import resources
+from dataset_cache import load_dataset
 
-# Download required NLTK data
-nltk.download('stopwords')
+# The spaCy NER pipeline is loaded on first use and shared through the resource
+# registry; `nlp` stays available as a module attribute
+__getattr__ = resources.lazy_attributes(__name__, nlp=resources.spacy_ner)
 
-# Load the spaCy model for NER
-nlp = spacy.load("en_core_web_sm")
-nlp.max_length = 2000000  # Increase the max_length limit
+def count_words_and_entities(texts, stop_words, batch_size=256, n_process=1):
+    """
+    Count non-stop-word tokens and collect NER tags one tweet at a time.
+    
+    Tweets are streamed through `nlp.pipe`, so peak memory is bounded by
+    `batch_size` rather than by the size of the corpus.
+    
+    Parameters:
+    texts (iterable): Tweet texts
+    stop_words (set): Lower-cased words to ignore
+    batch_size (int): Tweets per spaCy batch
+    n_process (int): Worker processes used by spaCy
+    
+    Returns:
+    tuple: (word_freq, ner_tags) where word_freq is a Counter of words and
+           ner_tags maps entity text -> NER label
+    """
+    word_freq = Counter()
+    ner_tags = {}
+    nlp = resources.spacy_ner()
+    for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process):
+        word_freq.update(word for word in doc.text.split() if word.lower() not in stop_words)
+        for ent in doc.ents:
+            ner_tags[ent.text] = ent.label_
+    return word_freq, ner_tags
+
+def count_entity_spans(texts, labels=("PERSON", "ORG", "GPE", "NORP"), batch_size=256, n_process=1):
+    """
+    Build a ranked entity-frequency table from spaCy entity spans.
+    
+    Multi-word entities such as "Sheikh Hasina" are counted as a whole. Mentions
+    are collected per tweet and aggregated with pandas groupby.
+    
+    Parameters:
+    texts (iterable): Tweet texts
+    labels (iterable): NER labels to keep, or None to keep all of them
+    batch_size (int): Tweets per spaCy batch
+    n_process (int): Worker processes used by spaCy
+    
+    Returns:
+    DataFrame: Columns Word, NER, Frequency (total mentions) and
+               DocFrequency (number of tweets mentioning the entity),
+               sorted by Frequency then DocFrequency
+    """
+    labels = set(labels) if labels is not None else None
+    doc_ids, words, tags = [], [], []
+    nlp = resources.spacy_ner()
+    for doc_id, doc in enumerate(nlp.pipe(texts, batch_size=batch_size, n_process=n_process)):
+        for ent in doc.ents:
+            if labels is None or ent.label_ in labels:
+                doc_ids.append(doc_id)
+                words.append(ent.text.strip())
+                tags.append(ent.label_)
+    
+    mentions = pd.DataFrame({"doc_id": doc_ids, "Word": words, "NER": tags})
+    table = (
+        mentions.groupby(["Word", "NER"], sort=False)["doc_id"]
+        .agg(Frequency="size", DocFrequency="nunique")
+        .reset_index()
+        .sort_values(["Frequency", "DocFrequency"], ascending=False, kind="stable")
+        .reset_index(drop=True)
+    )
+    return table
 
-def generate_wordcloud_and_csv(excel_file, column_name, output_csv):
+def generate_entity_frequency_csv(excel_file, column_name, output_csv, top_n=100,
+                                  labels=("PERSON", "ORG", "GPE", "NORP"), batch_size=256, n_process=1):
+    """
+    Save the top entities of an Excel column to CSV.
+    The output can be passed straight to
+    knowledge_graph_builder.build_knowledge_graph_from_entities.
+    
+    Parameters:
+    excel_file (str): Path to the Excel file
+    column_name (str): Name of the column containing text data
+    output_csv (str): Path to the output CSV file
+    top_n (int): Number of entities to keep
+    labels (iterable): NER labels to keep, or None to keep all of them
+    """
+    df = load_dataset(excel_file, columns=[column_name])
+    table = count_entity_spans(
+        df[column_name].dropna().astype(str),
+        labels=labels,
+        batch_size=batch_size,
+        n_process=n_process
+    )
+    table = table.head(top_n)
+    table.to_csv(output_csv, index=False)
+    return table
+
+def generate_wordcloud_and_csv(excel_file, column_name, output_csv, batch_size=256, n_process=1):
     """
     Generate a word cloud from an Excel column while removing stop words,
     and create a CSV file with the top 100 words, their frequency, and NER tags.
@@ -22,29 +105,30 @@ def generate_wordcloud_and_csv(excel_file, column_name, output_csv):
     excel_file (str): Path to the Excel file
     column_name (str): Name of the column containing text data
     output_csv (str): Path to the output CSV file
+    batch_size (int): Tweets per spaCy batch
+    n_process (int): Worker processes used for NER
     """
-    # Read the Excel file
-    df = pd.read_excel(excel_file)
-    
-    # Combine all text from the column into a single string
-    text = ' '.join(df[column_name].astype(str).values)
+    # Plotting libraries are only needed here
+    from wordcloud import WordCloud
+    import matplotlib.pyplot as plt
+
+    # Read only the text column through the dataset cache
+    df = load_dataset(excel_file, columns=[column_name])
     
     # Get English stop words
-    stop_words = set(stopwords.words('english'))
+    stop_words = set(resources.stop_words())
     
-    # Tokenize and filter out stop words
-    words = [word for word in text.split() if word.lower() not in stop_words]
-    
-    # Count word frequencies
-    word_freq = Counter(words)
+    # Count word frequencies and run NER per tweet
+    word_freq, ner_tags = count_words_and_entities(
+        df[column_name].astype(str),
+        stop_words,
+        batch_size=batch_size,
+        n_process=n_process
+    )
     
     # Get the top 100 words
     top_words = word_freq.most_common(100)
     
-    # Perform NER on the text
-    doc = nlp(text)
-    ner_tags = {ent.text: ent.label_ for ent in doc.ents}
-    
     # Prepare data for CSV
     csv_data = []
     for word, freq in top_words:
@@ -66,8 +150,8 @@ def generate_wordcloud_and_csv(excel_file, column_name, output_csv):
         random_state=42
     )
     
-    # Generate the word cloud
-    wordcloud.generate(text)
+    # Generate the word cloud from the aggregated counts
+    wordcloud.generate_from_frequencies(word_freq)
     
     # Display the word cloud
     plt.figure(figsize=(10, 5))
@@ -0,0 +1,60 @@
+import re
+
+# spaCy labels that correspond to what the LLM extractor is asked for
+SPACY_LABELS = ("PERSON", "ORG", "NORP")
+
+
+class GazetteerExtractor:
+    """
+    Local entity extractor built from the entity names already stored in the graph.
+
+    Names are compiled into one case-insensitive regex with word boundaries,
+    longest names first, and matches are mapped back to the stored node id so
+    they hit the full-text index exactly. An optional spaCy pipeline adds
+    PERSON/ORG/NORP entities the gazetteer does not know.
+
+    Parameters:
+    names (iterable): Entity names (graph node ids)
+    min_length (int): Ignore names shorter than this, e.g. "AL", which match too much
+    nlp: Optional spaCy pipeline used as a second pass
+    """
+
+    def __init__(self, names, min_length=3, nlp=None):
+        self.canonical = {}
+        for name in names:
+            name = str(name).strip()
+            if len(name) >= min_length:
+                self.canonical.setdefault(name.lower(), name)
+        self.nlp = nlp
+        alternatives = sorted((re.escape(name) for name in self.canonical), key=len, reverse=True)
+        self.pattern = (
+            re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)", re.IGNORECASE)
+            if alternatives else None
+        )
+
+    @classmethod
+    def from_graph(cls, graph, labels=("Person", "Organization"), **kwargs):
+        """Build the gazetteer from the ids of entity nodes in Neo4j with one of `labels`."""
+        if labels:
+            rows = graph.query(
+                "MATCH (n:__Entity__) WHERE any(label IN labels(n) WHERE label IN $labels) RETURN DISTINCT n.id AS id",
+                {"labels": list(labels)}
+            )
+        else:
+            rows = graph.query("MATCH (n:__Entity__) RETURN DISTINCT n.id AS id")
+        return cls([row["id"] for row in rows if row["id"]], **kwargs)
+
+    @classmethod
+    def from_local_graph(cls, backend, **kwargs):
+        """Build the gazetteer from the node ids of a local_graph.LocalGraph."""
+        return cls(backend.node_ids, **kwargs)
+
+    def extract(self, text):
+        """Entity names found in `text`, in order of first appearance."""
+        text = str(text)
+        names = []
+        if self.pattern is not None:
+            names.extend(self.canonical[match.group(0).lower()] for match in self.pattern.finditer(text))
+        if self.nlp is not None:
+            names.extend(ent.text for ent in self.nlp(text).ents if ent.label_ in SPACY_LABELS)
+        return list(dict.fromkeys(names))
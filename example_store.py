@@ -0,0 +1,433 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import resources
+from context_budget import truncate_tokens
+from retrieval_cache import LRUCache, normalize_question
+
+# Stores up to this size are searched exactly; larger ones get an inverted-file index
+EXACT_SEARCH_LIMIT = 4096
+
+# Examples at least this similar to the query are near-duplicates (retweets, quotes) and never selected
+NEAR_DUPLICATE_SIMILARITY = 0.9
+
+# Share of the labeled rows kept out of the store for evaluation
+HOLDOUT_FRACTION = 0.2
+
+FILES = {
+    "meta": "meta.json",
+    "vectors": "vectors.npy",
+    "centroids": "centroids.npy",
+    "offsets": "offsets.npy",
+    "hashes": "hashes.npy",
+    "examples": "examples.parquet",
+}
+
+
+def text_hash(text):
+    """64-bit hash of a normalized tweet, used to keep a tweet out of its own demonstrations."""
+    digest = hashlib.blake2b(normalize_question(text).encode("utf-8"), digest_size=8).digest()
+    return np.uint64(int.from_bytes(digest, "big"))
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _assign(vectors, centroids, batch_size=8192):
+    # Nearest centroid (cosine) per vector, in batches to bound the score matrix
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        batch = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+        labels[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors, n_lists, iterations=20, sample_size=65536, seed=0):
+    """
+    Cluster L2-normalized vectors into `n_lists` unit-length centroids.
+    Centroids are fit on a random sample of at most `sample_size` vectors;
+    empty clusters are reseeded from random sample vectors.
+
+    Returns:
+    ndarray: float32 centroids, shape (n_lists, dim)
+    """
+    rng = np.random.default_rng(seed)
+    size = min(len(vectors), sample_size)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(size, n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        present = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[present]
+        sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(size, int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class ExampleStore:
+    """
+    Labeled tweets indexed by their embeddings, for picking the few-shot
+    demonstrations closest to each tweet.
+
+    The store is a directory written by ExampleStore.build: one float32 matrix
+    of L2-normalized embeddings, memory-mapped on open, plus the tweets,
+    stances and contexts in Parquet. Stores larger than EXACT_SEARCH_LIMIT are
+    split into sqrt(n) clusters by spherical k-means with rows grouped by
+    cluster (an inverted file), and a query only scores the rows of its
+    `n_probe` nearest clusters. A batch of queries scores each probed cluster
+    with one matrix product.
+
+    A query never gets itself back: examples whose normalized text equals the
+    query, or whose similarity reaches `max_similarity` (retweets and other
+    near-duplicates), are skipped, and copies of one stored tweet are
+    selected at most once. Evaluation must still use rows that are not
+    in the store: the build records the IDs and source file of its examples,
+    and held_out_rows drops them from the runners' input.
+
+    Parameters:
+    path (str): Store directory
+    embeddings: Embedding model with `embed_documents`, the one the store was built with
+    n_probe (int): Clusters searched per query
+    cache_size (int): Selections kept in memory, keyed by normalized tweet and k
+    max_similarity (float): Examples at least this similar to a query are skipped
+    """
+
+    def __init__(self, path, embeddings=None, n_probe=8, cache_size=100000,
+                 max_similarity=NEAR_DUPLICATE_SIMILARITY):
+        with open(os.path.join(path, FILES["meta"]), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.embeddings = embeddings
+        self.n_probe = n_probe
+        self.max_similarity = max_similarity
+        # Plain ndarray views of the memory maps skip np.memmap's per-slice overhead
+        self.vectors = np.load(os.path.join(path, FILES["vectors"]), mmap_mode="r").view(np.ndarray)
+        self.hashes = np.load(os.path.join(path, FILES["hashes"]), mmap_mode="r").view(np.ndarray)
+        self.centroids = np.load(os.path.join(path, FILES["centroids"]))
+        self.offsets = np.load(os.path.join(path, FILES["offsets"]))
+        examples = pd.read_parquet(os.path.join(path, FILES["examples"]))
+        self.texts = examples["text"].tolist()
+        self.stances = examples["stance"].tolist()
+        self.contexts = examples["context"].tolist()
+        self._selections = LRUCache(max_size=cache_size)
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def example_ids(self):
+        """Dataset row IDs of the examples, or an empty set for stores built without IDs"""
+        return set(self.meta.get("example_ids") or ())
+
+    @classmethod
+    def build(cls, texts, stances, path, contexts=None, embeddings=None, n_lists=None, batch_size=256,
+              max_context_tokens=80, seed=0, ids=None, source=None, id_column=None):
+        """
+        Embed labeled tweets and write a store to `path`.
+
+        Parameters:
+        texts (list): Tweet texts
+        stances (list): FAVOR or AGAINST per tweet
+        contexts (list): Optional graph context per tweet, trimmed to `max_context_tokens`
+        embeddings: Embedding model with `embed_documents`; defaults to the shared MiniLM model
+        n_lists (int): Clusters in the index; by default 1 (exact search) up to
+                       EXACT_SEARCH_LIMIT examples and sqrt(n) above
+        batch_size (int): Tweets per embed_documents call
+        ids (list): Optional dataset row ID per tweet, recorded so runners can skip these rows
+        source (str): Dataset file the tweets come from
+        id_column (str): Column the IDs come from; None for the row index
+
+        Returns:
+        ExampleStore: The new store, opened with the same embeddings
+        """
+        embeddings = embeddings or resources.embeddings()
+        texts = [str(text) for text in texts]
+        contexts = ["" if context is None or pd.isna(context) else truncate_tokens(str(context), max_context_tokens)
+                    for context in (contexts if contexts is not None else [None] * len(texts))]
+        vectors = np.concatenate([
+            _normalize(embeddings.embed_documents(texts[start:start + batch_size]))
+            for start in range(0, len(texts), batch_size)
+        ]) if texts else np.zeros((0, 0), dtype=np.float32)
+
+        if n_lists is None:
+            n_lists = 1 if len(texts) <= EXACT_SEARCH_LIMIT else int(np.sqrt(len(texts)))
+        n_lists = max(1, min(n_lists, len(texts)))
+        if n_lists > 1:
+            centroids = spherical_kmeans(vectors, n_lists, seed=seed)
+            labels = _assign(vectors, centroids)
+        else:
+            centroids = _normalize(vectors.mean(axis=0, keepdims=True)) if len(texts) else np.zeros((1, 0), np.float32)
+            labels = np.zeros(len(texts), dtype=np.int64)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, FILES["vectors"]), vectors[order].astype(np.float32))
+        np.save(os.path.join(path, FILES["centroids"]), centroids.astype(np.float32))
+        np.save(os.path.join(path, FILES["offsets"]), offsets)
+        np.save(os.path.join(path, FILES["hashes"]), np.array([text_hash(texts[i]) for i in order], dtype=np.uint64))
+        pd.DataFrame({
+            "text": [texts[i] for i in order],
+            "stance": [str(stances[i]) for i in order],
+            "context": [contexts[i] for i in order],
+        }).to_parquet(os.path.join(path, FILES["examples"]), index=False)
+        with open(os.path.join(path, FILES["meta"]), "w", encoding="utf-8") as f:
+            json.dump({
+                "count": len(texts),
+                "dim": int(vectors.shape[1]) if len(texts) else 0,
+                "n_lists": n_lists,
+                "model": getattr(embeddings, "model_name", type(embeddings).__name__),
+                "source": os.path.basename(source) if source else None,
+                "id_column": id_column,
+                "example_ids": [id_.item() if hasattr(id_, "item") else id_ for id_ in ids] if ids is not None else None,
+            }, f, indent=2)
+        return cls(path, embeddings=embeddings)
+
+    def _probes(self, queries):
+        # The n_probe nearest clusters of each query
+        n_lists = len(self.centroids)
+        if n_lists <= self.n_probe:
+            return np.tile(np.arange(n_lists), (len(queries), 1))
+        centroid_scores = queries @ self.centroids.T
+        return np.argpartition(-centroid_scores, self.n_probe - 1, axis=1)[:, :self.n_probe]
+
+    def search_vectors(self, query_vectors, k=4, exclude_hashes=None, max_similarity=None):
+        """
+        Top `k` examples by cosine similarity for a batch of query embeddings.
+
+        Each probed cluster is scored once for all queries that probe it, and
+        its best `k` rows per query are merged into the final ranking.
+
+        Parameters:
+        query_vectors (array): Shape (n_queries, dim)
+        exclude_hashes (array): Optional text_hash per query; matching examples are skipped
+        max_similarity (float): Optional; examples at least this similar are skipped
+
+        Returns:
+        tuple: (indices, scores), both shape (n_queries, k); missing results have index -1
+        """
+        queries = _normalize(np.atleast_2d(query_vectors))
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if not len(self.texts) or k <= 0 or not len(queries):
+            return indices, scores
+        if exclude_hashes is not None:
+            exclude_hashes = np.asarray(exclude_hashes, dtype=np.uint64)
+
+        probes = self._probes(queries)
+        n_probe = probes.shape[1]
+        candidates = np.full((len(queries), n_probe, k), -1, dtype=np.int64)
+        candidate_scores = np.full((len(queries), n_probe, k), -np.inf, dtype=np.float32)
+        # Group (query, probe slot) pairs by cluster
+        flat = probes.ravel()
+        order = np.argsort(flat, kind="stable")
+        groups = np.split(order, np.flatnonzero(np.diff(flat[order])) + 1)
+        for positions in groups:
+            cluster = flat[positions[0]]
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            if end == start:
+                continue
+            rows, slots = positions // n_probe, positions % n_probe
+            similarity = queries[rows] @ self.vectors[start:end].T
+            if exclude_hashes is not None:
+                similarity[self.hashes[start:end][None, :] == exclude_hashes[rows][:, None]] = -np.inf
+            if max_similarity is not None:
+                similarity[similarity >= max_similarity] = -np.inf
+            top_k = min(k, end - start)
+            top = np.argpartition(-similarity, top_k - 1, axis=1)[:, :top_k]
+            candidates[rows, slots, :top_k] = start + top
+            candidate_scores[rows, slots, :top_k] = np.take_along_axis(similarity, top, axis=1)
+
+        candidates = candidates.reshape(len(queries), -1)
+        candidate_scores = candidate_scores.reshape(len(queries), -1)
+        top_k = min(k, candidates.shape[1])
+        top = np.argpartition(-candidate_scores, top_k - 1, axis=1)[:, :top_k]
+        top_scores = np.take_along_axis(candidate_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        indices[:, :top_k] = np.where(np.isfinite(top_scores), np.take_along_axis(candidates, top, axis=1), -1)
+        scores[:, :top_k] = top_scores
+        return indices, scores
+
+    def _example(self, index, score):
+        return {"text": self.texts[index], "stance": self.stances[index], "context": self.contexts[index],
+                "score": float(score)}
+
+    def _distinct(self, indices, scores, k):
+        # The best-scoring example per text_hash, up to k; copies of a stored
+        # tweet (possibly with conflicting labels) only count once
+        seen, examples = set(), []
+        for index, score in zip(indices, scores):
+            if index < 0 or len(examples) == k:
+                break
+            if self.hashes[index] not in seen:
+                seen.add(self.hashes[index])
+                examples.append(self._example(index, score))
+        return examples
+
+    def select_batch(self, texts, k=4):
+        """
+        The `k` most similar distinct labeled examples for each tweet. Tweets
+        not seen before are embedded with one embed_documents call and searched
+        together; the search fetches extra candidates, and more again for
+        tweets whose results were mostly copies of the same stored tweet.
+
+        Returns:
+        list: One list per tweet of dicts with text, stance, context and score
+        """
+        texts = [str(text) for text in texts]
+        results = [self._selections.get((normalize_question(text), k)) for text in texts]
+        pending = list(dict.fromkeys(text for text, result in zip(texts, results) if result is None))
+        if pending:
+            vectors = np.atleast_2d(np.asarray(self.embeddings.embed_documents(pending), dtype=np.float32))
+            hashes = np.array([text_hash(text) for text in pending], dtype=np.uint64)
+            found = {}
+            remaining = np.arange(len(pending))
+            fetch = 2 * k
+            while len(remaining):
+                indices, scores = self.search_vectors(
+                    vectors[remaining],
+                    k=fetch,
+                    exclude_hashes=hashes[remaining],
+                    max_similarity=self.max_similarity
+                )
+                short = []
+                for position, row_indices, row_scores in zip(remaining, indices, scores):
+                    found[pending[position]] = self._distinct(row_indices, row_scores, k)
+                    # A full candidate list may hide more distinct examples
+                    if len(found[pending[position]]) < k and row_indices[-1] >= 0 and fetch < len(self):
+                        short.append(position)
+                remaining = np.array(short, dtype=np.int64)
+                fetch *= 2
+            for text in pending:
+                self._selections.put((normalize_question(text), k), found[text])
+            results = [found[text] if result is None else result for text, result in zip(texts, results)]
+        return results
+
+    def select(self, text, k=4):
+        """The `k` most similar labeled examples for one tweet (see select_batch)."""
+        return self.select_batch([text], k=k)[0]
+
+
+def select_examples(tweet, k=4, default=()):
+    """
+    Demonstrations for `tweet` from the shared example store, or `default`
+    when no store is configured (see resources.example_store) or it is empty.
+    """
+    store = resources.example_store()
+    if store is None:
+        return list(default)
+    return store.select(tweet, k=k) or list(default)
+
+
+def prefetch_examples(tweets, k=4, batch_size=1024):
+    """
+    Select demonstrations for many tweets in vectorized batches, so the
+    per-tweet select_examples calls that follow are memory lookups.
+    Does nothing without a configured store.
+    """
+    store = resources.example_store()
+    if store is None:
+        return
+    tweets = list(tweets)
+    for start in range(0, len(tweets), batch_size):
+        store.select_batch(tweets[start:start + batch_size], k=k)
+
+
+def held_out_rows(rows, input_file, id_column=None):
+    """
+    Drop the rows of `input_file` that are examples in the store, so no tweet
+    is classified, scored or tuned on with its own gold label in the prompt.
+    Rows of other datasets, or without a store, are returned unchanged.
+
+    Parameters:
+    rows (list): (row ID, prompt inputs, label) triples from stance_runner.load_rows
+    input_file (str): Dataset the rows were loaded from
+    id_column (str): Column the row IDs come from; None for the row index
+
+    Returns:
+    list: The rows not used as demonstrations
+    """
+    store = resources.example_store()
+    if store is None or not store.meta.get("source") or store.meta["source"] != os.path.basename(input_file):
+        return rows
+    if store.meta.get("id_column") != id_column:
+        raise ValueError(
+            f"The example store was built from '{store.meta['source']}' with row IDs from "
+            f"{store.meta.get('id_column') or 'the row index'}; load the rows with the same id column"
+        )
+    example_ids = store.example_ids
+    kept = [row for row in rows if row[0] not in example_ids]
+    if len(kept) < len(rows):
+        print(f"Skipping {len(rows) - len(kept)} rows used as few-shot examples; {len(kept)} held-out rows remain")
+    return kept
+
+
+def format_examples(examples, with_context=False):
+    """Render demonstrations in the prompts' 'Tweet: / Context: / Stance:' format."""
+    blocks = []
+    for example in examples:
+        lines = [f'Tweet: "{" ".join(str(example["text"]).split())}"']
+        if with_context:
+            lines.append(f'Context: "{" ".join(str(example.get("context") or "").split())}"')
+        lines.append(f"Stance: {str(example['stance']).capitalize()}")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+if __name__ == "__main__":
+    from stance_runner import label_stance
+    from dataset_cache import load_dataset
+
+    parser = argparse.ArgumentParser(description="Build the few-shot demonstration store from labeled tweets")
+    parser.add_argument("input_file", nargs="?", default="BPDisC_translated.xlsx")
+    parser.add_argument("--output", default=resources.EXAMPLE_STORE_PATH)
+    parser.add_argument("--text-column", default="translation")
+    parser.add_argument("--label-column", default="label")
+    parser.add_argument("--context-column", default="info_from_graph")
+    parser.add_argument("--id-column", default=None, help="Row ID column, as passed to the runners; default the row index")
+    parser.add_argument("--holdout", type=float, default=HOLDOUT_FRACTION,
+                        help="Share of labeled rows kept out of the store for evaluation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-lists", type=int, default=None, help="Index clusters; default 1 up to 4096 examples, else sqrt(n)")
+    args = parser.parse_args()
+
+    df = load_dataset(args.input_file)
+    df = df[df[args.text_column].notna()]
+    stances = df[args.label_column].map(label_stance)
+    df = df.assign(stance=stances)[stances.notna()]
+    # The held-out rows are left out of the store; the runners evaluate only those
+    holdout = np.random.default_rng(args.seed).random(len(df)) < args.holdout
+    examples = df[~holdout]
+    ids = examples[args.id_column] if args.id_column else examples.index
+    contexts = examples[args.context_column].tolist() if args.context_column in examples else None
+    start = time.perf_counter()
+    store = ExampleStore.build(
+        examples[args.text_column].tolist(),
+        examples["stance"].tolist(),
+        args.output,
+        contexts=contexts,
+        n_lists=args.n_lists,
+        ids=list(ids),
+        source=args.input_file,
+        id_column=args.id_column
+    )
+    print(f"Indexed {len(store)} labeled tweets in {store.meta['n_lists']} clusters "
+          f"in {time.perf_counter() - start:.1f}s; saved to '{args.output}'")
+    print(f"{int(holdout.sum())} labeled rows are held out; runners on '{os.path.basename(args.input_file)}' "
+          f"skip the {len(store)} example rows")
@@ -0,0 +1,313 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STANCES = ("FAVOR", "AGAINST")
+NUMBERED_LINE_RE = re.compile(r"^\s*(\d+)\.\s+(.*)$", re.MULTILINE)
+NAME_RE = re.compile(r"\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*")
+
+
+def stable_hash(text):
+    """Process-independent integer hash of a string."""
+    return int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "big")
+
+
+def message_text(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def fake_stance(text):
+    """FAVOR or AGAINST, fixed for a given text."""
+    return STANCES[stable_hash(text) % 2]
+
+
+def fake_confidence(text):
+    """Probability in [0.5, 1) the fake model gives its own stance for `text`."""
+    return 0.5 + (stable_hash(f"confidence:{text}") % 1000) / 2000
+
+
+def fake_logprobs(content, text):
+    """
+    OpenAI-style token logprobs for `content`. The stance token carries
+    fake_confidence(text) with the opposite stance as its top alternative.
+    """
+    confidence = fake_confidence(text)
+    positions = []
+    for token in re.findall(r"\s*\S+", content):
+        word = token.strip().upper()
+        if word in STANCES:
+            other = token.replace(token.strip(), STANCES[1 - STANCES.index(word)])
+            top = [
+                {"token": token, "logprob": math.log(confidence), "bytes": None},
+                {"token": other, "logprob": math.log(1 - confidence), "bytes": None},
+            ]
+            positions.append({"token": token, "logprob": math.log(confidence), "bytes": None, "top_logprobs": top})
+        else:
+            positions.append({"token": token, "logprob": 0.0, "bytes": None, "top_logprobs": []})
+    return {"content": positions}
+
+
+def fill_schema(schema, text, definitions=None, name=None):
+    """
+    Build a value that matches a JSON schema, derived deterministically from `text`.
+
+    Arrays of objects with an `id` property get one item per numbered line
+    ("1. ...") in the text, so packed requests are answered slot by slot.
+    """
+    definitions = definitions if definitions is not None else schema.get("definitions") or schema.get("$defs") or {}
+    if "$ref" in schema:
+        return fill_schema(definitions[schema["$ref"].rsplit("/", 1)[-1]], text, definitions, name)
+    if "allOf" in schema:
+        return fill_schema(schema["allOf"][0], text, definitions, name)
+    if "anyOf" in schema:
+        return fill_schema(schema["anyOf"][0], text, definitions, name)
+    if "enum" in schema:
+        return schema["enum"][stable_hash(text) % len(schema["enum"])]
+
+    kind = schema.get("type", "object")
+    if kind == "object":
+        return {key: fill_schema(value, text, definitions, key) for key, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        items = schema.get("items", {})
+        resolved = definitions.get(items.get("$ref", "").rsplit("/", 1)[-1], items) if "$ref" in items else items
+        slots = NUMBERED_LINE_RE.findall(text)
+        if slots and "id" in resolved.get("properties", {}):
+            values = []
+            for slot, line in slots:
+                value = fill_schema(resolved, line, definitions)
+                value["id"] = int(slot)
+                values.append(value)
+            return values
+        if resolved.get("type") == "string":
+            return list(dict.fromkeys(NAME_RE.findall(text)))[:3]
+        return [fill_schema(resolved, f"{text}#{i}", definitions) for i in range(2)]
+    if kind == "integer":
+        return stable_hash(text) % 10
+    if kind == "number":
+        return (stable_hash(text) % 1000) / 1000
+    if kind == "boolean":
+        return bool(stable_hash(text) % 2)
+    if name == "stance":
+        return fake_stance(text)
+    names = NAME_RE.findall(text)
+    return names[stable_hash(text) % len(names)] if names else "Entity"
+
+
+def fake_reply(messages, sample=0):
+    """
+    Plain-text answer for a chat request: translation prompts get the tweet
+    back, everything else gets a stance. Samples after the first flip the
+    stance with probability 1 - fake_confidence, like sampling at temperature > 0.
+    """
+    system = " ".join(message_text(m) for m in messages if m.get("role") == "system").lower()
+    last = message_text(messages[-1]) if messages else ""
+    if "translat" in system:
+        match = re.search(r"Tweet:\s*(.*?)\s*Translated Tweet \(English\):\s*$", last, re.DOTALL)
+        return match.group(1) if match else last
+    stance = fake_stance(last)
+    if sample and (stable_hash(f"{last}#{sample}") % 1000) / 1000 >= fake_confidence(last):
+        stance = STANCES[1 - STANCES.index(stance)]
+    return f"Stance: {stance}"
+
+
+def fake_completion(body):
+    """
+    OpenAI chat.completion response for a request body. Plain answers honor
+    `n` (extra samples when temperature > 0) and `logprobs`.
+    """
+    messages = body.get("messages", [])
+    text = "\n".join(message_text(m) for m in messages)
+    message = {"role": "assistant", "content": None}
+    choices = None
+    tools = body.get("tools") or []
+    response_format = body.get("response_format") or {}
+    if tools:
+        choice = body.get("tool_choice")
+        wanted = choice.get("function", {}).get("name") if isinstance(choice, dict) else None
+        tool = next((t for t in tools if t["function"]["name"] == wanted), tools[0])["function"]
+        arguments = fill_schema(tool.get("parameters", {}), message_text(messages[-1]) if messages else "")
+        message["tool_calls"] = [{
+            "id": f"call_{stable_hash(text) % 10 ** 12}",
+            "type": "function",
+            "function": {"name": tool["name"], "arguments": json.dumps(arguments)},
+        }]
+        finish_reason = "tool_calls"
+    elif response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"].get("schema", {})
+        message["content"] = json.dumps(fill_schema(schema, message_text(messages[-1]) if messages else ""))
+        finish_reason = "stop"
+    else:
+        last = message_text(messages[-1]) if messages else ""
+        sampled = (body.get("temperature") or 0) > 0
+        choices = []
+        for index in range(max(1, int(body.get("n") or 1))):
+            content = fake_reply(messages, sample=index if sampled else 0)
+            logprobs = fake_logprobs(content, last) if body.get("logprobs") else None
+            choices.append({"index": index, "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop", "logprobs": logprobs})
+        message = choices[0]["message"]
+        finish_reason = "stop"
+    if choices is None:
+        choices = [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}]
+    completion_text = "".join(choice["message"]["content"] or "" for choice in choices) \
+        or message["tool_calls"][0]["function"]["arguments"]
+    prompt_tokens = max(1, len(text) // 4)
+    completion_tokens = max(1, len(completion_text) // 4)
+    return {
+        "id": f"chatcmpl-{stable_hash(text) % 10 ** 12}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": choices,
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class FakeLLMServer:
+    """
+    Local OpenAI-compatible chat completions server for offline benchmarks.
+
+    Answers POST /v1/chat/completions deterministically: stances for classifier
+    prompts, the tweet itself for translation prompts and schema-shaped tool
+    calls for structured output. Latency, rate limiting and server errors are
+    injected so clients exercise their retry and throttling paths.
+
+    Parameters:
+    latency (float): Mean seconds before each response
+    jitter (float): Uniform +/- seconds added to the latency
+    rate_limit (float): Requests per second accepted before answering 429, None for no limit
+    error_rate (float): Fraction of requests answered with a 500
+    seed (int): Seed for jitter and error injection
+    host (str), port (int): Address to bind; port 0 picks a free port
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, rate_limit=None, error_rate=0.0, seed=0,
+                 host="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = float(rate_limit or 0)
+        self._updated = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+                    return
+                status, payload, headers = server.handle(body)
+                self._send(status, payload, headers)
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _admit(self):
+        # Token bucket refilled at `rate_limit` per second with one second of burst
+        if not self.rate_limit:
+            return True, 0.0
+        now = time.monotonic()
+        self._tokens = min(float(self.rate_limit), self._tokens + (now - self._updated) * self.rate_limit)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True, 0.0
+        return False, (1 - self._tokens) / self.rate_limit
+
+    def handle(self, body):
+        """Return (status, payload, headers) for one chat completion request."""
+        with self._lock:
+            self.stats["requests"] += 1
+            admitted, wait = self._admit()
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.error_rate
+        if not admitted:
+            with self._lock:
+                self.stats["rate_limited"] += 1
+            error = {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error", "code": 429}}
+            return 429, error, {"Retry-After": f"{wait:.3f}"}
+        time.sleep(delay)
+        if failed:
+            with self._lock:
+                self.stats["errors"] += 1
+            return 500, {"error": {"message": "Injected server error", "type": "server_error", "code": 500}}, {}
+        with self._lock:
+            self.stats["ok"] += 1
+        return 200, fake_completion(body), {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake OpenAI-compatible server.")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeLLMServer(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                           error_rate=args.error_rate, seed=args.seed, port=args.port)
+    print(f"Serving fake chat completions on {server.url} (set OPENROUTER_BASE_URL and OPENAI_API_BASE to this)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
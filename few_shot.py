@@ -1,25 +1,47 @@
 from dotenv import load_dotenv
-import os
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+import resources
+import tracing
+from llm_cache import cached_completion
+from rate_limiter import call_with_retries
+from packed import classify_packed
 
 # Load environment variables
 load_dotenv()
 
-# Initialize clients
-client = OpenAI(
-    base_url="https://api.openrouter.ai/v1",  
-    api_key=os.getenv("OPENROUTER_API_KEY")   
-)
+def get_llm():
+    """The shared gpt-4o chat model, created on first use"""
+    return resources.chat_model("gpt-4o")
 
-# Initialize the language model
-llm = ChatOpenAI(client=client, model="gpt-4o")  # Ensure the client is passed correctly
+# `llm` and `client` stay available as module attributes but are only built when first used
+__getattr__ = resources.lazy_attributes(__name__, llm=get_llm, client=resources.openrouter_client)
+
+# Demonstrations used when no example store has been built
+DEFAULT_EXAMPLES = [
+    {"text": "The country is moving forward under the leadership of Sheikh Hasina. #AwamiLeague", "stance": "FAVOR"},
+    {"text": "Corruption is rampant, and the government is not listening to the people. #Bangladesh", "stance": "AGAINST"},
+]
+
+# Labeled tweets most similar to the input, taken from the example store
+NUM_EXAMPLES = 4
 
 # Define the prompt template for few-shot classification
 prompt = ChatPromptTemplate.from_template("""
 Task: Analyze the following tweets and determine if the author’s stance is in FAVOR of or AGAINST the specified target entity.
 Target Entity: Awami League
 
+Examples:
+{examples}
+
+Tweet: "{tweet}"
+Stance:
+""")
+
+# Prompt template that classifies several numbered tweets in one request
+packed_prompt = ChatPromptTemplate.from_template("""
+Task: Analyze the following numbered tweets and determine if each author’s stance is in FAVOR of or AGAINST the specified target entity.
+Target Entity: Awami League
+
 Examples:
 Tweet: "The country is moving forward under the leadership of Sheikh Hasina. #AwamiLeague"
 Stance: Favor
@@ -27,10 +49,22 @@ Stance: Favor
 Tweet: "Corruption is rampant, and the government is not listening to the people. #Bangladesh"
 Stance: Against
 
-Tweet: "{tweet}"
-Stance:
+Return one prediction per tweet, using the tweet's number as its id and FAVOR or AGAINST as its stance.
+
+Tweets:
+{tweets}
 """)
 
+def build_messages(tweet, k=NUM_EXAMPLES):
+    """
+    Render the few-shot prompt with the `k` labeled tweets most similar to
+    `tweet` as examples, or DEFAULT_EXAMPLES without an example store
+    """
+    from example_store import format_examples, select_examples
+
+    examples = select_examples(tweet, k=k, default=DEFAULT_EXAMPLES)
+    return prompt.format_messages(tweet=tweet, examples=format_examples(examples))
+
 def classify_stance_few_shot(tweet):
     """
     Classify the stance of a tweet towards the Awami League using few-shot examples.
@@ -41,13 +75,41 @@ def classify_stance_few_shot(tweet):
     Returns:
     str: The stance expressed in the tweet (FAVOR or AGAINST)
     """
-    # Invoke the language model with the prompt
-    result = prompt | llm.invoke({"tweet": tweet})
+    # Render the prompt and reuse a cached completion for identical requests
+    messages = build_messages(tweet)
+
+    llm = get_llm()
+
+    def request():
+        message = call_with_retries(lambda: llm.invoke(messages))
+        tracing.add_usage(message)
+        return message.content
+
+    with tracing.span("llm.classify", strategy="few_shot"):
+        result = cached_completion(
+            llm.model_name,
+            messages,
+            {"temperature": llm.temperature},
+            request
+        )
     
     # Extract and return the stance from the result
     stance = result.strip()  # Assuming the model returns a simple stance
     return stance
 
+def classify_stance_few_shot_packed(tweets, pack_size=10):
+    """
+    Classify many tweets with `pack_size` tweets per request, sending the few-shot examples once per request.
+    
+    Parameters:
+    tweets (list): The tweet texts to analyze
+    pack_size (int): Tweets per request
+    
+    Returns:
+    list: FAVOR, AGAINST or None (no valid answer) per tweet
+    """
+    return classify_packed(tweets, packed_prompt, get_llm(), pack_size=pack_size)
+
 # Example usage
 if __name__ == "__main__":
     new_tweet = "The economic policies are benefiting everyone. #AwamiLeague"
@@ -1,19 +1,36 @@
 from dotenv import load_dotenv
-import os
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+import resources
+import tracing
+from llm_cache import cached_completion
+from rate_limiter import call_with_retries
 
 # Load environment variables
 load_dotenv()
 
-# Initialize clients
-client = OpenAI(
-    base_url="https://api.openrouter.ai/v1",  
-    api_key=os.getenv("OPENROUTER_API_KEY")   
-)
+def get_llm():
+    """The shared gpt-4o chat model, created on first use"""
+    return resources.chat_model("gpt-4o")
 
-# Initialize the language model
-llm = ChatOpenAI(client=client, model="gpt-4o")  # Ensure the client is passed correctly
+# `llm` and `client` stay available as module attributes but are only built when first used
+__getattr__ = resources.lazy_attributes(__name__, llm=get_llm, client=resources.openrouter_client)
+
+# Demonstrations used when no example store has been built
+DEFAULT_EXAMPLES = [
+    {
+        "text": "The country is moving forward under the leadership of Sheikh Hasina. #AwamiLeague",
+        "context": "Sheikh Hasina is the leader of the Awami League and has been praised for infrastructure development.",
+        "stance": "FAVOR",
+    },
+    {
+        "text": "Corruption is rampant, and the government is not listening to the people. #Bangladesh",
+        "context": "The Awami League has been criticized in the media for alleged corruption and authoritarian practices.",
+        "stance": "AGAINST",
+    },
+]
+
+# Labeled tweets most similar to the input, with their stored graph context
+NUM_EXAMPLES = 3
 
 # Define the prompt template for few-shot classification with context
 prompt = ChatPromptTemplate.from_template("""
@@ -21,19 +38,23 @@ Task: Analyze the following tweets and determine if the author’s stance is in
 Target Entity: Awami League
 
 Examples:
-Tweet: "The country is moving forward under the leadership of Sheikh Hasina. #AwamiLeague"
-Context: "Sheikh Hasina is the leader of the Awami League and has been praised for infrastructure development."
-Stance: Favor
-
-Tweet: "Corruption is rampant, and the government is not listening to the people. #Bangladesh"
-Context: "The Awami League has been criticized in the media for alleged corruption and authoritarian practices."
-Stance: Against
+{examples}
 
 Tweet: "{tweet}"
 Context: "{context}"
 Stance:
 """)
 
+def build_messages(tweet, context, k=NUM_EXAMPLES):
+    """
+    Render the prompt with the `k` labeled tweets most similar to `tweet`,
+    and their context, as examples; DEFAULT_EXAMPLES without an example store
+    """
+    from example_store import format_examples, select_examples
+
+    examples = select_examples(tweet, k=k, default=DEFAULT_EXAMPLES)
+    return prompt.format_messages(tweet=tweet, context=context, examples=format_examples(examples, with_context=True))
+
 def classify_stance_with_context(tweet, context):
     """
     Classify the stance of a tweet towards the Awami League using few-shot examples and context.
@@ -45,8 +66,23 @@ def classify_stance_with_context(tweet, context):
     Returns:
     str: The stance expressed in the tweet (FAVOR or AGAINST)
     """
-    # Invoke the language model with the prompt
-    result = prompt | llm.invoke({"tweet": tweet, "context": context})
+    # Render the prompt and reuse a cached completion for identical requests
+    messages = build_messages(tweet, context)
+
+    llm = get_llm()
+
+    def request():
+        message = call_with_retries(lambda: llm.invoke(messages))
+        tracing.add_usage(message)
+        return message.content
+
+    with tracing.span("llm.classify", strategy="few_shot_rag"):
+        result = cached_completion(
+            llm.model_name,
+            messages,
+            {"temperature": llm.temperature},
+            request
+        )
     
     # Extract and return the stance from the result
     stance = result.strip()  # Assuming the model returns a simple stance
@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import pickle
+import sqlite3
+import threading
+import time
+import tracing
+
+
+def chunk_hash(chunk):
+    """Content fingerprint of a chunk, so identical text from different articles shares one entry."""
+    return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+
+
+class ChunkStore:
+    """
+    SQLite store of extracted GraphDocuments keyed by chunk hash.
+
+    A chunk is extracted by the LLM at most once. Each entry also records
+    whether its graph documents have been written to the graph, so an
+    interrupted build resumes with the writes that are still missing, and a
+    fresh graph can be rebuilt from the store without any LLM calls.
+
+    Parameters:
+    path (str): SQLite database file
+    """
+
+    def __init__(self, path=".graph_chunks.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chunks (
+                hash TEXT PRIMARY KEY,
+                source TEXT,
+                graph_documents BLOB NOT NULL,
+                written INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """Return (graph_documents, written) for a chunk hash, or None if it was never extracted."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT graph_documents, written FROM chunks WHERE hash = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0]), bool(row[1])
+
+    def put(self, key, graph_documents, source=None):
+        """Store the extracted graph documents of a chunk, not yet marked as written."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chunks (hash, source, graph_documents, written, created_at) VALUES (?, ?, ?, 0, ?)",
+                (key, source, pickle.dumps(graph_documents), time.time())
+            )
+            self._conn.commit()
+
+    def mark_written(self, keys):
+        """Record that the graph documents of these chunks are in the graph."""
+        with self._lock:
+            self._conn.executemany("UPDATE chunks SET written = 1 WHERE hash = ?", [(key,) for key in keys])
+            self._conn.commit()
+
+    def reset_written(self):
+        """Mark every chunk as unwritten, e.g. after the graph database was wiped."""
+        with self._lock:
+            self._conn.execute("UPDATE chunks SET written = 0")
+            self._conn.commit()
+
+    def __iter__(self):
+        """Yield (hash, graph_documents) for every stored chunk."""
+        with self._lock:
+            rows = self._conn.execute("SELECT hash, graph_documents FROM chunks").fetchall()
+        for key, blob in rows:
+            yield key, pickle.loads(blob)
+
+    def stats(self):
+        """Stored chunk count and how many of them are written to the graph."""
+        with self._lock:
+            total, written = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(written), 0) FROM chunks"
+            ).fetchone()
+        return {"chunks": total, "written": written}
+
+    def close(self):
+        self._conn.close()
+
+
+async def _call(fn, *args):
+    """Await `fn(*args)`; synchronous callables run in a worker thread."""
+    if asyncio.iscoroutinefunction(fn):
+        return await fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+async def ingest_entities(entity_names, load_documents, split_documents, extract_graph, write_graph,
+                          fetch_concurrency=4, extract_concurrency=8, write_batch_size=50, queue_size=64,
+                          store=None):
+    """
+    Pipelined knowledge-graph ingestion.
+
+    Three stages run at the same time, connected by bounded queues:
+    document fetching per entity, graph extraction per chunk, and batched graph
+    writes. A full queue makes the stage before it wait, so memory stays bounded
+    however many entities are ingested. Every stage is passed in as a callable
+    (sync or async), so the engine can run against local stand-ins for
+    Wikipedia, the LLM and Neo4j.
+
+    With a ChunkStore the build is incremental: chunks are fingerprinted by
+    content hash, duplicates are dropped, chunks already written are skipped,
+    and chunks extracted earlier but not yet written go straight to the writer
+    without an LLM call.
+
+    Parameters:
+    entity_names (iterable): Entity names to ingest
+    load_documents (callable): name -> list of Documents
+    split_documents (callable): list of Documents -> list of chunk Documents
+    extract_graph (callable): list of chunks -> list of GraphDocuments
+    write_graph (callable): list of GraphDocuments -> None, called once per batch
+    fetch_concurrency (int): Entities fetched at the same time
+    extract_concurrency (int): Chunks sent to the LLM at the same time
+    write_batch_size (int): GraphDocuments per graph write
+    queue_size (int): Capacity of each queue between stages
+    store (ChunkStore): Optional store of extracted chunks for incremental builds
+
+    Returns:
+    dict: Counts of entities, extracted, reused and skipped chunks, graph documents,
+          writes and errors, plus elapsed seconds
+    """
+    names = iter(entity_names)
+    chunk_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue = asyncio.Queue(maxsize=queue_size)
+    stats = {"entities": 0, "chunks": 0, "reused": 0, "skipped": 0, "graph_documents": 0, "writes": 0, "errors": 0}
+    seen = set()
+    start = time.perf_counter()
+
+    async def fetch_worker():
+        # Workers pull from a shared iterator so only `fetch_concurrency` entities are in flight
+        for name in names:
+            print(f"Processing entity: {name}")
+            try:
+                with tracing.span("ingest.fetch", entity=name) as span:
+                    documents = await _call(load_documents, name)
+                    chunks = await _call(split_documents, documents) if documents else []
+                    span.set("chunks", len(chunks))
+            except Exception as e:
+                print(f"Error fetching entity {name}: {e}")
+                stats["errors"] += 1
+                continue
+            stats["entities"] += 1
+            for chunk in chunks:
+                key = chunk_hash(chunk)
+                if key in seen:
+                    stats["skipped"] += 1
+                    continue
+                seen.add(key)
+                stored = store.get(key) if store is not None else None
+                if stored is None:
+                    await chunk_queue.put((key, name, chunk))
+                elif stored[1]:
+                    stats["skipped"] += 1
+                else:
+                    # Extracted in an earlier run but never written
+                    stats["reused"] += 1
+                    await write_queue.put((key, stored[0]))
+
+    async def extract_worker():
+        while True:
+            item = await chunk_queue.get()
+            if item is None:
+                return
+            key, name, chunk = item
+            try:
+                with tracing.span("ingest.extract", entity=name):
+                    graph_documents = await _call(extract_graph, [chunk])
+            except Exception as e:
+                print(f"Error extracting graph from chunk: {e}")
+                stats["errors"] += 1
+                continue
+            stats["chunks"] += 1
+            if store is not None:
+                store.put(key, graph_documents, source=name)
+            await write_queue.put((key, graph_documents))
+
+    async def write_worker():
+        batch, keys = [], []
+
+        async def flush():
+            try:
+                with tracing.span("graph.write", graph_documents=len(batch)):
+                    await _call(write_graph, batch)
+                stats["graph_documents"] += len(batch)
+                stats["writes"] += 1
+                if store is not None:
+                    store.mark_written(keys)
+            except Exception as e:
+                print(f"Error writing {len(batch)} graph documents: {e}")
+                stats["errors"] += 1
+
+        while True:
+            item = await write_queue.get()
+            if item is None:
+                break
+            key, graph_documents = item
+            # A chunk's graph documents always land in the same batch
+            batch.extend(graph_documents)
+            keys.append(key)
+            if len(batch) >= write_batch_size:
+                await flush()
+                batch, keys = [], []
+        if batch or keys:
+            await flush()
+
+    fetchers = [asyncio.create_task(fetch_worker()) for _ in range(max(1, fetch_concurrency))]
+    extractors = [asyncio.create_task(extract_worker()) for _ in range(max(1, extract_concurrency))]
+    writer = asyncio.create_task(write_worker())
+
+    # Shut the stages down in order once the previous stage has drained
+    await asyncio.gather(*fetchers)
+    for _ in extractors:
+        await chunk_queue.put(None)
+    await asyncio.gather(*extractors)
+    await write_queue.put(None)
+    await writer
+
+    stats["elapsed"] = time.perf_counter() - start
+    print(f"Ingested {stats['entities']} entities, {stats['chunks']} new chunks "
+          f"({stats['reused']} reused, {stats['skipped']} skipped) and "
+          f"{stats['graph_documents']} graph documents in {stats['elapsed']:.1f}s ({stats['errors']} errors)")
+    return stats
+
+
+def replay_store(store, write_graph, write_batch_size=50):
+    """
+    Write every graph document in `store` to the graph without any LLM calls,
+    e.g. to rebuild a fresh database.
+
+    Returns:
+    int: Number of graph documents written
+    """
+    batch, keys, written = [], [], 0
+    for key, graph_documents in store:
+        batch.extend(graph_documents)
+        keys.append(key)
+        if len(batch) >= write_batch_size:
+            write_graph(batch)
+            store.mark_written(keys)
+            written += len(batch)
+            batch, keys = [], []
+    if batch or keys:
+        write_graph(batch)
+        store.mark_written(keys)
+        written += len(batch)
+    return written
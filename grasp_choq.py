@@ -1,37 +1,118 @@
 from dotenv import load_dotenv
-import os
+import threading
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+import resources
+import tracing
+from llm_cache import cached_completion
+from rate_limiter import call_with_retries
+from context_budget import dedupe, fit_to_budget
 
 # Load environment variables
 load_dotenv()
 
-# Initialize clients
-client = OpenAI(
-    base_url="https://api.openrouter.ai/v1",  
-    api_key=os.getenv("OPENROUTER_API_KEY")   
-)
+def get_llm():
+    """The shared gpt-4o chat model, created on first use"""
+    return resources.chat_model("gpt-4o")
 
-# Initialize the language model
-llm = ChatOpenAI(client=client, model="gpt-4o")  # Ensure the client is passed correctly
+# `llm` and `client` stay available as module attributes but are only built when first used
+__getattr__ = resources.lazy_attributes(__name__, llm=get_llm, client=resources.openrouter_client)
 
 # Define the prompt template for GRASP-ChoQ
-prompt = ChatPromptTemplate.from_template("""
-Tweet: {tweet}
-Read the tweet above. The tweet has a political stance. It may express a view either in favor of the Awami League of Bangladesh or against it.
+# Static instructions and the Chain-of-Question demonstration come first and the
+# tweet-specific parts last, so providers that cache prompt prefixes can reuse them
+prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", """Read the tweet given at the end. The tweet has a political stance. It may express a view either in favor of the Awami League of Bangladesh or against it.
 Detect the stance of the tweet with respect to the Awami League. Use reasoning based on political references or implied affiliations.
 
 ASK QUESTIONS TO DETECT STANCE:
+Example tweet: The head of the UN Human Rights Commission’s visit to Bangladesh raises concerns over the illegal Yunus government!
 Q: Who is being criticized here?
 A: Muhammad Yunus. Because the tweet uses "illegal" to describe him. Since Yunus is opposed to Sheikh Hasina (leader of Awami League), this implies support for Awami League.
 Q: Which government is depicted in power in the tweet?
 A: Muhammad Yunus’s government. As he is seen to follow Hasina, and is portrayed negatively, the stance favors the Awami League.
 
-To aid your decision, general background knowledge about political figures and affiliations is provided.
-TWEET_INFO: {tweet_info}
+To aid your decision, general background knowledge about political figures and affiliations is provided with the tweet.
+After your questions and answers, finish with a final line `Stance: FAVOR` or `Stance: AGAINST`."""),
+        ("human", """{examples}TWEET_INFO: {tweet_info}
 GENERAL_INFO: {relational_text}
 EXTRA_INFO: {unstructured_data}
-""")
+Tweet: {tweet}"""),
+    ]
+)
+
+# Labeled tweets most similar to the input, shown with the tweet when an example store has been built
+NUM_EXAMPLES = 3
+
+# Token budgets for the retrieved context
+RELATIONAL_TOKEN_BUDGET = 600
+UNSTRUCTURED_TOKEN_BUDGET = 800
+
+# Prompt tokens reported by the provider, split into cached and uncached
+prompt_cache_stats = {"requests": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0}
+_stats_lock = threading.Lock()
+
+def record_usage(message):
+    """
+    Add the prompt token counts of a response to prompt_cache_stats
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    cached = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    with _stats_lock:
+        prompt_cache_stats["requests"] += 1
+        prompt_cache_stats["prompt_tokens"] += usage.get("input_tokens", 0)
+        prompt_cache_stats["cached_prompt_tokens"] += cached
+
+def prompt_cache_report():
+    """
+    Cached vs uncached prompt tokens over all calls so far
+    """
+    with _stats_lock:
+        total = prompt_cache_stats["prompt_tokens"]
+        cached = prompt_cache_stats["cached_prompt_tokens"]
+        return {
+            "requests": prompt_cache_stats["requests"],
+            "prompt_tokens": total,
+            "cached_prompt_tokens": cached,
+            "uncached_prompt_tokens": total - cached,
+            "cached_ratio": cached / total if total else 0.0,
+        }
+
+def format_similar_tweets(tweet, k=NUM_EXAMPLES):
+    """
+    The SIMILAR_TWEETS block: the `k` labeled tweets closest to `tweet`, or an
+    empty string without an example store. The Chain-of-Question
+    demonstration stays in the static system message, so the prompt prefix
+    is unchanged.
+    """
+    from example_store import format_examples, select_examples
+
+    examples = select_examples(tweet, k=k)
+    if not examples:
+        return ""
+    return f"SIMILAR_TWEETS (labeled with their stance towards the Awami League):\n{format_examples(examples)}\n"
+
+def build_messages(tweet, tweet_info, relational_text, unstructured_data,
+                   relational_budget=RELATIONAL_TOKEN_BUDGET, unstructured_budget=UNSTRUCTURED_TOKEN_BUDGET,
+                   k=NUM_EXAMPLES):
+    """
+    Render the GRASP-ChoQ prompt. Relational triples and retrieved chunks are
+    deduplicated and trimmed to their token budgets, keeping the earliest ones.
+    The `k` most similar labeled tweets from the example store precede the tweet's context.
+    """
+    relational_text = fit_to_budget(dedupe(str(relational_text).splitlines()), relational_budget)
+    unstructured_data = fit_to_budget(
+        dedupe(str(unstructured_data).split("#Document ")),
+        unstructured_budget,
+        separator="#Document "
+    )
+    return prompt.format_messages(
+        examples=format_similar_tweets(tweet, k=k),
+        tweet=tweet,
+        tweet_info=tweet_info,
+        relational_text=relational_text,
+        unstructured_data=unstructured_data
+    )
 
 def detect_stance_grasp_choq(tweet, tweet_info, relational_text, unstructured_data):
     """
@@ -46,13 +127,24 @@ def detect_stance_grasp_choq(tweet, tweet_info, relational_text, unstructured_da
     Returns:
     str: The stance expressed in the tweet (FAVOR or AGAINST)
     """
-    # Invoke the language model with the prompt
-    result = prompt | llm.invoke({
-        "tweet": tweet,
-        "tweet_info": tweet_info,
-        "relational_text": relational_text,
-        "unstructured_data": unstructured_data
-    })
+    # Render the prompt and reuse a cached completion for identical requests
+    messages = build_messages(tweet, tweet_info, relational_text, unstructured_data)
+
+    llm = get_llm()
+
+    def request():
+        message = call_with_retries(lambda: llm.invoke(messages))
+        record_usage(message)
+        tracing.add_usage(message)
+        return message.content
+
+    with tracing.span("llm.classify", strategy="grasp_choq"):
+        result = cached_completion(
+            llm.model_name,
+            messages,
+            {"temperature": llm.temperature},
+            request
+        )
     
     # Extract and return the stance from the result
     stance = result.strip()  # Assuming the model returns a simple stance
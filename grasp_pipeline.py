@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import os
+import time
+import pandas as pd
+import tracing
+from checkpoint import CheckpointWriter, read_records
+from example_store import held_out_rows
+from metrics import LatencyHistogram
+from rate_limiter import TokenBucket
+from stance_runner import classify_async, load_rows, prefetch_strategy_examples
+
+
+def make_retrieve(backend=None, cache=None, extractor=None, max_tokens=None, embeddings=None):
+    """
+    Retrieval stage backed by retrieve_from_graph.
+    Returns a function tweet -> (relational_text, unstructured_data).
+    With `max_tokens` the context is ranked by relevance and trimmed to that budget.
+    """
+    import retrieve_from_graph
+
+    def retrieve(tweet):
+        if max_tokens is not None:
+            relational_text, chunks = retrieve_from_graph.compiled_retriever(
+                tweet, backend=backend, cache=cache, extractor=extractor, max_tokens=max_tokens, embeddings=embeddings
+            )
+        else:
+            relational_text = retrieve_from_graph.structured_retriever(tweet, backend=backend, cache=cache, extractor=extractor)
+            chunks = retrieve_from_graph.unstructured_retriever(tweet, backend=backend, cache=cache)
+        return relational_text, "#Document ".join(chunks)
+
+    return retrieve
+
+
+class StageStats:
+    """Per-stage counters: latency histogram, queue wait, busy time and errors."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = LatencyHistogram()
+        self.queue_wait = LatencyHistogram()
+        self.errors = 0
+
+    def report(self, wall_time):
+        summary = self.latency.summary()
+        return {
+            "stage": self.name,
+            "rows": summary["count"],
+            "errors": self.errors,
+            "rows_per_sec": summary["count"] / wall_time if wall_time > 0 else 0.0,
+            "latency_p50": summary["p50"],
+            "latency_p99": summary["p99"],
+            "busy_sec": self.latency.total,
+            "queue_wait_p50": self.queue_wait.quantile(0.5),
+        }
+
+
+async def run_grasp_pipeline_async(rows, output_file, retrieve, retrieval_workers=4, classify_workers=16,
+                                   queue_size=32, requests_per_second=5.0, max_retries=5, sync_interval=2.0):
+    """
+    GRASP-ChoQ over many tweets with retrieval and classification overlapped.
+
+    Retrieval runs in `retrieval_workers` threads and feeds a bounded queue
+    that `classify_workers` async workers drain. While the LLM classifies tweet
+    N, the graph is already serving tweet N+k. A full queue pauses retrieval, so
+    at most `queue_size` retrieved tweets wait in memory. Rows already
+    classified in `output_file` are skipped.
+
+    Parameters:
+    rows (list): (row ID, prompt inputs, label) triples from stance_runner.load_rows
+    output_file (str): JSONL file that gets one record per tweet
+    retrieve (callable): tweet -> (relational_text, unstructured_data), e.g. from make_retrieve
+
+    Returns:
+    DataFrame: One report row per stage
+    """
+    done = {record["row"] for record in read_records(output_file) if "stance" in record}
+    pending_rows = [row for row in rows if row[0] not in done]
+    prefetch_strategy_examples("grasp_choq", pending_rows)
+    pending = iter(pending_rows)
+    queue = asyncio.Queue(maxsize=queue_size)
+    limiter = TokenBucket(requests_per_second, capacity=max(1.0, requests_per_second))
+    writer = CheckpointWriter(output_file, sync_interval=sync_interval)
+    retrieval = StageStats("retrieval")
+    classification = StageStats("classification")
+    start = time.perf_counter()
+
+    async def retrieval_worker():
+        for row_id, inputs, label in pending:
+            stage_start = time.perf_counter()
+            try:
+                # Spans opened inside `retrieve` nest under this one (to_thread copies the context)
+                with tracing.span("pipeline.retrieve"):
+                    relational_text, unstructured_data = await asyncio.to_thread(retrieve, inputs["tweet"])
+            except Exception as e:
+                print(f"Error retrieving context for row {row_id}: {e}")
+                retrieval.errors += 1
+                writer.write({"row": row_id, "error": f"retrieval: {e}"})
+                continue
+            retrieval_latency = time.perf_counter() - stage_start
+            retrieval.latency.observe(retrieval_latency)
+            inputs = {**inputs, "relational_text": relational_text, "unstructured_data": unstructured_data}
+            await queue.put((row_id, inputs, label, retrieval_latency, time.perf_counter()))
+
+    async def classify_worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            row_id, inputs, label, retrieval_latency, queued_at = item
+            queue_wait = time.perf_counter() - queued_at
+            classification.queue_wait.observe(queue_wait)
+            stage_start = time.perf_counter()
+            try:
+                with tracing.span("pipeline.classify", queue_wait=queue_wait):
+                    result = await classify_async("grasp_choq", inputs, limiter=limiter, max_retries=max_retries)
+                latency = time.perf_counter() - stage_start
+                classification.latency.observe(latency)
+                writer.write({"row": row_id, "label": label, "retrieval_latency": retrieval_latency,
+                              "latency": latency, **result})
+            except Exception as e:
+                print(f"Error classifying row {row_id}: {e}")
+                classification.errors += 1
+                writer.write({"row": row_id, "error": str(e)})
+
+    retrievers = [asyncio.create_task(retrieval_worker()) for _ in range(max(1, retrieval_workers))]
+    classifiers = [asyncio.create_task(classify_worker()) for _ in range(max(1, classify_workers))]
+    try:
+        await asyncio.gather(*retrievers)
+        for _ in classifiers:
+            await queue.put(None)
+        await asyncio.gather(*classifiers)
+    finally:
+        writer.close()
+
+    wall_time = time.perf_counter() - start
+    report = pd.DataFrame([retrieval.report(wall_time), classification.report(wall_time)])
+    print(f"Pipeline finished in {wall_time:.1f}s")
+    print(report.to_string(index=False))
+    print("Time, tokens and retries by operation:")
+    tracing.get_tracer().print_summary()
+    return report
+
+
+def run_grasp_pipeline(input_file, output_file="predictions/grasp_choq_pipeline.jsonl", backend=None,
+                       cache=None, extractor=None, max_tokens=None, text_column="translation",
+                       label_column="label", id_column=None, **kwargs):
+    """
+    Load a dataset and run the pipelined GRASP-ChoQ classifier over it
+    (see run_grasp_pipeline_async for the worker and queue options)
+    """
+    # The context is retrieved per tweet, so no context column is read
+    rows = load_rows(input_file, text_column=text_column, context_column=None, label_column=label_column,
+                     id_column=id_column)
+    rows = held_out_rows(rows, input_file, id_column)
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    retrieve = make_retrieve(backend=backend, cache=cache, extractor=extractor, max_tokens=max_tokens,
+                             embeddings=getattr(backend, "embeddings", None))
+    return asyncio.run(run_grasp_pipeline_async(rows, output_file, retrieve, **kwargs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipelined retrieval + GRASP-ChoQ classification")
+    parser.add_argument("input_file", nargs="?", default="BPDisC_translated.xlsx")
+    parser.add_argument("--output-file", default="predictions/grasp_choq_pipeline.jsonl")
+    parser.add_argument("--snapshot", default=None, help="Use a local_graph snapshot instead of Neo4j")
+    parser.add_argument("--retrieval-workers", type=int, default=4)
+    parser.add_argument("--classify-workers", type=int, default=16)
+    parser.add_argument("--queue-size", type=int, default=32)
+    parser.add_argument("--requests-per-second", type=float, default=5.0)
+    parser.add_argument("--max-context-tokens", type=int, default=None)
+    parser.add_argument("--trace-file", default=None, help="Append spans to this file as OTLP/JSON lines")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address the metrics endpoint binds to")
+    args = parser.parse_args()
+
+    if args.metrics_port is not None:
+        tracing.serve_metrics(args.metrics_port, host=args.metrics_host)
+    if args.trace_file:
+        tracing.get_tracer().stream_to(args.trace_file)
+
+    backend = None
+    if args.snapshot:
+        import resources
+        from local_graph import LocalGraph
+        backend = LocalGraph.load(args.snapshot, embeddings=resources.embeddings())
+
+    run_grasp_pipeline(
+        args.input_file,
+        output_file=args.output_file,
+        backend=backend,
+        max_tokens=args.max_context_tokens,
+        retrieval_workers=args.retrieval_workers,
+        classify_workers=args.classify_workers,
+        queue_size=args.queue_size,
+        requests_per_second=args.requests_per_second
+    )
@@ -1,74 +1,137 @@
 import os
 from dotenv import load_dotenv
-from langchain_community.graphs import Neo4jGraph
-from langchain_community.document_loaders import WikipediaLoader
-from langchain.text_splitter import TokenTextSplitter
-from langchain_experimental.graph_transformers import LLMGraphTransformer
 import pandas as pd
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import Neo4jVector
+import asyncio
+from graph_ingestion import ChunkStore, ingest_entities, replay_store
+import resources
+import tracing
+from rate_limiter import call_with_retries, call_with_retries_async
 
 # Load environment variables
 load_dotenv()
 
-# Neo4j connection
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-
-# Initialize Neo4j graph
-graph = Neo4jGraph(
-    url=NEO4J_URI,
-    username=NEO4J_USERNAME,
-    password=NEO4J_PASSWORD
-)
-
-# Initialize clients
-llm = OpenAI(
-    base_url="https://api.openrouter.ai/v1",  
-    api_key=os.getenv("OPENROUTER_API_KEY")   
+# The Neo4j connection, graph-extraction LLM, MiniLM embeddings and hybrid
+# vector index are created on first use and shared through the resource
+# registry; they stay available as module attributes
+__getattr__ = resources.lazy_attributes(
+    __name__,
+    graph=resources.neo4j_graph,
+    llm=resources.chat_model,
+    embeddings=resources.embeddings,
+    vector_index=resources.vector_index
 )
 
-# Initialize embeddings using a HuggingFace model
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-# Create a vector store instance from the existing graph
-vector_index = Neo4jVector.from_existing_graph(
-    embeddings,
-    search_type="hybrid",
-    node_label="Document",
-    text_node_properties=["text"],
-    embedding_node_property="embedding"
-)
+def stamp_graph_build(graph):
+    """
+    Record a new build version on the graph's single GraphBuild node.
+    Called after every write to the graph; retrieve_from_graph.graph_build_version
+    reads it to invalidate retrieval caches.
+    """
+    graph.query(
+        """MERGE (b:GraphBuild {id: 'current'})
+        SET b.version = randomUUID(), b.built_at = datetime()"""
+    )
 
 def build_knowledge_graph_from_entities(entities_df):
     """
     Build knowledge graph from the top 20 entities
     """
+    from langchain_community.document_loaders import WikipediaLoader
+    from langchain.text_splitter import TokenTextSplitter
+    from langchain_experimental.graph_transformers import LLMGraphTransformer
+
     # Initialize LLM for graph transformation
-    llm_transformer = LLMGraphTransformer(llm=llm)  # Use the initialized OpenAI client
+    llm_transformer = LLMGraphTransformer(llm=resources.chat_model())
+    graph = resources.neo4j_graph()
 
     # Process top 20 entities
-    for _, row in entities_df.head(20).iterrows():
-        entity_name = row['Word']
-        print(f"Processing entity: {entity_name}")
-        
-        # Step 1: Load Wikipedia content using a query
-        raw_documents = WikipediaLoader(query=entity_name).load()
-        
-        if not raw_documents:
-            continue
-        
-        # Step 2: Split documents into token-sized chunks
-        text_splitter = TokenTextSplitter(chunk_size=256, chunk_overlap=50)
-        documents = text_splitter.split_documents(raw_documents)
-        
-        # Step 3: Convert document chunks into graph-structured format
-        graph_documents = llm_transformer.convert_to_graph_documents(documents)
-        
-        # Step 4: Add graph documents to the knowledge graph
+    try:
+        for _, row in entities_df.head(20).iterrows():
+            entity_name = row['Word']
+            print(f"Processing entity: {entity_name}")
+            
+            # Step 1: Load Wikipedia content using a query
+            raw_documents = WikipediaLoader(query=entity_name).load()
+            
+            if not raw_documents:
+                continue
+            
+            # Step 2: Split documents into token-sized chunks
+            text_splitter = TokenTextSplitter(chunk_size=256, chunk_overlap=50)
+            documents = text_splitter.split_documents(raw_documents)
+            
+            # Step 3: Convert document chunks into graph-structured format
+            graph_documents = call_with_retries(lambda: llm_transformer.convert_to_graph_documents(documents))
+            
+            # Step 4: Add graph documents to the knowledge graph
+            graph.add_graph_documents(graph_documents, baseEntityLabel=True, include_source=True)
+    finally:
+        stamp_graph_build(graph)
+
+def build_knowledge_graph_pipelined(entities_df, top_n=20, fetch_concurrency=4, extract_concurrency=8,
+                                    write_batch_size=50, queue_size=64, store_path=".graph_chunks.sqlite"):
+    """
+    Build the knowledge graph from the top `top_n` entities with overlapping
+    fetch, extraction and write stages (see graph_ingestion.ingest_entities).
+    Extracted chunks are kept in `store_path`, so reruns only pay for new chunks;
+    pass store_path=None to extract everything again.
+    """
+    from langchain_community.document_loaders import WikipediaLoader
+    from langchain.text_splitter import TokenTextSplitter
+    from langchain_experimental.graph_transformers import LLMGraphTransformer
+
+    llm_transformer = LLMGraphTransformer(llm=resources.chat_model())
+    graph = resources.neo4j_graph()
+    text_splitter = TokenTextSplitter(chunk_size=256, chunk_overlap=50)
+
+    def load_documents(entity_name):
+        return WikipediaLoader(query=entity_name).load()
+
+    def write_graph(graph_documents):
         graph.add_graph_documents(graph_documents, baseEntityLabel=True, include_source=True)
 
+    async def extract_graph(chunks):
+        return await call_with_retries_async(lambda: llm_transformer.aconvert_to_graph_documents(chunks))
+
+    store = ChunkStore(store_path) if store_path else None
+    try:
+        stats = asyncio.run(ingest_entities(
+            entities_df['Word'].head(top_n),
+            load_documents=load_documents,
+            split_documents=text_splitter.split_documents,
+            extract_graph=extract_graph,
+            write_graph=write_graph,
+            fetch_concurrency=fetch_concurrency,
+            extract_concurrency=extract_concurrency,
+            write_batch_size=write_batch_size,
+            queue_size=queue_size,
+            store=store
+        ))
+    finally:
+        if store is not None:
+            store.close()
+        stamp_graph_build(graph)
+    tracing.get_tracer().print_summary()
+    return stats
+
+def rebuild_knowledge_graph_from_store(store_path=".graph_chunks.sqlite", write_batch_size=50):
+    """
+    Re-ingest every stored GraphDocument into the graph without any LLM calls
+    """
+    graph = resources.neo4j_graph()
+    store = ChunkStore(store_path)
+    try:
+        written = replay_store(
+            store,
+            lambda graph_documents: graph.add_graph_documents(graph_documents, baseEntityLabel=True, include_source=True),
+            write_batch_size=write_batch_size
+        )
+    finally:
+        store.close()
+        stamp_graph_build(graph)
+    print(f"Re-ingested {written} graph documents from '{store_path}'")
+    return written
+
 if __name__ == "__main__":
     # Load entities from the CSV file
     entities_file = r"f:\EUCLIDO\Tasks\_____self\semeval-humayun\entities_for_wiki.csv"
@@ -80,4 +143,4 @@ if __name__ == "__main__":
         entities_df = pd.read_csv(entities_file)
         
         # Build knowledge graph
-        build_knowledge_graph_from_entities(entities_df)
\ No newline at end of file
+        build_knowledge_graph_pipelined(entities_df)
\ No newline at end of file
@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import tracing
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+CACHE_MODES = ("readwrite", "replay", "off")
+
+# Hits buffered before their accessed_at timestamps are written back
+ACCESS_FLUSH_EVERY = 100
+
+
+class CacheMiss(KeyError):
+    """Raised in replay mode when a request has no cached response."""
+
+
+def render_messages(messages):
+    """
+    Convert a prompt into a JSON-serialisable form for hashing.
+    Accepts a plain string, OpenAI-style message dicts or LangChain messages.
+    """
+    if isinstance(messages, str):
+        return messages
+    rendered = []
+    for message in messages:
+        if isinstance(message, dict):
+            rendered.append({"role": message.get("role"), "content": message.get("content")})
+        else:
+            rendered.append({"role": getattr(message, "type", None), "content": message.content})
+    return rendered
+
+
+def make_cache_key(model, prompt, params=None):
+    """
+    Content-addressed key: SHA-256 over model, rendered prompt and sampling parameters.
+    """
+    payload = json.dumps(
+        {"model": model, "prompt": render_messages(prompt), "params": params or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Disk-backed LLM response cache stored in SQLite.
+
+    Parameters:
+    path (str): SQLite database file
+    mode (str): "readwrite" (normal), "replay" (read-only, misses raise CacheMiss) or "off"
+    max_entries (int): Evict least recently used responses beyond this many entries
+    max_bytes (int): Evict least recently used responses beyond this total size
+    max_age (float): Treat responses older than this many seconds as expired
+    """
+
+    def __init__(self, path=".llm_cache.sqlite", mode="readwrite", max_entries=None,
+                 max_bytes=None, max_age=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode '{mode}'. Use one of {CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._pending_access = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        if mode == "off":
+            return
+        if mode == "replay":
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Replay mode needs an existing cache file: {path}")
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            self._conn.commit()
+
+    @property
+    def enabled(self):
+        return self._conn is not None
+
+    def get(self, key):
+        """
+        Return the cached response for `key`, or None on a miss.
+        In replay mode a miss raises CacheMiss instead.
+        Hits only record their access time in memory; the timestamps are written
+        back with the next put, eviction or close, or every ACCESS_FLUSH_EVERY hits.
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                row = None
+            if row is None:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise CacheMiss(key)
+                return None
+            self.hits += 1
+            if self.mode == "readwrite":
+                self._pending_access[key] = now
+                if len(self._pending_access) >= ACCESS_FLUSH_EVERY:
+                    self._flush_access_locked()
+                    self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, value, model=None):
+        """Store a JSON-serialisable response under `key`."""
+        if self.mode != "readwrite":
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._pending_access.pop(key, None)
+            self._flush_access_locked()
+            self._conn.commit()
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= 100:
+                self._evict_locked()
+
+    def evict(self):
+        """Drop expired responses, then least recently used ones over the size limits."""
+        if self.mode != "readwrite":
+            return
+        with self._lock:
+            self._evict_locked()
+
+    def _flush_access_locked(self):
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._pending_access.items()]
+            )
+            self._pending_access.clear()
+
+    def _evict_locked(self):
+        self._writes_since_evict = 0
+        self._flush_access_locked()
+        if self.max_age is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,))
+        if self.max_entries is not None:
+            self._conn.execute(
+                """DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,)
+            )
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                cursor = self._conn.execute("SELECT key, LENGTH(value) FROM responses ORDER BY accessed_at")
+                stale = []
+                for key, size in cursor:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+        self._conn.commit()
+
+    def stats(self):
+        """Hit/miss counters plus current entry count and size."""
+        entries, size = 0, 0
+        if self.enabled:
+            with self._lock:
+                entries, size = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM responses"
+                ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            if self.mode == "readwrite":
+                with self._lock:
+                    self._flush_access_locked()
+                    self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    Process-wide cache configured from the environment:
+    LLM_CACHE_PATH, LLM_CACHE_MODE, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_MB, LLM_CACHE_MAX_AGE_DAYS
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            max_entries = os.getenv("LLM_CACHE_MAX_ENTRIES")
+            max_mb = os.getenv("LLM_CACHE_MAX_MB")
+            max_age_days = os.getenv("LLM_CACHE_MAX_AGE_DAYS")
+            _default_cache = ResponseCache(
+                path=os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite"),
+                mode=os.getenv("LLM_CACHE_MODE", "readwrite"),
+                max_entries=int(max_entries) if max_entries else None,
+                max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else None,
+                max_age=float(max_age_days) * 86400 if max_age_days else None
+            )
+        return _default_cache
+
+
+def set_default_cache(cache):
+    """Replace the process-wide cache (e.g. to switch an experiment into replay mode)."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
+
+
+def cached_completion(model, prompt, params, compute, cache=None):
+    """
+    Return the cached response for (model, prompt, params), calling `compute()` on a miss.
+    """
+    cache = cache or get_default_cache()
+    key = make_cache_key(model, prompt, params)
+    value = cache.get(key)
+    if value is not None:
+        tracing.add("cache_hits")
+        return value
+    value = compute()
+    cache.put(key, value, model=model)
+    return value
+
+
+async def cached_completion_async(model, prompt, params, compute, cache=None):
+    """
+    Async counterpart of `cached_completion`; `compute()` returns an awaitable.
+    SQLite reads and writes run in a worker thread so they never block the event loop.
+    """
+    cache = cache or get_default_cache()
+    key = make_cache_key(model, prompt, params)
+    value = await asyncio.to_thread(cache.get, key)
+    if value is not None:
+        tracing.add("cache_hits")
+        return value
+    value = await compute()
+    await asyncio.to_thread(cache.put, key, value, model=model)
+    return value
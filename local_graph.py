@@ -0,0 +1,305 @@
+import math
+import re
+import numpy as np
+from collections import Counter, defaultdict
+from langchain_core.documents import Document
+from retrieval_cache import merge_entity_triples
+
+# Lucene's standard analyzer splits on anything that is not a letter or digit
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def bounded_levenshtein(a, b, max_distance):
+    """Edit distance between a and b, or max_distance + 1 once it is certainly larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def export_snapshot(graph, path, embeddings=None):
+    """
+    Export the entity graph and Document chunks from Neo4j into a .npz snapshot.
+
+    Parameters:
+    graph (Neo4jGraph): Source graph
+    path (str): Output .npz file
+    embeddings: Optional embedding model used for Documents that have no stored embedding
+    """
+    node_ids = [row["id"] for row in graph.query("MATCH (n:__Entity__) RETURN DISTINCT n.id AS id")]
+    edges = graph.query(
+        """MATCH (s:__Entity__)-[r:!MENTIONS]->(t:__Entity__)
+        RETURN s.id AS source, type(r) AS type, t.id AS target"""
+    )
+    documents = graph.query("MATCH (d:Document) RETURN d.text AS text, d.embedding AS embedding")
+
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    rel_types = sorted({edge["type"] for edge in edges})
+    type_index = {rel_type: i for i, rel_type in enumerate(rel_types)}
+
+    texts = [doc["text"] or "" for doc in documents]
+    vectors = [doc["embedding"] for doc in documents]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        if embeddings is None:
+            raise ValueError(f"{len(missing)} Document nodes have no embedding; pass `embeddings` to compute them")
+        for i, vector in zip(missing, embeddings.embed_documents([texts[i] for i in missing])):
+            vectors[i] = vector
+    if vectors:
+        doc_embeddings = np.array(vectors, dtype=np.float32).reshape(len(texts), -1)
+    else:
+        # No Document nodes: an empty matrix, which LocalGraph searches never score against
+        doc_embeddings = np.zeros((0, 0), dtype=np.float32)
+
+    np.savez(
+        path,
+        node_ids=np.array(node_ids, dtype=str),
+        edge_source=np.array([index[edge["source"]] for edge in edges], dtype=np.int32),
+        edge_target=np.array([index[edge["target"]] for edge in edges], dtype=np.int32),
+        edge_type=np.array([type_index[edge["type"]] for edge in edges], dtype=np.int32),
+        rel_types=np.array(rel_types, dtype=str),
+        doc_texts=np.array(texts, dtype=str),
+        doc_embeddings=doc_embeddings
+    )
+    print(f"Exported {len(node_ids)} entities, {len(edges)} relationships and {len(texts)} documents to '{path}'")
+
+
+def _csr(keys, values, types, n):
+    # Sort edges by `keys` and build row pointers so row i is indptr[i]:indptr[i + 1]
+    order = np.argsort(keys, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n), out=indptr[1:])
+    return indptr, values[order], types[order]
+
+
+class LocalGraph:
+    """
+    In-process stand-in for the Neo4j retrieval used by retrieve_from_graph.
+
+    Mirrors the three operations retrieval needs:
+    - fuzzy full-text entity lookup (Lucene `word~2 AND ...` semantics, top 2 nodes)
+    - 1-hop neighborhood triples in both directions, MENTIONS excluded at export
+    - hybrid chunk search: the max of max-normalized vector and BM25 scores,
+      as in Neo4jVector(search_type="hybrid")
+
+    Adjacency is stored as CSR arrays for both edge directions and chunk
+    embeddings as one L2-normalized float32 matrix.
+
+    Parameters:
+    node_ids, edge_source, edge_target, edge_type, rel_types, doc_texts, doc_embeddings:
+        Arrays as written by export_snapshot
+    embeddings: Embedding model with `embed_query`, used for vector search
+    """
+
+    def __init__(self, node_ids, edge_source, edge_target, edge_type, rel_types, doc_texts,
+                 doc_embeddings, embeddings=None, k1=1.2, b=0.75):
+        self.node_ids = [str(node_id) for node_id in node_ids]
+        self.rel_types = [str(rel_type) for rel_type in rel_types]
+        self.embeddings = embeddings
+        n = len(self.node_ids)
+        edge_source = np.asarray(edge_source, dtype=np.int64)
+        edge_target = np.asarray(edge_target, dtype=np.int64)
+        edge_type = np.asarray(edge_type, dtype=np.int32)
+        self.out_indptr, self.out_neighbors, self.out_types = _csr(edge_source, edge_target, edge_type, n)
+        self.in_indptr, self.in_neighbors, self.in_types = _csr(edge_target, edge_source, edge_type, n)
+
+        # Full-text entity index: token -> node indices
+        self._postings = defaultdict(list)
+        for i, node_id in enumerate(self.node_ids):
+            for token in set(tokenize(node_id)):
+                self._postings[token].append(i)
+        self._vocabulary_by_length = defaultdict(list)
+        for token in self._postings:
+            self._vocabulary_by_length[len(token)].append(token)
+        self._fuzzy_cache = {}
+
+        # Chunk index: normalized embeddings plus BM25 postings
+        self.doc_texts = [str(text) for text in doc_texts]
+        matrix = np.asarray(doc_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True) if matrix.size else np.ones((0, 1), dtype=np.float32)
+        self.doc_matrix = matrix / np.maximum(norms, 1e-12)
+        self._doc_index = None
+        self._build_bm25(k1, b)
+
+    @classmethod
+    def load(cls, path, embeddings=None):
+        """Load a snapshot written by export_snapshot."""
+        with np.load(path) as snapshot:
+            return cls(**{name: snapshot[name] for name in snapshot.files}, embeddings=embeddings)
+
+    def _build_bm25(self, k1, b):
+        n_docs = len(self.doc_texts)
+        term_docs = defaultdict(list)
+        term_freqs = defaultdict(list)
+        lengths = np.zeros(n_docs, dtype=np.float32)
+        for i, text in enumerate(self.doc_texts):
+            counts = Counter(tokenize(text))
+            lengths[i] = sum(counts.values())
+            for term, tf in counts.items():
+                term_docs[term].append(i)
+                term_freqs[term].append(tf)
+        average = lengths.mean() if n_docs else 0.0
+        norm = k1 * (1 - b + b * lengths / max(average, 1e-12))
+        self._bm25 = {}
+        for term, docs in term_docs.items():
+            docs = np.array(docs, dtype=np.int64)
+            tf = np.array(term_freqs[term], dtype=np.float32)
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            self._bm25[term] = (docs, idf * tf * (k1 + 1) / (tf + norm[docs]))
+
+    def _fuzzy_terms(self, word, max_distance=2):
+        # Tokens within `max_distance` edits of `word`, with a similarity score
+        if word not in self._fuzzy_cache:
+            matches = []
+            for length in range(len(word) - max_distance, len(word) + max_distance + 1):
+                for token in self._vocabulary_by_length.get(length, ()):
+                    distance = bounded_levenshtein(word, token, max_distance)
+                    if distance <= max_distance:
+                        matches.append((token, 1.0 - distance / max(len(word), len(token))))
+            self._fuzzy_cache[word] = matches
+        return self._fuzzy_cache[word]
+
+    def search_entities(self, name, limit=2):
+        """
+        Fuzzy full-text lookup: every word of `name` must match a token of the
+        node id within two edits. Returns up to `limit` node indices, best first.
+        """
+        words = tokenize(name)
+        if not words:
+            return []
+        scores = None
+        for word in words:
+            word_scores = {}
+            for token, similarity in self._fuzzy_terms(word):
+                for node in self._postings[token]:
+                    word_scores[node] = max(word_scores.get(node, 0.0), similarity)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {node: score + word_scores[node] for node, score in scores.items() if node in word_scores}
+            if not scores:
+                return []
+        # Prefer higher scores, then shorter ids (closer to an exact match)
+        ranked = sorted(scores, key=lambda node: (-scores[node], len(self.node_ids[node])))
+        return ranked[:limit]
+
+    def neighborhood(self, node):
+        """Triples for every non-MENTIONS relationship of `node`, outgoing first."""
+        node_id = self.node_ids[node]
+        triples = []
+        start, end = self.out_indptr[node], self.out_indptr[node + 1]
+        for neighbor, rel in zip(self.out_neighbors[start:end], self.out_types[start:end]):
+            triples.append(f"{node_id} - {self.rel_types[rel]} -> {self.node_ids[neighbor]}")
+        start, end = self.in_indptr[node], self.in_indptr[node + 1]
+        for neighbor, rel in zip(self.in_neighbors[start:end], self.in_types[start:end]):
+            triples.append(f"{self.node_ids[neighbor]} - {self.rel_types[rel]} -> {node_id}")
+        return triples
+
+    def entity_neighborhoods(self, names, limit=50):
+        """
+        Same contract as retrieve_from_graph.fetch_entity_neighborhoods:
+        entity name -> up to `limit` distinct triples of its top 2 matching nodes.
+        """
+        by_entity = {}
+        for name in dict.fromkeys(names):
+            triples = []
+            for node in self.search_entities(name):
+                triples.extend(self.neighborhood(node))
+            by_entity[name] = list(dict.fromkeys(triples))[:limit]
+        return by_entity
+
+    def query_entity_neighborhoods(self, names, limit=50):
+        """
+        Same contract as retrieve_from_graph.query_entity_neighborhoods:
+        entity name -> deduplicated triples, no triple repeated across entities.
+        """
+        return merge_entity_triples(names, self.entity_neighborhoods(names, limit=limit))
+
+    def build_version(self):
+        """Entity, relationship and document counts, used to invalidate retrieval caches."""
+        return (len(self.node_ids), len(self.out_neighbors), len(self.doc_texts))
+
+    def bm25_scores(self, query):
+        scores = np.zeros(len(self.doc_texts), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term in self._bm25:
+                docs, weights = self._bm25[term]
+                scores[docs] += weights
+        return scores
+
+    def vector_scores(self, query_vectors):
+        """Scores of every document for one query vector, or a (queries, documents) matrix for several."""
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        norms = np.linalg.norm(query_vectors, axis=-1, keepdims=True)
+        query_vectors = query_vectors / np.maximum(norms, 1e-12)
+        # Cosine similarity mapped to [0, 1] like Neo4j's vector index score
+        return (1 + query_vectors @ self.doc_matrix.T) / 2
+
+    def _top_k(self, keyword, vector, k):
+        # keyword and vector are (queries, documents); each is max-normalized per query
+        # and the hybrid score is their element-wise max
+        row_max = keyword.max(axis=1, keepdims=True)
+        combined = np.divide(keyword, row_max, out=np.zeros_like(keyword), where=row_max > 0)
+        if vector is not None:
+            combined = np.maximum(combined, vector / np.maximum(vector.max(axis=1, keepdims=True), 1e-12))
+        k = min(k, combined.shape[1])
+        top = np.argpartition(-combined, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(combined, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        return [
+            [Document(page_content=self.doc_texts[i], metadata={"score": float(scores[i])}) for i in row]
+            for row, scores in zip(top, combined)
+        ]
+
+    def document_vectors(self, texts):
+        """Stored unit embeddings of the given chunk texts as a dict; texts not in the snapshot are left out."""
+        if self._doc_index is None:
+            self._doc_index = {text.strip(): i for i, text in enumerate(self.doc_texts)}
+        return {text: self.doc_matrix[self._doc_index[text.strip()]]
+                for text in texts if text.strip() in self._doc_index}
+
+    def similarity_search(self, query, k=4):
+        """
+        Hybrid chunk search returning the top `k` Documents, like
+        Neo4jVector.similarity_search with search_type="hybrid".
+        """
+        if not self.doc_texts:
+            return []
+        keyword = self.bm25_scores(query)[None, :]
+        vector = None
+        if self.embeddings is not None:
+            vector = self.vector_scores(self.embeddings.embed_query(query))[None, :]
+        return self._top_k(keyword, vector, k)[0]
+
+    def bulk_similarity_search(self, queries, k=4, batch_size=1024):
+        """
+        Hybrid search for many queries at once. Each batch is embedded with one
+        `embed_documents` call and scored against all chunks with one matrix product.
+
+        Returns:
+        list: One list of top `k` Documents per query, in input order
+        """
+        queries = [str(query) for query in queries]
+        if not self.doc_texts:
+            return [[] for _ in queries]
+        results = []
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            keyword = np.stack([self.bm25_scores(query) for query in batch])
+            vector = None
+            if self.embeddings is not None:
+                vector = self.vector_scores(self.embeddings.embed_documents(batch))
+            results.extend(self._top_k(keyword, vector, k))
+        return results
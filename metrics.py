@@ -0,0 +1,75 @@
+import bisect
+import threading
+
+
+# Upper bucket bounds in seconds, roughly log-spaced from 1ms to 60s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class LatencyHistogram:
+    """
+    Thread-safe latency histogram with fixed buckets.
+
+    Keeps a count per bucket plus the total, so memory does not grow with the
+    number of observations. Quantiles are estimated from the bucket bounds.
+
+    Parameters:
+    buckets (tuple): Increasing upper bounds in seconds; one overflow bucket is added
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """Record one latency in seconds."""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (0 < q <= 1)."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= target:
+                    return min(bound, self.max)
+            return self.max
+
+    def summary(self):
+        """Count, mean, p50, p90, p99 and max in seconds."""
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+    def buckets_cumulative(self):
+        """(upper bound, cumulative count) pairs, ending with (inf, total count)."""
+        with self._lock:
+            pairs, seen = [], 0
+            for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+                seen += count
+                pairs.append((bound, seen))
+        return pairs
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
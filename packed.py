@@ -0,0 +1,137 @@
+from typing import List
+import tracing
+from langchain_core.pydantic_v1 import BaseModel, Field
+from llm_cache import cached_completion, cached_completion_async
+from rate_limiter import call_with_retries, call_with_retries_async
+
+STANCES = ("FAVOR", "AGAINST")
+
+
+# Structured output schema for packed requests
+class StancePrediction(BaseModel):
+    """Stance of one numbered tweet."""
+    id: int = Field(..., description="The number of the tweet")
+    stance: str = Field(..., description="FAVOR or AGAINST")
+
+
+class StanceBatch(BaseModel):
+    """Stances of all numbered tweets in the request."""
+    predictions: List[StancePrediction] = Field(..., description="One prediction per numbered tweet")
+
+
+def number_tweets(tweets):
+    """Render tweets as numbered slots, starting at 1."""
+    return "\n".join(f"{slot}. {' '.join(str(tweet).split())}" for slot, tweet in enumerate(tweets, 1))
+
+
+def _parse_predictions(result):
+    # `result` comes from with_structured_output(include_raw=True)
+    parsed = result.get("parsed")
+    if parsed is None:
+        return []
+    return [{"id": prediction.id, "stance": prediction.stance} for prediction in parsed.predictions]
+
+
+def _usage(result):
+    usage = getattr(result.get("raw"), "usage_metadata", None) or {}
+    return {"prompt_tokens": usage.get("input_tokens", 0), "completion_tokens": usage.get("output_tokens", 0)}
+
+
+def _assign(predictions, chunk, results):
+    # Keep valid answers for slots of this chunk; anything else is re-issued
+    for prediction in predictions:
+        slot = prediction.get("id")
+        stance = str(prediction.get("stance", "")).strip().upper()
+        if isinstance(slot, int) and 1 <= slot <= len(chunk) and stance in STANCES:
+            results.setdefault(chunk[slot - 1], stance)
+
+
+def _request_params(llm, attempt):
+    params = {"temperature": llm.temperature, "schema": "StanceBatch"}
+    # Retries must not be answered from the cache entry that was incomplete
+    if attempt:
+        params["attempt"] = attempt
+    return params
+
+
+def classify_packed(tweets, prompt, llm, pack_size=10, max_attempts=3, usage=None, **prompt_vars):
+    """
+    Classify many tweets with `pack_size` tweets per request.
+
+    Tweets are sent as numbered slots and answered through a structured
+    {id, stance} list. Slots that are missing or invalid in the answer are
+    packed again and re-issued, up to `max_attempts` rounds.
+
+    Parameters:
+    tweets (list): Tweet texts
+    prompt (ChatPromptTemplate): Packed prompt with a {tweets} variable
+    llm (ChatOpenAI): Model used with structured output
+    pack_size (int): Tweets per request
+    max_attempts (int): Rounds of re-issuing missing slots
+    usage (dict): Optional dict that accumulates requests and token counts
+    prompt_vars: Other prompt variables, e.g. entity
+
+    Returns:
+    list: FAVOR, AGAINST or None per tweet, in input order
+    """
+    structured_llm = llm.with_structured_output(StanceBatch, include_raw=True)
+    results = {}
+    pending = list(range(len(tweets)))
+    for attempt in range(max_attempts):
+        for start in range(0, len(pending), pack_size):
+            chunk = pending[start:start + pack_size]
+            messages = prompt.format_messages(tweets=number_tweets([tweets[i] for i in chunk]), **prompt_vars)
+
+            def request():
+                result = call_with_retries(lambda: structured_llm.invoke(messages))
+                tracing.add_usage(result.get("raw"))
+                if usage is not None:
+                    usage["requests"] = usage.get("requests", 0) + 1
+                    for key, value in _usage(result).items():
+                        usage[key] = usage.get(key, 0) + value
+                return _parse_predictions(result)
+
+            with tracing.span("llm.classify_packed", pack=len(chunk), attempt=attempt):
+                predictions = cached_completion(llm.model_name, messages, _request_params(llm, attempt), request)
+            _assign(predictions, chunk, results)
+        pending = [i for i in pending if i not in results]
+        if not pending:
+            break
+    return [results.get(i) for i in range(len(tweets))]
+
+
+async def classify_packed_async(tweets, prompt, llm, pack_size=10, max_attempts=3, usage=None,
+                                limiter=None, max_retries=5, **prompt_vars):
+    """
+    Async counterpart of `classify_packed`. Packs are sent one after another;
+    callers get concurrency by classifying several groups of tweets at once.
+    """
+    structured_llm = llm.with_structured_output(StanceBatch, include_raw=True)
+    results = {}
+    pending = list(range(len(tweets)))
+    for attempt in range(max_attempts):
+        for start in range(0, len(pending), pack_size):
+            chunk = pending[start:start + pack_size]
+            messages = prompt.format_messages(tweets=number_tweets([tweets[i] for i in chunk]), **prompt_vars)
+
+            async def request():
+                result = await structured_llm.ainvoke(messages)
+                tracing.add_usage(result.get("raw"))
+                if usage is not None:
+                    usage["requests"] = usage.get("requests", 0) + 1
+                    for key, value in _usage(result).items():
+                        usage[key] = usage.get(key, 0) + value
+                return _parse_predictions(result)
+
+            with tracing.span("llm.classify_packed", pack=len(chunk), attempt=attempt):
+                predictions = await cached_completion_async(
+                    llm.model_name,
+                    messages,
+                    _request_params(llm, attempt),
+                    lambda: call_with_retries_async(request, max_retries=max_retries, limiter=limiter)
+                )
+            _assign(predictions, chunk, results)
+        pending = [i for i in pending if i not in results]
+        if not pending:
+            break
+    return [results.get(i) for i in range(len(tweets))]
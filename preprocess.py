@@ -1,66 +1,75 @@
+import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import re
-import nltk
-from nltk.tokenize import word_tokenize
-nltk.download('punkt')
+from dataset_cache import load_dataset
 
-def preprocess_twitter_dataset(tweets_df):
+# Keywords in a user bio that indicate a political stance
+POLITICAL_KEYWORDS = [
+    
+    # Bangladesh political keywords
+    'awami league', 'bangladesh awami league', 'al', 'bnp', 
+    'bangladesh nationalist party', 'jatiya party', 'jp',
+    'jamaat-e-islami', 'jamaat', 'jatiyo party',
+    'sheikh hasina', 'hasina', 'khaleda zia', 'zia',
+    'pro-awami', 'pro-bnp', 'BAL', 'bangladesh awami',
+    'nationalist', '#awamileague', '#bnp', '#bangladeshpolitics'
+]
+
+# Word and punctuation tokens, close to what nltk's word_tokenize produces
+TOKEN_PATTERN = r"\w+|[^\w\s]"
+
+def compile_keyword_pattern(keywords):
     """
-    Preprocesses Twitter dataset according to the following criteria:
-    1. Excludes image tweets
-    2. Excludes tweets from users whose bios don't indicate political stance
-    3. Removes tweets with fewer than 5 words
+    Compile keywords into a single case-insensitive regex that only matches whole words,
+    so short keywords like 'al' no longer match inside 'global'
+    """
+    # Longest first so 'bangladesh awami league' wins over 'awami league'
+    alternatives = sorted((re.escape(keyword.lower()) for keyword in keywords), key=len, reverse=True)
+    return re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)", re.IGNORECASE)
+
+def count_words(texts):
+    """
+    Vectorized token count for a Series of texts; missing values count as 0
+    """
+    return texts.fillna('').astype(str).str.count(TOKEN_PATTERN)
+
+def filter_tweets(tweets_df, keyword_pattern, min_words=5):
+    """
+    Apply the image, bio and word-count filters to one DataFrame or chunk.
     
     Args:
-        tweets_df: DataFrame containing Twitter data with columns:
-                  - 'tweet_text': the content of the tweet
-                  - 'has_image': boolean indicating if tweet has image
-                  - 'user_bio': the user's Twitter bio text
+        tweets_df: DataFrame or chunk of Twitter data
+        keyword_pattern: Compiled pattern from compile_keyword_pattern
+        min_words: Minimum number of tokens a tweet must have
     
     Returns:
-        Preprocessed DataFrame with filtered tweets
+        Tuple of (filtered DataFrame, stages) where stages is a list of
+        (message, rows remaining) pairs; rows remaining is None for skipped stages
     """
-    print(f"Original dataset size: {len(tweets_df)}")
+    stages = []
     
     # 1. Filter out tweets with images
     if 'has_image' in tweets_df.columns:
-        tweets_df = tweets_df[~tweets_df['has_image']]
-        print(f"After removing image tweets: {len(tweets_df)}")
+        tweets_df = tweets_df[~tweets_df['has_image'].fillna(False).astype(bool)]
+        stages.append(("After removing image tweets", len(tweets_df)))
     else:
-        print("No 'has_image' column found, skipping image filtering")
+        stages.append(("No 'has_image' column found, skipping image filtering", None))
     
     # 2. Filter users based on political stance in bio
-    # Define keywords indicating political stance
-    political_keywords = [
-        
-        # Bangladesh political keywords
-        'awami league', 'bangladesh awami league', 'al', 'bnp', 
-        'bangladesh nationalist party', 'jatiya party', 'jp',
-        'jamaat-e-islami', 'jamaat', 'jatiyo party',
-        'sheikh hasina', 'hasina', 'khaleda zia', 'zia',
-        'pro-awami', 'pro-bnp', 'BAL', 'bangladesh awami',
-        'nationalist', '#awamileague', '#bnp', '#bangladeshpolitics'
-    ]
-    
-    # Function to check if bio contains political keywords
-    def has_political_stance(bio):
-        if pd.isna(bio):
-            return False
-        bio = str(bio).lower()
-        return any(keyword in bio for keyword in political_keywords)
-    
-    # Apply filter for users with political stance if user_bio column exists
     if 'user_bio' in tweets_df.columns:
-        tweets_df = tweets_df[tweets_df['user_bio'].apply(has_political_stance)]
-        print(f"After filtering users without political stance in bio: {len(tweets_df)}")
+        has_political_stance = tweets_df['user_bio'].fillna('').astype(str).str.contains(keyword_pattern)
+        tweets_df = tweets_df[has_political_stance]
+        stages.append(("After filtering users without political stance in bio", len(tweets_df)))
     elif 'stance' in tweets_df.columns:
         # If the dataset already has a stance column, use that instead
         tweets_df = tweets_df[~tweets_df['stance'].isna()]
-        print(f"Using existing stance column. After filtering: {len(tweets_df)}")
+        stages.append(("Using existing stance column. After filtering", len(tweets_df)))
     else:
-        print("No 'user_bio' or 'stance' column found, skipping political stance filtering")
+        stages.append(("No 'user_bio' or 'stance' column found, skipping political stance filtering", None))
     
-    # 3. Remove tweets with fewer than 5 words
+    # 3. Remove tweets with fewer than `min_words` words
     # Identify the text column (could be 'tweet_text', 'text', 'tweet', or 'Content')
     text_column = None
     for possible_column in ['tweet_text', 'text', 'tweet', 'Content']:
@@ -69,26 +78,163 @@ def preprocess_twitter_dataset(tweets_df):
             break
     
     if text_column:
-        def count_words(text):
-            if pd.isna(text):
-                return 0
-            # Tokenize text into words
-            words = word_tokenize(str(text))
-            return len(words)
-        
-        tweets_df = tweets_df[tweets_df[text_column].apply(count_words) >= 5]
-        print(f"After removing tweets with fewer than 5 words: {len(tweets_df)}")
+        tweets_df = tweets_df[count_words(tweets_df[text_column]) >= min_words]
+        stages.append((f"After removing tweets with fewer than {min_words} words", len(tweets_df)))
     else:
-        print("No text column found for word count filtering")
+        stages.append(("No text column found for word count filtering", None))
     
+    return tweets_df, stages
+
+def print_stages(original_size, stages):
+    """
+    Print per-stage row counts
+    """
+    print(f"Original dataset size: {original_size}")
+    for message, rows in stages:
+        print(f"{message}: {rows}" if rows is not None else message)
+
+def preprocess_twitter_dataset(tweets_df, political_keywords=None, min_words=5):
+    """
+    Preprocesses Twitter dataset according to the following criteria:
+    1. Excludes image tweets
+    2. Excludes tweets from users whose bios don't indicate political stance
+    3. Removes tweets with fewer than 5 words
+    
+    Args:
+        tweets_df: DataFrame containing Twitter data with columns:
+                  - 'tweet_text': the content of the tweet
+                  - 'has_image': boolean indicating if tweet has image
+                  - 'user_bio': the user's Twitter bio text
+        political_keywords: Bio keywords indicating a political stance,
+                  defaults to POLITICAL_KEYWORDS
+        min_words: Minimum number of tokens a tweet must have
+    
+    Returns:
+        Preprocessed DataFrame with filtered tweets
+    """
+    keyword_pattern = compile_keyword_pattern(political_keywords or POLITICAL_KEYWORDS)
+    original_size = len(tweets_df)
+    tweets_df, stages = filter_tweets(tweets_df, keyword_pattern, min_words=min_words)
+    print_stages(original_size, stages)
     return tweets_df
 
+def read_in_chunks(file_path, chunksize=100000, dtype=None):
+    """
+    Yield DataFrame chunks from a CSV, Parquet or JSONL file without loading it whole.
+    Parquet is read in pyarrow record batches. `dtype` pins column types of CSV
+    and JSONL input, e.g. {'user_id': str}.
+    """
+    if file_path.endswith('.csv'):
+        yield from pd.read_csv(file_path, chunksize=chunksize, dtype=dtype)
+    elif file_path.endswith('.parquet'):
+        parquet_file = pq.ParquetFile(file_path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif file_path.endswith('.jsonl'):
+        yield from pd.read_json(file_path, lines=True, chunksize=chunksize, dtype=dtype)
+    else:
+        raise ValueError("Unsupported file format for streaming. Use .csv, .parquet or .jsonl")
+
+def chunk_to_table(chunk, schema=None):
+    """
+    Convert a chunk to an Arrow table, conforming it to `schema` when given.
+    
+    Columns that are empty in a chunk carry no type (pandas reads them as
+    float NaN), so they are converted as nulls and take the type of `schema`.
+    Without a schema, null columns become strings. A column typed as string
+    keeps later numeric or boolean values as text.
+    
+    Args:
+        chunk: DataFrame chunk
+        schema: Output schema fixed by an earlier chunk, or None
+    
+    Returns:
+        pyarrow Table
+    """
+    empty = {column: pd.Series([None] * len(chunk), index=chunk.index, dtype=object)
+             for column in chunk.columns if chunk[column].isna().all()}
+    table = pa.Table.from_pandas(chunk.assign(**empty) if empty else chunk, preserve_index=False)
+    if schema is None:
+        fields = [pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field for field in table.schema]
+        return table.cast(pa.schema(fields, metadata=table.schema.metadata))
+    
+    extra = [name for name in table.column_names if schema.get_field_index(name) < 0]
+    if extra:
+        raise ValueError(f"Columns {extra} are missing from the first chunk; pass them in `dtype` or align the input")
+    columns = []
+    for field in schema:
+        if field.name not in table.column_names:
+            columns.append(pa.nulls(len(table), field.type))
+            continue
+        column = table.column(field.name)
+        if column.type != field.type:
+            try:
+                column = column.cast(field.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                raise ValueError(
+                    f"Column '{field.name}' is {field.type} in earlier chunks but {column.type} in this one; "
+                    f"pass dtype={{'{field.name}': str}} to read it as text"
+                )
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def preprocess_twitter_dataset_streaming(input_file, output_file, political_keywords=None,
+                                         min_words=5, chunksize=100000, dtype=None):
+    """
+    Preprocess a dataset chunk by chunk and append the kept rows to a Parquet file.
+    Memory use is bounded by `chunksize`, so inputs larger than RAM can be processed.
+    Chunks are conformed to the schema of the first one (see chunk_to_table).
+    Rows go to a temporary file that replaces `output_file` only when every
+    chunk was written, so a failed run leaves no partial output.
+    
+    Args:
+        input_file: Path to a .csv, .parquet or .jsonl file
+        output_file: Path to the output .parquet file
+        political_keywords: Bio keywords indicating a political stance,
+                  defaults to POLITICAL_KEYWORDS
+        min_words: Minimum number of tokens a tweet must have
+        chunksize: Rows per chunk
+        dtype: Column types for CSV and JSONL input, passed to pandas
+    
+    Returns:
+        Number of rows written
+    """
+    keyword_pattern = compile_keyword_pattern(political_keywords or POLITICAL_KEYWORDS)
+    temp_file = output_file + ".tmp"
+    original_size = 0
+    written = 0
+    totals = {}
+    writer = None
+    try:
+        for chunk in read_in_chunks(input_file, chunksize=chunksize, dtype=dtype):
+            if writer is None:
+                # Fix the output schema from the first unfiltered chunk
+                writer = pq.ParquetWriter(temp_file, chunk_to_table(chunk).schema)
+            original_size += len(chunk)
+            kept, stages = filter_tweets(chunk, keyword_pattern, min_words=min_words)
+            for message, rows in stages:
+                totals[message] = None if rows is None else totals.get(message, 0) + rows
+            written += len(kept)
+            if len(kept):
+                writer.write_table(chunk_to_table(kept, writer.schema))
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(temp_file, output_file)
+    finally:
+        if writer is not None:
+            writer.close()
+            os.remove(temp_file)
+    
+    print_stages(original_size, list(totals.items()))
+    return written
+
 # Example usage
 if __name__ == "__main__":
     try:
         # Load the BPDisC_with_stance.xlsx dataset
         file_path = 'BPDisC_with_stance.xlsx'
-        tweets_df = pd.read_excel(file_path)
+        tweets_df = load_dataset(file_path)
         
         # Display column names to help with debugging
         print(f"Columns in the dataset: {tweets_df.columns.tolist()}")
@@ -0,0 +1,117 @@
+import asyncio
+import random
+import threading
+import time
+import tracing
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter shared by sync and async callers.
+
+    Tokens refill continuously at `rate` per second up to `capacity`. A caller
+    reserves its tokens immediately and then waits out any deficit, so waiting
+    callers are served in arrival order and bursts never exceed `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        # Returns how long the caller has to wait before its tokens are available
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """Block the current thread until `tokens` are available; returns the seconds waited."""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, tokens=1):
+        """Wait without blocking the event loop until `tokens` are available; returns the seconds waited."""
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+
+def is_retryable_error(exc):
+    """
+    True for rate-limit (429), server-side (5xx), timeout and connection errors.
+    """
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(exc).__name__
+    return name in ("APIConnectionError", "APITimeoutError", "TimeoutError", "ConnectionError")
+
+
+def retry_after_seconds(exc):
+    """Read a Retry-After header from a provider error, if it carries one."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter for the given 0-based attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def call_with_retries(fn, max_retries=5, limiter=None, base_delay=1.0, max_delay=60.0):
+    """
+    Call `fn()` and retry retryable errors with exponential backoff.
+    Every attempt first takes a token from `limiter` when one is given.
+    Limiter waits and retries are added to the current tracing span.
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            tracing.add("queue_wait", limiter.acquire())
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable_error(e):
+                raise
+            delay = retry_after_seconds(e) or backoff_delay(attempt, base_delay, max_delay)
+            tracing.add("retries")
+            time.sleep(delay)
+
+
+async def call_with_retries_async(fn, max_retries=5, limiter=None, base_delay=1.0, max_delay=60.0):
+    """
+    Async counterpart of `call_with_retries`; `fn` returns an awaitable.
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            tracing.add("queue_wait", await limiter.acquire_async())
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable_error(e):
+                raise
+            delay = retry_after_seconds(e) or backoff_delay(attempt, base_delay, max_delay)
+            tracing.add("retries")
+            await asyncio.sleep(delay)
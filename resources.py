@@ -0,0 +1,225 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+OPENROUTER_BASE_URL = "https://api.openrouter.ai/v1"
+SPACY_MODEL = "en_core_web_sm"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EXAMPLE_STORE_PATH = "example_store"
+# The SDKs' own retries are disabled: every call goes through rate_limiter.call_with_retries(_async),
+# so each attempt takes a TokenBucket token and is counted in the `retries` span counter
+SDK_MAX_RETRIES = 0
+
+
+class ResourceRegistry:
+    """
+    Named resources created on first use and shared for the rest of the process.
+
+    Each resource has its own lock, so threads asking for the same resource
+    wait for one construction while other resources load in parallel. Clients
+    hold sockets and thread pools that must not cross a fork, so a forked child
+    starts with an empty registry and builds its own copies; spawned worker
+    processes import the modules afresh and do the same.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """Register `factory()` as the constructor of `name`."""
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+
+    def register_default(self, name, factory):
+        """Register `factory` for `name` unless a factory is already registered."""
+        with self._lock:
+            if name not in self._factories:
+                self._factories[name] = factory
+                self._locks[name] = threading.Lock()
+
+    def get(self, name):
+        """The resource `name`, created by its factory on the first call."""
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._factories:
+                raise KeyError(f"Unknown resource '{name}'")
+            lock = self._locks[name]
+        with lock:
+            if name not in self._instances:
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    def loaded(self, name):
+        return name in self._instances
+
+    def reset(self, name=None):
+        """Drop one cached resource, or all of them, so the next get() rebuilds it."""
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+    def _after_fork(self):
+        self._instances = {}
+        self._locks = {name: threading.Lock() for name in self._factories}
+        self._lock = threading.Lock()
+
+
+registry = ResourceRegistry()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+
+def resource(name):
+    """Decorator that registers a factory under `name` and returns a getter for it."""
+    def decorator(factory):
+        registry.register(name, factory)
+
+        def getter():
+            return registry.get(name)
+        getter.__name__ = factory.__name__
+        getter.__doc__ = factory.__doc__
+        return getter
+    return decorator
+
+
+def lazy_attributes(module_name, **getters):
+    """
+    Module-level __getattr__ that resolves the given names through their getters,
+    so `module.llm` keeps working without building the client at import time.
+    """
+    def __getattr__(name):
+        if name in getters:
+            return getters[name]()
+        raise AttributeError(f"module '{module_name}' has no attribute '{name}'")
+    return __getattr__
+
+
+@resource("openrouter_client")
+def openrouter_client():
+    """Synchronous OpenAI client pointed at OpenRouter"""
+    from openai import OpenAI
+
+    return OpenAI(
+        base_url=os.getenv("OPENROUTER_BASE_URL", OPENROUTER_BASE_URL),
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        max_retries=SDK_MAX_RETRIES
+    )
+
+
+@resource("openrouter_async_client")
+def openrouter_async_client():
+    """Async OpenAI client pointed at OpenRouter"""
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(
+        base_url=os.getenv("OPENROUTER_BASE_URL", OPENROUTER_BASE_URL),
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        max_retries=SDK_MAX_RETRIES
+    )
+
+
+def _make_chat_model(model):
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=model,
+        base_url=os.getenv("OPENROUTER_BASE_URL", OPENROUTER_BASE_URL),
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        max_retries=SDK_MAX_RETRIES
+    )
+
+
+def chat_model(model="gpt-4o"):
+    """Shared ChatOpenAI for `model` on OpenRouter, used by the classifiers and graph extraction"""
+    name = f"chat_model:{model}"
+    if not registry.loaded(name):
+        registry.register_default(name, lambda: _make_chat_model(model))
+    return registry.get(name)
+
+
+@resource("stop_words")
+def stop_words():
+    """English NLTK stop words; the corpus is downloaded only when it is not installed"""
+    import nltk
+
+    try:
+        nltk.data.find("corpora/stopwords")
+    except LookupError:
+        nltk.download("stopwords", quiet=True)
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words("english"))
+
+
+@resource("spacy_ner")
+def spacy_ner():
+    """spaCy pipeline for NER; the parser and lemmatizer are not needed"""
+    import spacy
+
+    return spacy.load(SPACY_MODEL, disable=["parser", "lemmatizer"])
+
+
+@resource("neo4j_graph")
+def neo4j_graph():
+    """Neo4j connection from NEO4J_URI, NEO4J_USERNAME and NEO4J_PASSWORD"""
+    from langchain_community.graphs import Neo4jGraph
+
+    return Neo4jGraph(
+        url=os.getenv("NEO4J_URI"),
+        username=os.getenv("NEO4J_USERNAME"),
+        password=os.getenv("NEO4J_PASSWORD")
+    )
+
+
+def _is_cached_locally(repo_id):
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return False
+    return isinstance(try_to_load_from_cache(repo_id, "config.json"), str)
+
+
+@resource("embeddings")
+def embeddings():
+    """MiniLM sentence embeddings; a model already in the Hugging Face cache is loaded without network calls"""
+    from langchain.embeddings import HuggingFaceEmbeddings
+
+    model_kwargs = {"local_files_only": True} if _is_cached_locally(EMBEDDING_MODEL) else {}
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, model_kwargs=model_kwargs)
+
+
+@resource("vector_index")
+def vector_index():
+    """Hybrid Neo4j vector index over the Document chunks of the graph"""
+    from langchain.vectorstores import Neo4jVector
+
+    return Neo4jVector.from_existing_graph(
+        registry.get("embeddings"),
+        search_type="hybrid",
+        node_label="Document",
+        text_node_properties=["text"],
+        embedding_node_property="embedding"
+    )
+
+
+@resource("example_store")
+def example_store():
+    """Labeled few-shot demonstrations at EXAMPLE_STORE_PATH, or None when no store has been built"""
+    path = os.getenv("EXAMPLE_STORE_PATH", EXAMPLE_STORE_PATH)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    from example_store import ExampleStore
+
+    return ExampleStore(path, embeddings=registry.get("embeddings"))
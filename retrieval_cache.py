@@ -0,0 +1,132 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def normalize_question(question):
+    """Cache key for a question: lower-cased with whitespace collapsed."""
+    return re.sub(r"\s+", " ", str(question)).strip().lower()
+
+
+def merge_entity_triples(names, by_entity):
+    """
+    Combine per-entity triples in the order the names were given, dropping
+    triples already listed under an earlier entity.
+    """
+    seen = set()
+    grouped = {}
+    for name in dict.fromkeys(names):
+        triples = [triple for triple in by_entity.get(name, []) if triple not in seen]
+        seen.update(triples)
+        grouped[name] = triples
+    return grouped
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with an optional time-to-live.
+
+    Parameters:
+    max_size (int): Evict the least recently used entry beyond this many entries
+    ttl (float): Entries older than this many seconds count as misses
+    """
+
+    def __init__(self, max_size=10000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._data[key]
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._data),
+        }
+
+
+class RetrievalCache:
+    """
+    Two-level cache for graph retrieval.
+
+    - entities: entity name -> raw neighborhood triples
+    - questions: normalized question -> extracted entity names and similarity-search results
+
+    Both levels are cleared when the graph build version changes. The version
+    comes from `version_fn` and is checked at most every `version_check_interval`
+    seconds, so steady-state lookups never touch the database.
+
+    Parameters:
+    max_entities (int): LRU size of the entity level
+    max_questions (int): LRU size of the question level
+    ttl (float): Time-to-live in seconds for both levels, or None
+    version_fn (callable): Returns the current graph build version
+    version_check_interval (float): Seconds between version checks
+    """
+
+    def __init__(self, max_entities=10000, max_questions=10000, ttl=None, version_fn=None,
+                 version_check_interval=60.0):
+        self.entities = LRUCache(max_entities, ttl)
+        self.questions = LRUCache(max_questions, ttl)
+        self.version_fn = version_fn
+        self.version_check_interval = version_check_interval
+        self.version = None
+        self.invalidations = 0
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def check_version(self, force=False):
+        """Clear both levels if the graph build version changed since the last check."""
+        if self.version_fn is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._checked_at is not None and now - self._checked_at < self.version_check_interval:
+                return
+            self._checked_at = now
+            version = self.version_fn()
+            if version != self.version:
+                if self.version is not None:
+                    self.invalidations += 1
+                self.entities.clear()
+                self.questions.clear()
+                self.version = version
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "invalidations": self.invalidations,
+            "entities": self.entities.stats(),
+            "questions": self.questions.stats(),
+        }
@@ -1,7 +1,15 @@
+import contextvars
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import resources
+import tracing
+from metrics import LatencyHistogram
+from retrieval_cache import RetrievalCache, merge_entity_triples, normalize_question
+from context_budget import compile_context, compile_contexts
+from rate_limiter import call_with_retries
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_community.vectorstores.neo4j_vector import remove_lucene_chars
 
 # Define the Entities class for structured output
 class Entities(BaseModel):
@@ -19,51 +27,377 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-# Initialize the entity extraction chain
-entity_chain = prompt | llm.with_structured_output(Entities)
+# The entity extraction chain is built on first use
+@resources.resource("entity_chain")
+def get_entity_chain():
+    return prompt | resources.chat_model().with_structured_output(Entities)
+
+# `entity_chain`, `graph` and `vector_index` stay available as module attributes
+# but are only created when a Neo4j-backed call first needs them
+__getattr__ = resources.lazy_attributes(
+    __name__,
+    entity_chain=get_entity_chain,
+    graph=resources.neo4j_graph,
+    vector_index=resources.vector_index
+)
 
 # Function to generate a full-text query
 def generate_full_text_query(input: str) -> str:
+    from langchain_community.vectorstores.neo4j_vector import remove_lucene_chars
+
     full_text_query = ""
     words = [el for el in remove_lucene_chars(input).split() if el]
+    if not words:
+        return ""
     for word in words[:-1]:
         full_text_query += f" {word}~2 AND"
     full_text_query += f" {words[-1]}~2"
     return full_text_query.strip()
 
+# Latency of the batched neighborhood query, one observation per call
+graph_query_latency = LatencyHistogram()
+
+# One round trip for all entities: full-text lookup plus 1-hop neighborhood per entity
+NEIGHBORHOOD_QUERY = """
+UNWIND $entities AS entity
+CALL db.index.fulltext.queryNodes('entity', entity.query, {limit:2})
+YIELD node,score
+CALL {
+  WITH node
+  MATCH (node)-[r:!MENTIONS]->(neighbor)
+  RETURN node.id + ' - ' + type(r) + ' -> ' + neighbor.id AS output
+  UNION ALL
+  WITH node
+  MATCH (node)<-[r:!MENTIONS]-(neighbor)
+  RETURN neighbor.id + ' - ' + type(r) + ' -> ' +  node.id AS output
+}
+WITH entity, collect(DISTINCT output) AS outputs
+RETURN entity.name AS entity, outputs[..$limit] AS outputs
+"""
+
+def fetch_entity_neighborhoods(names, limit=50):
+    """
+    Fetch neighborhood triples for several entities in a single query.
+    
+    Returns:
+    dict: entity name -> up to `limit` distinct triples, one entry per name
+    """
+    names = list(dict.fromkeys(names))
+    entities = []
+    for name in names:
+        query = generate_full_text_query(name)
+        if query:
+            entities.append({"name": name, "query": query})
+    by_entity = {name: [] for name in names}
+    if not entities:
+        return by_entity
+    
+    start = time.perf_counter()
+    with tracing.span("graph.neighborhood_query", entities=len(entities)):
+        response = resources.neo4j_graph().query(NEIGHBORHOOD_QUERY, {"entities": entities, "limit": limit})
+    graph_query_latency.observe(time.perf_counter() - start)
+    
+    by_entity.update({el['entity']: el['outputs'] for el in response})
+    return by_entity
+
+def query_entity_neighborhoods(names, limit=50):
+    """
+    Fetch neighborhood triples for several entities in a single query.
+    
+    Returns:
+    dict: entity name -> list of triples, in the order the names were given;
+          a triple already listed under an earlier entity is not repeated
+    """
+    return merge_entity_triples(names, fetch_entity_neighborhoods(names, limit=limit))
+
+def graph_build_version():
+    """
+    The version stamped on the GraphBuild node by the last graph build
+    (knowledge_graph_builder.stamp_graph_build). Graphs built before stamps
+    existed fall back to node and relationship counts, which miss a rebuild
+    that leaves both unchanged.
+    """
+    row = resources.neo4j_graph().query(
+        """OPTIONAL MATCH (b:GraphBuild {id: 'current'})
+        CALL { MATCH (n) RETURN count(n) AS nodes }
+        CALL { MATCH ()-[r]->() RETURN count(r) AS relationships }
+        RETURN b.version AS version, nodes, relationships"""
+    )[0]
+    if row['version'] is not None:
+        return row['version']
+    return (row['nodes'], row['relationships'])
+
+def make_retrieval_cache(backend=None, **kwargs):
+    """
+    Create a RetrievalCache that is invalidated when the graph (or `backend`) is rebuilt
+    """
+    version_fn = backend.build_version if backend is not None else graph_build_version
+    return RetrievalCache(version_fn=version_fn, **kwargs)
+
+def extract_entities(question: str, cache=None, extractor=None):
+    """
+    Person and organization names in the question, memoized per normalized question.
+    A local `extractor` (entity_extractor.GazetteerExtractor) is tried first; the
+    LLM chain only runs when it finds nothing.
+    """
+    with tracing.span("entity_extraction") as span:
+        key = ("entities", normalize_question(question))
+        names = cache.questions.get(key) if cache is not None else None
+        source = "cache"
+        if names is None:
+            names = extractor.extract(question) if extractor is not None else []
+            source = "gazetteer"
+            if not names:
+                names = call_with_retries(lambda: get_entity_chain().invoke({"question": question})).names
+                source = "llm"
+            if cache is not None:
+                cache.questions.put(key, names)
+        else:
+            span.add("cache_hits")
+        span.set("source", source)
+        span.set("entities", len(names))
+    return names
+
+def bulk_extract_entities(questions, cache=None, extractor=None, concurrency=8):
+    """
+    extract_entities for many questions. Cached questions and gazetteer hits
+    are resolved locally; the remaining distinct questions go to the LLM chain
+    with at most `concurrency` requests in flight, each retried on 429/5xx.
+    
+    Returns:
+    list: One list of names per question, in input order
+    """
+    questions = [str(question) for question in questions]
+    keys = [("entities", normalize_question(question)) for question in questions]
+    found = {}
+    with tracing.span("entity_extraction.bulk", questions=len(questions)) as span:
+        llm_questions = {}
+        for question, key in zip(questions, keys):
+            if key in found or key in llm_questions:
+                continue
+            names = cache.questions.get(key) if cache is not None else None
+            if names is not None:
+                span.add("cache_hits")
+            else:
+                names = extractor.extract(question) if extractor is not None else []
+                if not names:
+                    llm_questions[key] = question
+                    continue
+                span.add("gazetteer")
+                if cache is not None:
+                    cache.questions.put(key, names)
+            found[key] = names
+        if llm_questions:
+            span.add("llm", len(llm_questions))
+            chain = get_entity_chain()
+
+            def extract(question):
+                return call_with_retries(lambda: chain.invoke({"question": question}))
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+                # Each request runs in a copy of this context, so its retries count towards this span
+                futures = [pool.submit(contextvars.copy_context().run, extract, question)
+                           for question in llm_questions.values()]
+                outputs = [future.result() for future in futures]
+            for key, output in zip(llm_questions, outputs):
+                found[key] = output.names
+                if cache is not None:
+                    cache.questions.put(key, output.names)
+    return [found[key] for key in keys]
+
 # Function to retrieve structured data
-def structured_retriever(question: str) -> str:
-    time.sleep(0.5)
-    result = ""
-    entities = entity_chain.invoke({"question": question})
-    for entity in entities.names:
-        response = graph.query(
-            """CALL db.index.fulltext.queryNodes('entity', $query, {limit:2})
-            YIELD node,score
-            CALL {
-              WITH node
-              MATCH (node)-[r:!MENTIONS]->(neighbor)
-              RETURN node.id + ' - ' + type(r) + ' -> ' + neighbor.id AS output
-              UNION ALL
-              WITH node
-              MATCH (node)<-[r:!MENTIONS]-(neighbor)
-              RETURN neighbor.id + ' - ' + type(r) + ' -> ' +  node.id AS output
-            }
-            RETURN output LIMIT 50
-            """,
-            {"query": generate_full_text_query(entity)},
-        )
-        result += "\n".join([el['output'] for el in response])
-    return result
+# `backend` is an optional local_graph.LocalGraph used instead of Neo4j
+# `cache` is an optional RetrievalCache from make_retrieval_cache
+# `extractor` is an optional GazetteerExtractor tried before the LLM
+def structured_retriever(question: str, backend=None, cache=None, extractor=None) -> str:
+    with tracing.span("retrieval.structured") as span:
+        if cache is not None:
+            cache.check_version()
+        names = extract_entities(question, cache=cache, extractor=extractor)
+        fetch = backend.entity_neighborhoods if backend is not None else fetch_entity_neighborhoods
+        by_entity = {}
+        if cache is not None:
+            for name in dict.fromkeys(names):
+                triples = cache.entities.get(name)
+                if triples is not None:
+                    by_entity[name] = triples
+        span.add("cache_hits", len(by_entity))
+        missing = [name for name in dict.fromkeys(names) if name not in by_entity]
+        if missing:
+            fetched = fetch(missing)
+            by_entity.update(fetched)
+            if cache is not None:
+                for name, triples in fetched.items():
+                    cache.entities.put(name, triples)
+        grouped = merge_entity_triples(names, by_entity)
+        return "\n".join(triple for triples in grouped.values() for triple in triples)
 
-# Function to retrieve both structured and unstructured data
-def retriever(question: str):
-    print(f"Search query: {question}")
-    structured_data = structured_retriever(question)
-    unstructured_data = [el.page_content for el in vector_index.similarity_search(question)]
-    final_data = f"""Structured data:
+def unstructured_retriever(question: str, backend=None, cache=None):
+    """
+    Text of the chunks most similar to the question. With a cache, the query
+    embedding and search are skipped for questions seen before.
+    """
+    with tracing.span("retrieval.vector_search") as span:
+        key = ("search", normalize_question(question))
+        chunks = cache.questions.get(key) if cache is not None else None
+        if chunks is None:
+            search = backend.similarity_search if backend is not None else resources.vector_index().similarity_search
+            chunks = [el.page_content for el in search(question)]
+            if cache is not None:
+                cache.questions.put(key, chunks)
+        else:
+            span.add("cache_hits")
+    return chunks
+
+def format_context(structured_data, unstructured_data):
+    """
+    Render retrieved triples and chunks into the context string passed to the classifiers
+    """
+    return f"""Structured data:
 {structured_data}
 Unstructured data:
 {"#Document ".join(unstructured_data)}
     """
-    return final_data
\ No newline at end of file
+
+def compiled_retriever(question: str, backend=None, cache=None, extractor=None, max_tokens=1200, embeddings=None):
+    """
+    Retrieve triples and chunks, then keep the ones most relevant to the question
+    within `max_tokens` (see context_budget.compile_context).
+    
+    Returns:
+    tuple: (relational_text, list of chunk texts)
+    """
+    triples = structured_retriever(question, backend=backend, cache=cache, extractor=extractor).splitlines()
+    chunks = unstructured_retriever(question, backend=backend, cache=cache)
+    return compile_context(question, triples, chunks, max_tokens=max_tokens, embeddings=embeddings)
+
+# Function to retrieve both structured and unstructured data
+# With `max_tokens` the context is ranked and trimmed to that many tokens
+def retriever(question: str, backend=None, cache=None, extractor=None, max_tokens=None, embeddings=None):
+    print(f"Search query: {question}")
+    if max_tokens is not None:
+        structured_data, unstructured_data = compiled_retriever(
+            question, backend=backend, cache=cache, extractor=extractor, max_tokens=max_tokens, embeddings=embeddings
+        )
+        return format_context(structured_data, unstructured_data)
+    structured_data = structured_retriever(question, backend=backend, cache=cache, extractor=extractor)
+    unstructured_data = unstructured_retriever(question, backend=backend, cache=cache)
+    return format_context(structured_data, unstructured_data)
+
+# Batched top-k vector search for many query embeddings in one round trip
+BULK_VECTOR_QUERY = """
+UNWIND $queries AS query
+CALL db.index.vector.queryNodes($index, $k, query.embedding)
+YIELD node, score
+WITH query, node, score ORDER BY score DESC
+RETURN query.row AS row, collect(node[$text_property]) AS texts
+"""
+
+def bulk_unstructured_retriever(questions, backend=None, cache=None, k=4, batch_size=256):
+    """
+    Similar chunks for many questions. Questions are embedded in batches of
+    `batch_size` and each batch is searched with one matrix product (local
+    backend) or one UNWIND vector query (Neo4j). The Neo4j path uses the vector
+    index only, without the keyword half of the hybrid search.
+    
+    Returns:
+    list: One list of chunk texts per question, in input order
+    """
+    questions = [str(question) for question in questions]
+    results = [None] * len(questions)
+    if cache is not None:
+        for i, question in enumerate(questions):
+            results[i] = cache.questions.get(("search", normalize_question(question)))
+    # Each distinct pending question is searched once
+    pending = list(dict.fromkeys(question for question, result in zip(questions, results) if result is None))
+    
+    found = {}
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        with tracing.span("retrieval.bulk_vector_search", questions=len(batch)):
+            if backend is not None:
+                documents = backend.bulk_similarity_search(batch, k=k, batch_size=batch_size)
+                texts = [[el.page_content for el in row] for row in documents]
+            else:
+                vector_index = resources.vector_index()
+                vectors = vector_index.embedding.embed_documents(batch)
+                query_start = time.perf_counter()
+                response = resources.neo4j_graph().query(BULK_VECTOR_QUERY, {
+                    "queries": [{"row": i, "embedding": vector} for i, vector in enumerate(vectors)],
+                    "index": vector_index.index_name,
+                    "k": k,
+                    "text_property": vector_index.text_node_property
+                })
+                graph_query_latency.observe(time.perf_counter() - query_start)
+                texts = [[] for _ in batch]
+                for el in response:
+                    texts[el['row']] = el['texts']
+        for question, chunks in zip(batch, texts):
+            found[question] = chunks
+            if cache is not None:
+                cache.questions.put(("search", normalize_question(question)), chunks)
+    
+    return [result if result is not None else found[question] for question, result in zip(questions, results)]
+
+def bulk_structured_retriever(questions, backend=None, cache=None, extractor=None, batch_size=500,
+                              concurrency=8):
+    """
+    Neighborhood triples for many questions. Entities are extracted with
+    bulk_extract_entities (`concurrency` LLM requests at a time) and fetched
+    once per distinct name, `batch_size` names per graph query.
+    
+    Returns:
+    list: One newline-joined triple string per question, in input order
+    """
+    if cache is not None:
+        cache.check_version()
+    names_per_question = bulk_extract_entities(questions, cache=cache, extractor=extractor, concurrency=concurrency)
+    unique_names = list(dict.fromkeys(name for names in names_per_question for name in names))
+    
+    by_entity = {}
+    if cache is not None:
+        for name in unique_names:
+            triples = cache.entities.get(name)
+            if triples is not None:
+                by_entity[name] = triples
+    missing = [name for name in unique_names if name not in by_entity]
+    fetch = backend.entity_neighborhoods if backend is not None else fetch_entity_neighborhoods
+    for start in range(0, len(missing), batch_size):
+        with tracing.span("retrieval.bulk_neighborhoods", entities=len(missing[start:start + batch_size])):
+            fetched = fetch(missing[start:start + batch_size])
+        by_entity.update(fetched)
+        if cache is not None:
+            for name, triples in fetched.items():
+                cache.entities.put(name, triples)
+    
+    results = []
+    for names in names_per_question:
+        grouped = merge_entity_triples(names, by_entity)
+        results.append("\n".join(triple for triples in grouped.values() for triple in triples))
+    return results
+
+def bulk_retriever(questions, backend=None, cache=None, extractor=None, k=4, batch_size=256,
+                   max_tokens=None, embeddings=None):
+    """
+    Retrieval context for a whole column of questions, e.g. df['translation'].
+    With `max_tokens` each context is ranked and trimmed like compiled_retriever;
+    the questions, triples and chunks of the batch are embedded once
+    (context_budget.compile_contexts), and a local backend's stored chunk
+    vectors are reused when it uses the same embedding model.
+    
+    Returns:
+    list: One context string per question, aligned with the input
+    """
+    questions = list(questions)
+    print(f"Retrieving context for {len(questions)} questions")
+    structured = bulk_structured_retriever(questions, backend=backend, cache=cache, extractor=extractor)
+    unstructured = bulk_unstructured_retriever(questions, backend=backend, cache=cache, k=k, batch_size=batch_size)
+    if max_tokens is not None:
+        known_vectors = None
+        if backend is not None and embeddings is not None and embeddings is getattr(backend, "embeddings", None):
+            known_vectors = backend.document_vectors(chunk for chunks in unstructured for chunk in chunks)
+        compiled = compile_contexts(questions, [s.splitlines() for s in structured], unstructured,
+                                    max_tokens=max_tokens, embeddings=embeddings, known_vectors=known_vectors,
+                                    batch_size=batch_size)
+        structured = [s for s, _ in compiled]
+        unstructured = [u for _, u in compiled]
+    return [format_context(s, u) for s, u in zip(structured, unstructured)]
\ No newline at end of file
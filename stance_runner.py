@@ -0,0 +1,399 @@
+import argparse
+import asyncio
+import importlib
+import os
+import re
+import time
+import pandas as pd
+import tracing
+from checkpoint import CheckpointWriter, read_records
+from dataset_cache import load_dataset
+from example_store import held_out_rows, prefetch_examples
+from llm_cache import cached_completion_async
+from packed import classify_packed_async
+from rate_limiter import TokenBucket, call_with_retries_async
+
+# Strategy name -> (classifier module, prompt variables it needs)
+STRATEGIES = {
+    "zero_shot": ("zero_shot", ("entity", "tweet")),
+    "few_shot": ("few_shot", ("tweet",)),
+    "few_shot_rag": ("few_shot_with_rag", ("tweet", "context")),
+    "grasp_choq": ("grasp_choq", ("tweet", "tweet_info", "relational_text", "unstructured_data")),
+}
+
+# Strategies that can pack several tweets into one request -> extra prompt variables
+PACKED_STRATEGIES = {
+    "zero_shot": ("entity",),
+    "few_shot": (),
+}
+
+# An explicit verdict such as "Stance: FAVOR" or "**Stance:** in favour"
+VERDICT_RE = re.compile(r"\bstance\b\W{0,3}:\W*(?:in\s+)?(favou?r|against)\b", re.IGNORECASE)
+# Any stance word, optionally negated ("not in favor of")
+STANCE_RE = re.compile(r"\b(not\s+(?:in\s+)?)?(favou?r|against)\b", re.IGNORECASE)
+
+
+def find_stance(text):
+    """
+    The stance of a model answer and the character offset of the word it was read from.
+
+    The last explicit 'Stance: FAVOR|AGAINST' verdict wins. Without one, the
+    last stance word in the answer is used, so the conclusion of a reasoning
+    answer counts rather than its first sentence; a negated word ('not in
+    favor') gives the opposite stance.
+
+    Returns:
+    tuple: (FAVOR or AGAINST, offset), or (None, None) if no stance word appears
+    """
+    if text is None or (not isinstance(text, str) and pd.isna(text)):
+        return None, None
+    text = str(text)
+    verdicts = list(VERDICT_RE.finditer(text))
+    if verdicts:
+        match = verdicts[-1]
+        return ("AGAINST" if match.group(1).lower() == "against" else "FAVOR"), match.start(1)
+    matches = list(STANCE_RE.finditer(text))
+    if not matches:
+        return None, None
+    match = matches[-1]
+    against = match.group(2).lower() == "against"
+    if match.group(1):
+        against = not against
+    return ("AGAINST" if against else "FAVOR"), match.start(2)
+
+
+def parse_stance(text):
+    """Map a model answer to FAVOR or AGAINST, or None if neither appears (see find_stance)."""
+    return find_stance(text)[0]
+
+
+def label_stance(label):
+    """
+    Map a dataset label to FAVOR or AGAINST. Text labels are parsed like model
+    answers; BPDisC's numeric labels use 1 for FAVOR and 0 for AGAINST.
+    """
+    stance = parse_stance(label)
+    if stance is not None or label is None:
+        return stance
+    try:
+        value = float(label)
+    except (TypeError, ValueError):
+        return None
+    return {1.0: "FAVOR", 0.0: "AGAINST"}.get(value)
+
+
+def _value(row, column, default=""):
+    if column and column in row and not pd.isna(row[column]):
+        return str(row[column])
+    return default
+
+
+def build_inputs(row, text_column="translation", context_column="info_from_graph", entity="Awami League"):
+    """
+    Prompt variables for every strategy from one dataset row.
+    GRASP-ChoQ reads 'relational_text' and 'unstructured_data' columns when present
+    and falls back to the shared context column for the relational part.
+    """
+    context = _value(row, context_column)
+    return {
+        "tweet": _value(row, text_column),
+        "entity": entity,
+        "context": context,
+        "tweet_info": _value(row, "tweet_info"),
+        "relational_text": _value(row, "relational_text", context),
+        "unstructured_data": _value(row, "unstructured_data"),
+    }
+
+
+def usage_counts(message):
+    """Prompt, completion and cached prompt tokens from a LangChain AIMessage."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("input_token_details") or {}
+    return {
+        "prompt_tokens": usage.get("input_tokens", 0),
+        "completion_tokens": usage.get("output_tokens", 0),
+        "cached_tokens": details.get("cache_read", 0) or 0,
+    }
+
+
+def build_strategy_messages(strategy, inputs):
+    """
+    Render the prompt of `strategy` for one row.
+
+    Returns:
+    tuple: (classifier module, prompt messages)
+    """
+    module_name, variables = STRATEGIES[strategy]
+    module = importlib.import_module(module_name)
+    # Modules with their own prompt assembly (e.g. GRASP-ChoQ context budgets) provide build_messages
+    build_messages = getattr(module, "build_messages", module.prompt.format_messages)
+    return module, build_messages(**{name: inputs[name] for name in variables})
+
+
+def prefetch_strategy_examples(strategy, rows):
+    """
+    Select the example-store demonstrations of every row up front, in
+    vectorized batches, for strategies whose prompts include them (those
+    with NUM_EXAMPLES). Without an example store this does nothing.
+    """
+    if strategy not in STRATEGIES:
+        return
+    module = importlib.import_module(STRATEGIES[strategy][0])
+    if hasattr(module, "NUM_EXAMPLES") and rows:
+        with tracing.span("examples.prefetch", strategy=strategy, rows=len(rows)):
+            prefetch_examples([inputs["tweet"] for _, inputs, _ in rows], k=module.NUM_EXAMPLES)
+
+
+async def classify_async(strategy, inputs, limiter=None, max_retries=5):
+    """
+    Classify one row with `strategy` through the response cache.
+
+    Returns:
+    dict: raw answer, parsed stance, token counts and whether the answer came from the cache
+    """
+    module, messages = build_strategy_messages(strategy, inputs)
+    llm = module.get_llm()
+    counts = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    computed = False
+
+    async def request():
+        nonlocal computed
+        computed = True
+        message = await llm.ainvoke(messages)
+        counts.update(usage_counts(message))
+        tracing.add_usage(message)
+        return message.content
+
+    with tracing.span("llm.classify", strategy=strategy):
+        raw = await cached_completion_async(
+            llm.model_name,
+            messages,
+            {"temperature": llm.temperature},
+            lambda: call_with_retries_async(request, max_retries=max_retries, limiter=limiter)
+        )
+    return {"raw": raw, "stance": parse_stance(raw), "cache_hit": not computed, **counts}
+
+
+async def classify_pack_async(strategy, packed_rows, limiter=None, max_retries=5):
+    """
+    Classify several rows in one packed request (see packed.classify_packed_async).
+
+    Returns:
+    list: One result dict per row; rows without a valid answer get stance None.
+          Token counts are split evenly across the pack.
+    """
+    module = importlib.import_module(STRATEGIES[strategy][0])
+    first_inputs = packed_rows[0][1]
+    prompt_vars = {name: first_inputs[name] for name in PACKED_STRATEGIES[strategy]}
+    usage = {}
+    stances = await classify_packed_async(
+        [inputs["tweet"] for _, inputs, _ in packed_rows],
+        module.packed_prompt,
+        module.get_llm(),
+        pack_size=len(packed_rows),
+        usage=usage,
+        limiter=limiter,
+        max_retries=max_retries,
+        **prompt_vars
+    )
+    share = len(packed_rows)
+    return [{
+        "stance": stance,
+        "pack": share,
+        "cache_hit": not usage.get("requests"),
+        "prompt_tokens": usage.get("prompt_tokens", 0) / share,
+        "completion_tokens": usage.get("completion_tokens", 0) / share,
+        "cached_tokens": 0,
+    } for stance in stances]
+
+
+async def run_strategy_async(rows, strategy, output_file, concurrency=16, requests_per_second=5.0,
+                             max_retries=5, sync_interval=2.0, pack_size=1, classify=None):
+    """
+    Classify (row ID, inputs, label) triples with one strategy and append a JSONL
+    record per row as it finishes. Rows already classified in `output_file` are
+    skipped, so an interrupted run resumes where it stopped.
+
+    With pack_size > 1, strategies in PACKED_STRATEGIES send `pack_size` tweets
+    per request; rows that get no valid answer are recorded as errors and
+    retried on the next run.
+
+    `classify` replaces classify_async for single rows: an async function
+    (inputs, limiter, max_retries) -> result dict, e.g. the cascade classifier.
+
+    Returns:
+    DataFrame: One row per classified row with stance, latency and token usage
+    """
+    done = {record["row"] for record in read_records(output_file) if "stance" in record}
+    pending_rows = [row for row in rows if row[0] not in done]
+    if pack_size <= 1 or strategy not in PACKED_STRATEGIES or classify is not None:
+        pack_size = 1
+    if classify is None:
+        def classify(inputs, limiter, max_retries):
+            return classify_async(strategy, inputs, limiter=limiter, max_retries=max_retries)
+        prefetch_strategy_examples(strategy, pending_rows)
+    pending = iter([pending_rows[start:start + pack_size] for start in range(0, len(pending_rows), pack_size)])
+    limiter = TokenBucket(requests_per_second, capacity=max(1.0, requests_per_second))
+    writer = CheckpointWriter(output_file, sync_interval=sync_interval)
+    completed = 0
+
+    async def worker():
+        nonlocal completed
+        # Workers pull from a shared iterator so only `concurrency` requests are ever in flight
+        for batch in pending:
+            start = time.perf_counter()
+            try:
+                if pack_size > 1:
+                    results = await classify_pack_async(strategy, batch, limiter=limiter, max_retries=max_retries)
+                else:
+                    results = [await classify(batch[0][1], limiter=limiter, max_retries=max_retries)]
+                latency = time.perf_counter() - start
+                for (row_id, _, label), result in zip(batch, results):
+                    if result["stance"] is None and pack_size > 1:
+                        writer.write({"row": row_id, "error": "no valid answer in packed response", "latency": latency})
+                    else:
+                        writer.write({"row": row_id, "label": label, "latency": latency, **result})
+            except Exception as e:
+                latency = time.perf_counter() - start
+                for row_id, _, _ in batch:
+                    print(f"Error classifying row {row_id} with {strategy}: {e}")
+                    writer.write({"row": row_id, "error": str(e), "latency": latency})
+            completed += len(batch)
+            if completed % 50 < len(batch):
+                print(f"{strategy}: classified {completed} tweets")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    finally:
+        writer.close()
+
+    # Keep the latest record per row
+    records = {record["row"]: record for record in read_records(output_file)}
+    results = pd.DataFrame(list(records.values()))
+    # Rows finished by earlier runs are in `results` too; summarize measures throughput on this run's rows
+    results.attrs["processed"] = completed
+    return results
+
+
+def summarize(strategy, results, wall_time):
+    """
+    Accuracy, latency, token and throughput summary for one strategy run.
+    Throughput counts only the rows processed during `wall_time` (the
+    'processed' attribute set by run_strategy_async), not rows resumed from
+    the checkpoint.
+    """
+    ok = results[results["stance"].notna()] if "stance" in results else results.iloc[0:0]
+    processed = results.attrs.get("processed", len(results))
+    summary = {
+        "strategy": strategy,
+        "rows": len(results),
+        "processed": processed,
+        "errors": int(results["error"].notna().sum()) if "error" in results else 0,
+        "rows_per_sec": processed / wall_time if wall_time > 0 else 0.0,
+        "latency_p50": results["latency"].quantile(0.5) if len(results) else 0.0,
+        "latency_p99": results["latency"].quantile(0.99) if len(results) else 0.0,
+    }
+    for column in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+        summary[column] = int(results[column].fillna(0).sum()) if column in results else 0
+    if len(ok) and "label" in ok and ok["label"].notna().any():
+        labelled = ok[ok["label"].notna()]
+        summary["accuracy"] = (labelled["stance"] == labelled["label"].map(label_stance)).mean()
+    return summary
+
+
+def load_rows(input_file, text_column="translation", context_column="info_from_graph", label_column="label",
+              id_column=None, entity="Awami League"):
+    """
+    Load a dataset as (row ID, prompt inputs, label) triples, skipping rows without text.
+    The defaults match BPDisC. A named column missing from the dataset raises
+    ValueError; pass None for a context or label column the dataset lacks.
+    """
+    df = load_dataset(input_file)
+    print(f"Dataset size: {len(df)} tweets")
+    missing = [column for column in (text_column, context_column, label_column, id_column)
+               if column is not None and column not in df.columns]
+    if missing:
+        raise ValueError(f"Columns {missing} not found in '{input_file}'; available columns: {list(df.columns)}")
+    df = df[df[text_column].notna()]
+    ids = df[id_column] if id_column else pd.Series(df.index, index=df.index)
+    rows = []
+    for row_id, (_, row) in zip(ids, df.iterrows()):
+        row_id = row_id.item() if hasattr(row_id, "item") else row_id
+        label = _value(row, label_column, None)
+        rows.append((row_id, build_inputs(row, text_column, context_column, entity), label))
+    return rows
+
+
+def run_strategies(input_file, strategies=tuple(STRATEGIES), output_dir="predictions",
+                   text_column="translation", context_column="info_from_graph", label_column="label",
+                   id_column=None, entity="Awami League", concurrency=16, requests_per_second=5.0,
+                   max_retries=5, pack_size=1):
+    """
+    Run each strategy over the dataset and print a comparison table.
+    Predictions go to '<output_dir>/<strategy>.jsonl'; with pack_size > 1,
+    zero_shot and few_shot send that many tweets per request. Rows that are
+    demonstrations in the example store are skipped (see held_out_rows).
+
+    Returns:
+    DataFrame: One summary row per strategy
+    """
+    rows = held_out_rows(load_rows(input_file, text_column, context_column, label_column, id_column, entity),
+                         input_file, id_column)
+
+    os.makedirs(output_dir, exist_ok=True)
+    summaries = []
+    for strategy in strategies:
+        print(f"Running {strategy} on {len(rows)} tweets")
+        start = time.perf_counter()
+        results = asyncio.run(run_strategy_async(
+            rows,
+            strategy,
+            os.path.join(output_dir, f"{strategy}.jsonl"),
+            concurrency=concurrency,
+            requests_per_second=requests_per_second,
+            max_retries=max_retries,
+            pack_size=pack_size
+        ))
+        summaries.append(summarize(strategy, results, time.perf_counter() - start))
+
+    summary_df = pd.DataFrame(summaries)
+    print(summary_df.to_string(index=False))
+    print("Time, tokens and retries by operation:")
+    tracing.get_tracer().print_summary()
+    return summary_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify a dataset with one or more stance strategies")
+    parser.add_argument("input_file", nargs="?", default="BPDisC_translated.xlsx")
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES))
+    parser.add_argument("--output-dir", default="predictions")
+    parser.add_argument("--text-column", default="translation")
+    parser.add_argument("--context-column", default="info_from_graph",
+                        help="Context for few_shot_rag and grasp_choq; 'none' if the dataset has none")
+    parser.add_argument("--label-column", default="label", help="Gold labels; 'none' for unlabeled data")
+    parser.add_argument("--id-column", default=None)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests-per-second", type=float, default=5.0)
+    parser.add_argument("--pack-size", type=int, default=1, help="Tweets per request for zero_shot and few_shot")
+    parser.add_argument("--trace-file", default=None, help="Append spans to this file as OTLP/JSON lines")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address the metrics endpoint binds to")
+    args = parser.parse_args()
+
+    if args.metrics_port is not None:
+        tracing.serve_metrics(args.metrics_port, host=args.metrics_host)
+    if args.trace_file:
+        tracing.get_tracer().stream_to(args.trace_file)
+    run_strategies(
+        args.input_file,
+        strategies=args.strategies,
+        output_dir=args.output_dir,
+        text_column=args.text_column,
+        context_column=None if args.context_column.lower() == "none" else args.context_column,
+        label_column=None if args.label_column.lower() == "none" else args.label_column,
+        id_column=args.id_column,
+        concurrency=args.concurrency,
+        requests_per_second=args.requests_per_second,
+        pack_size=args.pack_size
+    )
@@ -0,0 +1,89 @@
+import math
+import pandas as pd
+import pytest
+from cascade import logprob_confidence, tune_thresholds, vote_confidence
+from fake_llm_server import fake_confidence, fake_logprobs
+
+STAGES = ("zero_shot", "grasp_choq")
+
+
+def position(token, alternatives=()):
+    top = [{"token": alt, "logprob": math.log(p)} for alt, p in alternatives]
+    logprob = top[0]["logprob"] if top else 0.0
+    return {"token": token, "logprob": logprob, "top_logprobs": top}
+
+
+def test_logprob_confidence_scores_the_verdict_not_the_reasoning():
+    logprobs = {"content": [
+        position("The"), position(" tweet"), position(" is"),
+        position(" against", [(" against", 0.99), (" for", 0.01)]),
+        position(" Yunus"), position(".\n"), position("Stance"), position(":"),
+        position(" FAV", [(" FAV", 0.6), (" AG", 0.3), (" neutral", 0.1)]),
+        position("OR"),
+    ]}
+    stance, confidence = logprob_confidence(logprobs)
+    assert stance == "FAVOR"
+    assert confidence == pytest.approx(0.6 / 0.9)
+
+
+def test_logprob_confidence_matches_the_fake_server():
+    text = "Tweet: Yunus government faces protests"
+    content = "Q: Who is criticized? A: Yunus.\nStance: AGAINST"
+    stance, confidence = logprob_confidence(fake_logprobs(content, text))
+    assert stance == "AGAINST"
+    assert confidence == pytest.approx(fake_confidence(text))
+
+
+@pytest.mark.parametrize("logprobs", [
+    None,
+    {"content": []},
+    {"content": [position("The"), position(" tweet"), position(" is"), position(" neutral")]},
+    # The verdict shares its token with the marker, so there is no stance token to score
+    {"content": [position("Stance: F"), position("AVOR")]},
+])
+def test_logprob_confidence_without_a_scorable_verdict(logprobs):
+    assert logprob_confidence(logprobs) == (None, None)
+
+
+def test_vote_confidence():
+    answers = ["Stance: FAVOR", "Stance: FAVOR", "Stance: AGAINST", "I cannot tell."]
+    assert vote_confidence(answers) == ("FAVOR", 0.5)
+    assert vote_confidence(["Neutral", "Unclear"]) == (None, 0.0)
+
+
+def stage_rows():
+    # The cheap stage is confidently right on two rows and unsure and wrong on two
+    return pd.DataFrame({
+        "row": [0, 1, 2, 3],
+        "label": ["FAVOR", "AGAINST", "FAVOR", "AGAINST"],
+        "zero_shot_stance": ["FAVOR", "AGAINST", "AGAINST", "FAVOR"],
+        "zero_shot_confidence": [0.99, 0.98, 0.6, 0.7],
+        "zero_shot_tokens": [100, 100, 100, 100],
+        "grasp_choq_stance": ["FAVOR", "AGAINST", "FAVOR", "AGAINST"],
+        "grasp_choq_confidence": [0.9, 0.9, 0.9, 0.9],
+        "grasp_choq_tokens": [1000, 1000, 1000, 1000],
+    })
+
+
+def test_tune_thresholds_keeps_accuracy_at_the_lowest_cost():
+    tuned = tune_thresholds(stage_rows(), stages=STAGES)
+    assert 0.7 < tuned["thresholds"]["zero_shot"] <= 0.98
+    assert tuned["accuracy"] == 1.0
+    assert tuned["reference_accuracy"] == 1.0
+    # Two rows exit after the first stage, two pay for both
+    assert tuned["mean_tokens"] == pytest.approx((2 * 100 + 2 * 1100) / 4)
+    assert tuned["reference_tokens"] == pytest.approx(1100)
+    assert tuned["exit_rates"] == {"zero_shot": 0.5, "grasp_choq": 0.5}
+
+
+def test_tune_thresholds_trades_accuracy_for_cost_when_allowed():
+    tuned = tune_thresholds(stage_rows(), stages=STAGES, max_accuracy_drop=0.5)
+    assert tuned["exit_rates"]["zero_shot"] == 1.0
+    assert tuned["mean_tokens"] == pytest.approx(100)
+    assert tuned["accuracy"] == 0.5
+
+
+def test_tune_thresholds_needs_token_counts():
+    table = stage_rows().assign(grasp_choq_tokens=0)
+    with pytest.raises(ValueError, match="grasp_choq"):
+        tune_thresholds(table, stages=STAGES)
@@ -0,0 +1,61 @@
+import numpy as np
+from benchmark import HashingEmbeddings, synthetic_corpus
+from example_store import ExampleStore, text_hash
+
+
+def build(tmp_path, texts, stances, **kwargs):
+    return ExampleStore.build(texts, stances, str(tmp_path / "store"), embeddings=HashingEmbeddings(), **kwargs)
+
+
+def test_ivf_search_recalls_exact_neighbors(tmp_path):
+    corpus = synthetic_corpus(2000)
+    texts = corpus["translation"].tolist()
+    stances = ["FAVOR" if label else "AGAINST" for label in corpus["label"]]
+    ivf = ExampleStore.build(texts, stances, str(tmp_path / "ivf"), embeddings=HashingEmbeddings(), n_lists=40)
+    exact = ExampleStore.build(texts, stances, str(tmp_path / "exact"), embeddings=HashingEmbeddings(), n_lists=1)
+
+    queries = np.array(HashingEmbeddings().embed_documents(synthetic_corpus(200, seed=1)["translation"]))
+    ivf_scores = ivf.search_vectors(queries, k=5)[1]
+    exact_scores = exact.search_vectors(queries, k=5)[1]
+    # The two stores order rows differently, so compare the k-th best similarity
+    recall = np.mean(ivf_scores[:, -1] >= exact_scores[:, -1] - 1e-6)
+    assert recall >= 0.9
+
+
+def test_select_skips_the_query_and_near_duplicates(tmp_path):
+    texts = [
+        "Sheikh Hasina opens the new bridge",
+        "sheikh hasina OPENS the new bridge again",
+        "Yunus government faces protests in Dhaka",
+        "Awami League rally in Chittagong",
+    ]
+    store = build(tmp_path, texts, ["FAVOR", "FAVOR", "AGAINST", "FAVOR"])
+    selected = [example["text"] for example in store.select("Sheikh  Hasina opens the new bridge", k=4)]
+    assert texts[0] not in selected
+    assert texts[1] not in selected
+    assert all(example["score"] < store.max_similarity for example in store.select(texts[2], k=4))
+
+
+def test_select_returns_each_stored_tweet_once(tmp_path):
+    copies = ["Awami League rally in Dhaka"] * 6
+    others = ["Awami League rally in Chittagong", "Awami League meeting in Dhaka", "Yunus speaks in Dhaka"]
+    store = build(tmp_path, copies + others, ["FAVOR", "AGAINST"] * 3 + ["FAVOR"] * 3, n_lists=1)
+    store.max_similarity = None
+    selected = store.select("Awami League rally today in Dhaka", k=3)
+    hashes = [text_hash(example["text"]) for example in selected]
+    assert len(selected) == 3
+    assert len(set(hashes)) == 3
+    assert sum(example["text"] == copies[0] for example in selected) == 1
+
+
+def test_select_batch_matches_select(tmp_path):
+    corpus = synthetic_corpus(300)
+    store = build(tmp_path, corpus["translation"], corpus["label"].map({1: "FAVOR", 0: "AGAINST"}))
+    store.max_similarity = None
+    tweets = synthetic_corpus(20, seed=2)["translation"].tolist()
+    batch = store.select_batch(tweets, k=3)
+    fresh = ExampleStore(store.path, embeddings=HashingEmbeddings(), max_similarity=None)
+    # Equal-scoring examples may come back in either order
+    for batched, tweet in zip(batch, tweets):
+        single = fresh.select(tweet, k=3)
+        assert np.allclose([example["score"] for example in batched], [example["score"] for example in single])
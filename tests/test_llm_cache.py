@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from llm_cache import CacheMiss, ResponseCache, cached_completion_async
+
+
+def test_replay_mode_raises_on_miss(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    writer = ResponseCache(path)
+    writer.put("known", {"answer": "Stance: FAVOR"})
+    writer.close()
+
+    replay = ResponseCache(path, mode="replay")
+    assert replay.get("known") == {"answer": "Stance: FAVOR"}
+    with pytest.raises(CacheMiss):
+        replay.get("unknown")
+    replay.put("unknown", "ignored")
+    assert replay.stats()["entries"] == 1
+
+
+def test_replay_mode_needs_an_existing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        ResponseCache(str(tmp_path / "missing.sqlite"), mode="replay")
+
+
+def test_eviction_keeps_recently_read_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, key)
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a") == "a"
+    cache.evict()
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
+    assert cache.get("c") == "c"
+    assert cache.stats()["entries"] == 2
+
+
+def test_eviction_by_size(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=30)
+    for key in ("a", "b", "c"):
+        cache.put(key, key * 10)
+    cache.evict()
+    assert cache.stats()["bytes"] <= 30
+    assert cache.get("a") is None
+    assert cache.get("c") == "c" * 10
+
+
+def test_access_times_survive_reopen(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.close()
+
+    reopened = ResponseCache(path, max_entries=1)
+    reopened.evict()
+    assert reopened.get("a") == 1
+    assert reopened.get("b") is None
+
+
+def test_cached_completion_async_computes_once(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return "Stance: AGAINST"
+
+    async def run():
+        first = await cached_completion_async("m", "prompt", {}, compute, cache=cache)
+        second = await cached_completion_async("m", "prompt", {}, compute, cache=cache)
+        return first, second
+
+    assert asyncio.run(run()) == ("Stance: AGAINST", "Stance: AGAINST")
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
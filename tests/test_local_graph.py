@@ -0,0 +1,24 @@
+from local_graph import LocalGraph, export_snapshot
+
+
+class EntityOnlyGraph:
+    """Answers export_snapshot's queries for a graph with entities but no Document nodes."""
+
+    def query(self, cypher):
+        if "RETURN DISTINCT n.id" in cypher:
+            return [{"id": "Awami League"}, {"id": "Sheikh Hasina"}]
+        if "type(r)" in cypher:
+            return [{"source": "Sheikh Hasina", "type": "LEADS", "target": "Awami League"}]
+        return []
+
+
+def test_export_snapshot_without_documents(tmp_path):
+    path = str(tmp_path / "graph.npz")
+    export_snapshot(EntityOnlyGraph(), path)
+    graph = LocalGraph.load(path)
+    assert graph.doc_texts == []
+    assert graph.similarity_search("Hasina") == []
+    assert graph.bulk_similarity_search(["Hasina", "Yunus"]) == [[], []]
+    assert graph.query_entity_neighborhoods(["Hasina"]) == {
+        "Hasina": ["Sheikh Hasina - LEADS -> Awami League"]
+    }
@@ -0,0 +1,46 @@
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from preprocess import preprocess_twitter_dataset_streaming
+
+
+TWEET = "The country is moving forward under this government"
+
+
+def test_streaming_handles_columns_typed_differently_across_chunks(tmp_path):
+    input_file = tmp_path / "scrape.csv"
+    pd.DataFrame({
+        "tweet_text": [TWEET] * 6,
+        "user_bio": ["Awami League supporter"] * 6,
+        "has_image": [False] * 6,
+        "location": [None, None, None, "Dhaka", "Dhaka", "Dhaka"],
+        "retweets": [None, None, None, 1, 2, 3],
+    }).to_csv(input_file, index=False)
+    output_file = tmp_path / "out.parquet"
+
+    written = preprocess_twitter_dataset_streaming(str(input_file), str(output_file), chunksize=3)
+
+    table = pq.read_table(output_file)
+    assert written == 6
+    assert table.column("location").to_pylist() == [None, None, None, "Dhaka", "Dhaka", "Dhaka"]
+    assert table.column("retweets").to_pylist()[3:] == ["1", "2", "3"]
+
+
+def test_streaming_leaves_no_partial_output_on_incompatible_chunk(tmp_path):
+    input_file = tmp_path / "scrape.csv"
+    pd.DataFrame({
+        "tweet_text": [TWEET] * 4,
+        "user_bio": ["BNP"] * 4,
+        "followers": ["10", "20", "many", "more"],
+    }).to_csv(input_file, index=False)
+    output_file = tmp_path / "out.parquet"
+
+    with pytest.raises(ValueError, match="followers"):
+        preprocess_twitter_dataset_streaming(str(input_file), str(output_file), chunksize=2)
+    assert not output_file.exists()
+    assert not (tmp_path / "out.parquet.tmp").exists()
+
+    written = preprocess_twitter_dataset_streaming(str(input_file), str(output_file), chunksize=2,
+                                                   dtype={"followers": str})
+    assert written == 4
+    assert pq.read_table(output_file).column("followers").to_pylist() == ["10", "20", "many", "more"]
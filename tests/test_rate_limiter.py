@@ -0,0 +1,145 @@
+import asyncio
+import time
+import pytest
+from openai import AsyncOpenAI
+import rate_limiter
+from fake_llm_server import FakeLLMServer
+from rate_limiter import TokenBucket, call_with_retries, call_with_retries_async, is_retryable_error, retry_after_seconds
+import resources
+from resources import SDK_MAX_RETRIES
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code=None, headers=None):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers or {}})()
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+def test_bucket_allows_a_burst_of_capacity_then_throttles():
+    bucket = TokenBucket(rate=20, capacity=3)
+    waits = [bucket.acquire() for _ in range(4)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(0.05, abs=0.01)
+
+
+def test_bucket_serves_waiting_callers_in_arrival_order():
+    bucket = TokenBucket(rate=50, capacity=1)
+    finished = []
+
+    async def caller(i):
+        await bucket.acquire_async()
+        finished.append(i)
+
+    async def run():
+        await asyncio.gather(*(caller(i) for i in range(5)))
+
+    start = time.monotonic()
+    asyncio.run(run())
+    assert finished == [0, 1, 2, 3, 4]
+    assert time.monotonic() - start == pytest.approx(0.08, abs=0.04)
+
+
+def test_bucket_rejects_a_non_positive_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (ProviderError(429), True),
+    (ProviderError(500), True),
+    (ProviderError(503), True),
+    (ProviderError(400), False),
+    (ProviderError(401), False),
+    (APIConnectionError(), True),
+    (TimeoutError(), True),
+    (ValueError("bad input"), False),
+])
+def test_is_retryable_error(error, retryable):
+    assert is_retryable_error(error) is retryable
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(ProviderError(429, {"retry-after": "1.5"})) == 1.5
+    assert retry_after_seconds(ProviderError(429, {"retry-after": "soon"})) is None
+    assert retry_after_seconds(ValueError()) is None
+
+
+def test_call_with_retries_does_not_retry_client_errors():
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ProviderError(400)
+
+    with pytest.raises(ProviderError):
+        call_with_retries(fail, base_delay=0)
+    assert len(calls) == 1
+
+
+def test_call_with_retries_async_waits_for_retry_after(monkeypatch):
+    delays = []
+    sleep = asyncio.sleep
+
+    async def recording_sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", recording_sleep)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ProviderError(429, {"retry-after": "2.5"})
+        return "Stance: FAVOR"
+
+    assert asyncio.run(call_with_retries_async(flaky, base_delay=100)) == "Stance: FAVOR"
+    assert delays == [2.5, 2.5]
+
+
+def test_call_with_retries_async_recovers_from_fake_server_rate_limits():
+    with FakeLLMServer(latency=0.0, rate_limit=5) as server:
+        client = AsyncOpenAI(base_url=server.url, api_key="test", max_retries=SDK_MAX_RETRIES)
+
+        async def classify(i):
+            response = await call_with_retries_async(lambda: client.chat.completions.create(
+                model="fake",
+                messages=[{"role": "user", "content": f"Tweet: rally number {i}"}]
+            ))
+            return response.choices[0].message.content
+
+        async def run():
+            try:
+                return await asyncio.gather(*(classify(i) for i in range(10)))
+            finally:
+                await client.close()
+
+        answers = asyncio.run(run())
+    assert len(answers) == 10
+    assert server.stats["rate_limited"] > 0
+    assert server.stats["ok"] == 10
+
+
+def test_shared_client_leaves_retries_to_call_with_retries(monkeypatch):
+    with FakeLLMServer(latency=0.0, error_rate=1.0) as server:
+        monkeypatch.setenv("OPENROUTER_BASE_URL", server.url)
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test")
+        resources.registry.reset("openrouter_async_client")
+        client = resources.openrouter_async_client()
+        resources.registry.reset("openrouter_async_client")
+
+        async def run():
+            try:
+                await client.chat.completions.create(model="fake", messages=[{"role": "user", "content": "Tweet: hi"}])
+            finally:
+                await client.close()
+
+        with pytest.raises(Exception) as raised:
+            asyncio.run(run())
+    assert is_retryable_error(raised.value)
+    assert server.stats["requests"] == 1
@@ -0,0 +1,29 @@
+import pytest
+from stance_runner import find_stance, label_stance, parse_stance
+
+
+@pytest.mark.parametrize("answer, stance", [
+    ("Stance: FAVOR", "FAVOR"),
+    ("**Stance:** Against", "AGAINST"),
+    ("Favor", "FAVOR"),
+    ("A: The tweet is against the Yunus government. Therefore the stance is in FAVOR of the Awami League.", "FAVOR"),
+    ("The tweet is not in favor of the Awami League.", "AGAINST"),
+    ("Q: Who is criticized? A: The tweet is against Yunus, which favors the Awami League.\nStance: FAVOR", "FAVOR"),
+    ("Stance: FAVOR\nOn reflection the tweet attacks the party.\nStance: AGAINST", "AGAINST"),
+    ("The tweet is neutral.", None),
+    (None, None),
+])
+def test_parse_stance_reads_the_final_verdict(answer, stance):
+    assert parse_stance(answer) == stance
+
+
+def test_find_stance_points_at_the_verdict_word():
+    answer = "A: against Yunus.\nStance: FAVOR"
+    stance, offset = find_stance(answer)
+    assert stance == "FAVOR"
+    assert answer[offset:].startswith("FAVOR")
+
+
+def test_label_stance_reads_numeric_and_text_labels():
+    assert [label_stance(label) for label in (1, 0, "1.0", "favor", "AGAINST", 2, None)] == \
+        ["FAVOR", "AGAINST", "FAVOR", "FAVOR", "AGAINST", None, None]
@@ -0,0 +1,329 @@
+import contextvars
+import json
+import secrets
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import LatencyHistogram
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # Spans are still recorded, aggregated and exported locally
+    otel_trace = None
+
+# Numeric span attributes summed per span name, with their Prometheus counter names
+COUNTERS = {
+    "prompt_tokens": "prompt_tokens_total",
+    "completion_tokens": "completion_tokens_total",
+    "cached_tokens": "cached_tokens_total",
+    "retries": "retries_total",
+    "cache_hits": "cache_hits_total",
+    "queue_wait": "queue_wait_seconds_total",
+}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation. Attributes set while it is open are exported with it;
+    the ones in COUNTERS are also summed per span name.
+    """
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes)
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = None
+        self.end_ns = None
+        self.error = None
+        self._token = None
+        self._otel = None
+        self._otel_span = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, amount=1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def __enter__(self):
+        if otel_trace is not None:
+            self._otel = otel_trace.get_tracer(__name__).start_as_current_span(self.name)
+            self._otel_span = self._otel.__enter__()
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        if self._otel is not None:
+            for key, value in self.attributes.items():
+                self._otel_span.set_attribute(key, value)
+            self._otel.__exit__(exc_type, exc, tb)
+        self.tracer.record(self)
+        return False
+
+    def to_otlp(self):
+        """The span as an OTLP/JSON span object."""
+        attributes = []
+        for key, value in self.attributes.items():
+            if isinstance(value, bool):
+                typed = {"boolValue": value}
+            elif isinstance(value, int):
+                typed = {"intValue": str(value)}
+            elif isinstance(value, float):
+                typed = {"doubleValue": value}
+            else:
+                typed = {"stringValue": str(value)}
+            attributes.append({"key": key, "value": typed})
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": attributes,
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _resource_spans(spans):
+    # OTLP/JSON ExportTraceServiceRequest body
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "grasp-choq"}}]},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp() for span in spans]}],
+    }]}
+
+
+class _SpanStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+
+class Tracer:
+    """
+    Records spans for LLM calls, graph queries and vector searches.
+
+    Every finished span updates a per-name latency histogram, error count and
+    the COUNTERS sums, so the summary and Prometheus output stay constant-size.
+    The most recent `max_spans` spans are kept for export_spans; stream_to
+    writes every span to a file as it finishes instead.
+    When the OpenTelemetry API is installed, spans are mirrored to it as well,
+    so a configured OpenTelemetry SDK exports them too.
+
+    Parameters:
+    max_spans (int): Finished spans kept for export_spans
+    """
+
+    def __init__(self, max_spans=10000):
+        self.spans = deque(maxlen=max_spans)
+        self._stats = {}
+        self._sink = None
+        self._lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        """Context manager timing one operation: `with tracer.span("llm.classify", strategy=s):`"""
+        return Span(self, name, attributes)
+
+    def record(self, span):
+        with self._lock:
+            stats = self._stats.get(span.name)
+            if stats is None:
+                stats = self._stats[span.name] = _SpanStats()
+            if span.error:
+                stats.errors += 1
+            for key in COUNTERS:
+                value = span.attributes.get(key)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats.counters[key] += value
+            self.spans.append(span)
+            if self._sink is not None:
+                self._sink.write(json.dumps(_resource_spans([span])) + "\n")
+        stats.latency.observe(span.duration)
+
+    def summary(self):
+        """
+        One row per span name: calls, errors, total and p50/p99 seconds plus
+        token, retry, cache-hit and queue-wait totals.
+
+        Returns:
+        DataFrame: Sorted by total time, largest first
+        """
+        import pandas as pd
+
+        with self._lock:
+            items = list(self._stats.items())
+        rows = []
+        for name, stats in items:
+            summary = stats.latency.summary()
+            rows.append({
+                "span": name,
+                "calls": summary["count"],
+                "errors": stats.errors,
+                "total_sec": stats.latency.total,
+                "p50": summary["p50"],
+                "p99": summary["p99"],
+                **stats.counters,
+            })
+        columns = ["span", "calls", "errors", "total_sec", "p50", "p99", *COUNTERS]
+        return pd.DataFrame(rows, columns=columns).sort_values("total_sec", ascending=False, ignore_index=True)
+
+    def print_summary(self):
+        summary = self.summary()
+        if len(summary):
+            print(summary.to_string(index=False))
+
+    def prometheus_text(self, prefix="grasp"):
+        """All span metrics in the Prometheus text exposition format."""
+        with self._lock:
+            items = sorted(self._stats.items())
+        lines = [
+            f"# HELP {prefix}_span_duration_seconds Duration of pipeline operations by span name",
+            f"# TYPE {prefix}_span_duration_seconds histogram",
+        ]
+        for name, stats in items:
+            for bound, count in stats.latency.buckets_cumulative():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{prefix}_span_duration_seconds_bucket{{span="{name}",le="{le}"}} {count}')
+            lines.append(f'{prefix}_span_duration_seconds_sum{{span="{name}"}} {stats.latency.total}')
+            lines.append(f'{prefix}_span_duration_seconds_count{{span="{name}"}} {stats.latency.count}')
+        lines.append(f"# TYPE {prefix}_span_errors_total counter")
+        lines.extend(f'{prefix}_span_errors_total{{span="{name}"}} {stats.errors}' for name, stats in items)
+        for key, metric in COUNTERS.items():
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            lines.extend(f'{prefix}_{metric}{{span="{name}"}} {stats.counters[key]}' for name, stats in items)
+        return "\n".join(lines) + "\n"
+
+    def export_spans(self, path):
+        """
+        Append the kept spans to `path` as OTLP/JSON, one ResourceSpans object
+        per line, and clear them.
+
+        Returns:
+        int: Number of spans written
+        """
+        with self._lock:
+            spans = list(self.spans)
+            self.spans.clear()
+        if not spans:
+            return 0
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(_resource_spans(spans)) + "\n")
+        return len(spans)
+
+    def stream_to(self, path):
+        """Append every span finished from now on to `path` as an OTLP/JSON line; None stops."""
+        with self._lock:
+            if self._sink is not None:
+                self._sink.close()
+            self._sink = open(path, "a", encoding="utf-8", buffering=1) if path else None
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.spans.clear()
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    """The process-wide tracer used by the pipeline modules."""
+    return _tracer
+
+
+def span(name, **attributes):
+    """Open a span on the process-wide tracer."""
+    return _tracer.span(name, **attributes)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def add(key, amount=1):
+    """Add to a numeric attribute of the current span; a no-op outside any span."""
+    active = _current_span.get()
+    if active is not None:
+        active.add(key, amount)
+
+
+def set_attribute(key, value):
+    """Set an attribute of the current span; a no-op outside any span."""
+    active = _current_span.get()
+    if active is not None:
+        active.set(key, value)
+
+
+def add_usage(response):
+    """
+    Add the token counts of an LLM response to the current span. Accepts a
+    LangChain AIMessage (usage_metadata) or an OpenAI completion (usage).
+    """
+    active = _current_span.get()
+    if active is None or response is None:
+        return
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        details = usage.get("input_token_details") or {}
+        active.add("prompt_tokens", usage.get("input_tokens", 0) or 0)
+        active.add("completion_tokens", usage.get("output_tokens", 0) or 0)
+        active.add("cached_tokens", details.get("cache_read", 0) or 0)
+        return
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        active.add("prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+        active.add("completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+        active.add("cached_tokens", getattr(details, "cached_tokens", 0) or 0)
+
+
+def serve_metrics(port=9464, host="127.0.0.1", tracer=None):
+    """
+    Serve the tracer's Prometheus metrics on http://host:port/metrics from a daemon thread.
+    Only local clients can connect by default; pass host="0.0.0.0" to expose it on every interface.
+
+    Returns:
+    ThreadingHTTPServer: Call shutdown() to stop it
+    """
+    tracer = tracer or _tracer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = tracer.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -1,32 +1,50 @@
 import pandas as pd
+import asyncio
 import time
-import os
 from dotenv import load_dotenv
-from openai import OpenAI
+import resources
+import tracing
+from rate_limiter import TokenBucket, call_with_retries, call_with_retries_async
+from llm_cache import cached_completion, cached_completion_async
+from dataset_cache import load_dataset
+from checkpoint import CheckpointWriter, read_records
 
 # Load environment variables
 load_dotenv()
 
-# Initialize clients
-client = OpenAI(
-    base_url="https://api.openrouter.ai/v1",  
-    api_key=os.getenv("OPENROUTER_API_KEY")   
+# `client` and the `async_client` used by translate_dataset_async are shared
+# through the resource registry and only built when first used
+__getattr__ = resources.lazy_attributes(
+    __name__,
+    client=resources.openrouter_client,
+    async_client=resources.openrouter_async_client
 )
 
-def load_tweet_data(file_path):
+def load_tweet_data(file_path, columns=None):
     """
-    Load tweet data from Excel or CSV file
+    Load tweet data from Excel, CSV, Parquet or JSONL file.
+    Files are read through the Parquet dataset cache, so only the first load parses Excel.
+    """
+    if not file_path.endswith(('.xlsx', '.csv', '.parquet', '.jsonl')):
+        raise ValueError("Unsupported file format. Use .xlsx, .csv, .parquet or .jsonl")
+    return load_dataset(file_path, columns=columns)
+
+def save_tweet_data(df, file_path):
+    """
+    Save tweet data to Excel, CSV or Parquet based on the file extension
     """
     if file_path.endswith('.xlsx'):
-        return pd.read_excel(file_path)
+        df.to_excel(file_path, index=False)
     elif file_path.endswith('.csv'):
-        return pd.read_csv(file_path)
+        df.to_csv(file_path, index=False)
+    elif file_path.endswith('.parquet'):
+        df.to_parquet(file_path, index=False)
     else:
-        raise ValueError("Unsupported file format. Use .xlsx or .csv")
+        raise ValueError("Unsupported file format. Use .xlsx, .csv or .parquet")
 
-def translate_tweet(tweet, model="gpt-4o"):
+def build_translation_messages(tweet):
     """
-    Translate tweet to English using LLM
+    Build the chat messages used to translate a single tweet
     """
     translation_prompt = f"""
     Task: Translate the following tweet into English. If the tweet is already in English, output the original tweet. Do NOT translate proper nouns (e.g., names of people, organizations, specific places).
@@ -41,18 +59,55 @@ def translate_tweet(tweet, model="gpt-4o"):
     Tweet: {tweet}
     Translated Tweet (English):
     """
-    
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that translates tweets to English while preserving proper nouns. If the tweet is already in English, you output the original tweet."},
-            {"role": "user", "content": translation_prompt}
-        ],
-        temperature=0
-    )
-    translated_tweet = response.choices[0].message.content
+    return [
+        {"role": "system", "content": "You are a helpful assistant that translates tweets to English while preserving proper nouns. If the tweet is already in English, you output the original tweet."},
+        {"role": "user", "content": translation_prompt}
+    ]
+
+def translate_tweet(tweet, model="gpt-4o"):
+    """
+    Translate tweet to English using LLM
+    """
+    messages = build_translation_messages(tweet)
+
+    def request():
+        response = call_with_retries(lambda: resources.openrouter_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0
+        ))
+        tracing.add_usage(response)
+        return response.choices[0].message.content
+
+    with tracing.span("llm.translate", model=model):
+        translated_tweet = cached_completion(model, messages, {"temperature": 0}, request)
     return translated_tweet
 
+async def translate_tweet_async(tweet, model="gpt-4o", limiter=None, max_retries=5):
+    """
+    Translate tweet to English with the async client, retrying 429/5xx errors
+    with exponential backoff. `limiter` is an optional TokenBucket.
+    """
+    messages = build_translation_messages(tweet)
+
+    async def request():
+        response = await resources.openrouter_async_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0
+        )
+        tracing.add_usage(response)
+        return response.choices[0].message.content
+
+    # Cache hits skip the rate limiter entirely
+    with tracing.span("llm.translate", model=model):
+        return await cached_completion_async(
+            model,
+            messages,
+            {"temperature": 0},
+            lambda: call_with_retries_async(request, max_retries=max_retries, limiter=limiter)
+        )
+
 # def translate_tweet_with_examples(tweet, model="gpt-4o"):
 #     """
 #     Translate tweet into English, preserving proper nouns.
@@ -112,6 +167,180 @@ def translate_dataset(input_file, output_file):
     # Save processed data
     df.to_excel(output_file, index=False)
     print(f"Translation complete. Dataset saved to '{output_file}'")
+    tracing.get_tracer().print_summary()
+    return df
+
+async def translate_rows_async(rows, model="gpt-4o", concurrency=16, requests_per_second=5.0,
+                               max_retries=5, on_result=None):
+    """
+    Translate (index, text) pairs concurrently.
+    
+    Parameters:
+    rows (iterable): (index, text) pairs to translate
+    model (str): Model name passed to the API
+    concurrency (int): Maximum number of requests in flight
+    requests_per_second (float): Sustained request rate allowed by the provider
+    max_retries (int): Retries per tweet for rate-limit and server errors
+    on_result (callable): Optional callback(index, translation, error) invoked as each row finishes
+    
+    Returns:
+    dict: index -> translation for every row that succeeded
+    """
+    limiter = TokenBucket(requests_per_second, capacity=max(1.0, requests_per_second))
+    rows = iter(rows)
+    translations = {}
+    completed = 0
+
+    async def worker():
+        nonlocal completed
+        # Workers pull from a shared iterator so only `concurrency` rows are ever in flight
+        for index, text in rows:
+            try:
+                translation = await translate_tweet_async(text, model=model, limiter=limiter, max_retries=max_retries)
+                translations[index] = translation
+                error = None
+            except Exception as e:
+                print(f"Error processing row {index}: {e}")
+                translation, error = None, e
+            completed += 1
+            if completed % 10 == 0:
+                print(f"Translated {completed} tweets")
+            if on_result is not None:
+                on_result(index, translation, error)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return translations
+
+async def translate_dataset_async(input_file, output_file, model="gpt-4o", concurrency=16,
+                                  requests_per_second=5.0, max_retries=5):
+    """
+    Translate tweets from the Content column to English using concurrent async requests.
+    Throughput is bounded by `requests_per_second` rather than per-request latency;
+    translations are written back to the rows they came from.
+    """
+    df = load_tweet_data(input_file)
+    print(f"Dataset size: {len(df)} tweets")
+
+    rows = []
+    if 'Content' in df.columns:
+        rows = [(index, text) for index, text in df['Content'].items() if not pd.isna(text)]
+
+    translations = await translate_rows_async(
+        rows,
+        model=model,
+        concurrency=concurrency,
+        requests_per_second=requests_per_second,
+        max_retries=max_retries
+    )
+
+    # Assign in input order so the output matches the source row order
+    if 'translation' not in df.columns:
+        df['translation'] = pd.NA
+    ordered = [index for index in df.index if index in translations]
+    df.loc[ordered, 'translation'] = [translations[index] for index in ordered]
+
+    # Save processed data
+    df.to_excel(output_file, index=False)
+    print(f"Translation complete. Dataset saved to '{output_file}'")
+    tracing.get_tracer().print_summary()
+    return df
+
+def _json_key(value):
+    # Row IDs come from pandas and may be numpy scalars
+    return value.item() if hasattr(value, 'item') else value
+
+def load_checkpoint(checkpoint_file):
+    """
+    Replay an append-only translation checkpoint.
+    
+    Returns:
+    tuple: (done, failures) where done maps row ID -> translation and
+           failures maps row ID -> number of failed attempts for rows not yet done
+    """
+    done, failures = {}, {}
+    for record in read_records(checkpoint_file):
+        row_id = record['row']
+        if 'translation' in record:
+            done[row_id] = record['translation']
+            failures.pop(row_id, None)
+        elif row_id not in done:
+            failures[row_id] = failures.get(row_id, 0) + 1
+    return done, failures
+
+async def translate_dataset_streaming(input_file, output_file, checkpoint_file=None, id_column=None,
+                                      model="gpt-4o", concurrency=16, requests_per_second=5.0,
+                                      max_retries=5, max_attempts=3, sync_interval=2.0):
+    """
+    Translate tweets with crash recovery.
+    
+    Each finished row is appended to a JSONL checkpoint keyed by row ID. On restart
+    rows already in the checkpoint are skipped and previously failed rows are retried
+    first. The final output file is written once, after all rows are processed.
+    
+    Parameters:
+    input_file (str): Path to the Excel/CSV input
+    output_file (str): Path to the .xlsx, .csv or .parquet output
+    checkpoint_file (str): Sidecar JSONL file, defaults to '<output_file>.checkpoint.jsonl'
+    id_column (str): Column holding a stable row ID (e.g. 'Tweet ID'); defaults to the row index
+    max_attempts (int): Give up on a row after this many failed attempts across runs
+    sync_interval (float): Seconds between fsyncs of the checkpoint
+    """
+    df = load_tweet_data(input_file)
+    print(f"Dataset size: {len(df)} tweets")
+    checkpoint_file = checkpoint_file or f"{output_file}.checkpoint.jsonl"
+
+    ids = df[id_column] if id_column else pd.Series(df.index, index=df.index)
+    ids = ids.map(_json_key)
+    if ids.duplicated().any():
+        raise ValueError(f"Row IDs must be unique; '{id_column}' has duplicates")
+
+    done, failures = load_checkpoint(checkpoint_file)
+    print(f"Checkpoint: {len(done)} rows done, {len(failures)} rows to retry")
+
+    texts = {}
+    if 'Content' in df.columns:
+        texts = {row_id: text for row_id, text in zip(ids, df['Content']) if not pd.isna(text)}
+
+    # Retry queue first, then rows never attempted
+    retry_queue = [row_id for row_id in failures if row_id in texts and failures[row_id] < max_attempts]
+    new_rows = [row_id for row_id in texts if row_id not in done and row_id not in failures]
+    pending = retry_queue + new_rows
+
+    writer = CheckpointWriter(checkpoint_file, sync_interval=sync_interval)
+
+    def on_result(row_id, translation, error):
+        if error is None:
+            done[row_id] = translation
+            failures.pop(row_id, None)
+            writer.write({'row': row_id, 'translation': translation})
+        else:
+            failures[row_id] = failures.get(row_id, 0) + 1
+            writer.write({'row': row_id, 'error': str(error)})
+
+    try:
+        while pending:
+            print(f"Translating {len(pending)} rows")
+            await translate_rows_async(
+                ((row_id, texts[row_id]) for row_id in pending),
+                model=model,
+                concurrency=concurrency,
+                requests_per_second=requests_per_second,
+                max_retries=max_retries,
+                on_result=on_result
+            )
+            pending = [row_id for row_id in pending if row_id not in done and failures.get(row_id, 0) < max_attempts]
+    finally:
+        writer.close()
+
+    gave_up = [row_id for row_id in failures if row_id not in done]
+    if gave_up:
+        print(f"{len(gave_up)} rows failed {max_attempts} times and were left untranslated")
+
+    # Build the final output once
+    df['translation'] = ids.map(done)
+    save_tweet_data(df, output_file)
+    print(f"Translation complete. Dataset saved to '{output_file}'")
+    tracing.get_tracer().print_summary()
     return df
 
 if __name__ == "__main__":
@@ -120,4 +349,4 @@ if __name__ == "__main__":
     output_file = "BPDisC_translated.xlsx"
     
     print("Translating tweets from BPDisC Dataset")
-    df = translate_dataset(input_file, output_file)
\ No newline at end of file
+    df = asyncio.run(translate_dataset_streaming(input_file, output_file, concurrency=16, requests_per_second=5.0))
\ No newline at end of file
@@ -1,25 +1,37 @@
 from dotenv import load_dotenv
-import os
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
+import resources
+import tracing
+from llm_cache import cached_completion
+from rate_limiter import call_with_retries
+from packed import classify_packed
 
 # Load environment variables
 load_dotenv()
 
-# Initialize clients
-client = OpenAI(
-    base_url="https://api.openrouter.ai/v1",  
-    api_key=os.getenv("OPENROUTER_API_KEY")   
-)
+def get_llm():
+    """The shared gpt-4o chat model, created on first use"""
+    return resources.chat_model("gpt-4o")
 
-# Initialize the language model
-llm = ChatOpenAI(client=client, model="gpt-4o")  # Ensure the client is passed correctly
+# `llm` and `client` stay available as module attributes but are only built when first used
+__getattr__ = resources.lazy_attributes(__name__, llm=get_llm, client=resources.openrouter_client)
 
 # Define the prompt template for zero-shot classification
 prompt = ChatPromptTemplate.from_template("""
 Task: Read the tweet and determine whether it expresses a stance in FAVOR of or AGAINST the specified target entity.
 Target Entity: {entity}
 Tweet: {tweet}
+Finish your answer with a final line `Stance: FAVOR` or `Stance: AGAINST`.
+""")
+
+# Prompt template that classifies several numbered tweets in one request
+packed_prompt = ChatPromptTemplate.from_template("""
+Task: Read each numbered tweet and determine whether it expresses a stance in FAVOR of or AGAINST the specified target entity.
+Target Entity: {entity}
+Return one prediction per tweet, using the tweet's number as its id and FAVOR or AGAINST as its stance.
+
+Tweets:
+{tweets}
 """)
 
 def classify_stance(tweet, entity="Awami League"):
@@ -33,13 +45,42 @@ def classify_stance(tweet, entity="Awami League"):
     Returns:
     str: The stance expressed in the tweet (FAVOR or AGAINST)
     """
-    # Invoke the language model with the prompt
-    result = prompt | llm.invoke({"entity": entity, "tweet": tweet})
+    # Render the prompt and reuse a cached completion for identical requests
+    messages = prompt.format_messages(entity=entity, tweet=tweet)
+
+    llm = get_llm()
+
+    def request():
+        message = call_with_retries(lambda: llm.invoke(messages))
+        tracing.add_usage(message)
+        return message.content
+
+    with tracing.span("llm.classify", strategy="zero_shot"):
+        result = cached_completion(
+            llm.model_name,
+            messages,
+            {"temperature": llm.temperature},
+            request
+        )
     
     # Extract and return the stance from the result
     stance = result.strip()  # Assuming the model returns a simple stance
     return stance
 
+def classify_stance_packed(tweets, entity="Awami League", pack_size=10):
+    """
+    Classify many tweets with `pack_size` tweets per request.
+    
+    Parameters:
+    tweets (list): The tweet texts to analyze
+    entity (str): The target entity to determine stance towards
+    pack_size (int): Tweets per request
+    
+    Returns:
+    list: FAVOR, AGAINST or None (no valid answer) per tweet
+    """
+    return classify_packed(tweets, packed_prompt, get_llm(), pack_size=pack_size, entity=entity)
+
 # Example usage
 if __name__ == "__main__":
     tweet = "I think Awami League is doing a great job!"